@@ -0,0 +1,660 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from schema import SUBJECTS, SCORE_SCALE, SCORE_MAX_CODE, SCORE_MISSING, decode_column, encode_column, encode_value
+from store import normalize_key
+
+PASS_SCORE = 5
+
+
+def score_value(value):
+    """
+    Điểm dạng float, None nếu bỏ trống hoặc không hợp lệ
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def numeric_frame(frame, columns):
+    """
+    Các cột điểm/năm dạng float64 (giải mã từ schema gọn), giá trị thiếu thành NaN
+    """
+    return pd.DataFrame({col: decode_column(col, frame[col]).astype('float64') for col in columns},
+                        index=frame.index)
+
+
+def change_frames(changes):
+    """
+    Gom list các (old, new) của nhiều lần ghi thành hai bảng: các dòng cũ và các dòng mới
+    """
+    old_rows = [old for old, _ in changes if old is not None]
+    new_rows = [new for _, new in changes if new is not None]
+    return pd.DataFrame(old_rows), pd.DataFrame(new_rows)
+
+
+def year_value(row):
+    year = normalize_key(row.get('Year'))
+    return year if isinstance(year, int) else None
+
+
+def copy_state(value):
+    """
+    Bản sao sâu của trạng thái thống kê (dict/list lồng nhau chứa số hoặc mảng numpy)
+    """
+    if isinstance(value, dict):
+        return {key: copy_state(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_state(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    return value
+
+
+class CopyOnWrite:
+    """
+    Trạng thái (các thuộc tính trong STATE) dùng chung với bản chỉ đọc tạo bởi snapshot(),
+    để ảnh chụp của store đọc thống kê không cần lock. Thao tác ghi gọi _own() trước khi
+    sửa tại chỗ: trạng thái đang được một bản chỉ đọc dùng thì được sao chép trước.
+    """
+
+    STATE = ()
+    _shared = False
+
+    def snapshot(self):
+        view = type(self)()
+        for name in self.STATE:
+            setattr(view, name, getattr(self, name))
+        self._shared = True
+        return view
+
+    def _own(self):
+        if self._shared:
+            for name in self.STATE:
+                setattr(self, name, copy_state(getattr(self, name)))
+            self._shared = False
+
+
+class YearSubjectStats(CopyOnWrite):
+    """
+    Thống kê theo (Year, môn): số lượng, tổng, tổng bình phương, số đậu, số rớt.
+    Tổng được tính trên mã điểm nguyên (điểm * 20) như ProvinceCube nên cộng/trừ luôn chính xác.
+    """
+
+    STATE = ('stats',)
+
+    FIELDS = ['count', 'sum', 'sumsq', 'pass', 'fail']
+
+    def __init__(self):
+        self.stats = {}
+
+    def rebuild(self, frame):
+        self.stats = {}
+        self._shared = False
+        self._accumulate(frame, 1)
+
+    def _accumulate(self, frame, sign):
+        self._own()
+        if frame.empty or 'Year' not in frame.columns:
+            return
+        years = numeric_frame(frame, ['Year'])['Year'].values
+        valid = ~np.isnan(years)
+        years = years[valid].astype('int64')
+        pass_code = PASS_SCORE * SCORE_SCALE
+        for subject in SUBJECTS:
+            if subject not in frame.columns:
+                continue
+            codes = encode_column(subject, frame[subject].values)[valid].astype('int64')
+            has_score = codes != SCORE_MISSING
+            for year in np.unique(years[has_score]):
+                c = codes[has_score & (years == year)]
+                passed = int(np.count_nonzero(c >= pass_code))
+                totals = [len(c), int(c.sum()), int((c * c).sum()), passed, len(c) - passed]
+                entry = self.stats.setdefault(int(year), {}).setdefault(subject, [0] * len(self.FIELDS))
+                for k, total in enumerate(totals):
+                    entry[k] += sign * total
+
+    def _add(self, row, sign):
+        self._own()
+        year = year_value(row)
+        if year is None:
+            return
+        year_stats = self.stats.setdefault(year, {})
+        for subject in SUBJECTS:
+            value = score_value(row.get(subject))
+            if value is None:
+                continue
+            code = encode_value(subject, value)
+            entry = year_stats.setdefault(subject, [0] * len(self.FIELDS))
+            entry[0] += sign
+            entry[1] += sign * code
+            entry[2] += sign * code * code
+            if code >= PASS_SCORE * SCORE_SCALE:
+                entry[3] += sign
+            else:
+                entry[4] += sign
+
+    def apply(self, old, new):
+        if old is not None:
+            self._add(old, -1)
+        if new is not None:
+            self._add(new, 1)
+
+    def apply_many(self, changes):
+        old_frame, new_frame = change_frames(changes)
+        self._accumulate(old_frame, -1)
+        self._accumulate(new_frame, 1)
+
+    def extend(self, frame):
+        self._accumulate(frame, 1)
+
+    def years(self):
+        # list(...) chụp dict trong một bước để đọc được khi luồng ghi thêm năm mới
+        return sorted(year for year, subjects in list(self.stats.items())
+                      if any(entry[0] > 0 for entry in list(subjects.values())))
+
+    def get(self, year, subject, field):
+        entry = self.stats.get(year, {}).get(subject)
+        if entry is None:
+            return 0
+        return entry[self.FIELDS.index(field)]
+
+    def mean(self, year, subject):
+        count = self.get(year, subject, 'count')
+        if count <= 0:
+            return None
+        return self.get(year, subject, 'sum') / count / SCORE_SCALE
+
+    def std(self, year, subject):
+        count = self.get(year, subject, 'count')
+        if count <= 1:
+            return None
+        total = self.get(year, subject, 'sum')
+        # Phương sai tính trên số nguyên rồi mới chia, tránh sai số khi trừ hai số lớn
+        variance = (count * self.get(year, subject, 'sumsq') - total * total) / (count * (count - 1))
+        return float(np.sqrt(max(variance, 0.0))) / SCORE_SCALE
+
+
+KHOI_HOC = {
+    'A': ['Toan', 'Ly', 'Hoa'],
+    'B': ['Toan', 'Hoa', 'Sinh'],
+    'C': ['Van', 'Lich su', 'Dia ly'],
+    'D': ['Toan', 'Van', 'Ngoai ngu']
+}
+
+# Lưới histogram cố định 0.25 điểm: ô k chứa [k/4, (k+1)/4), ô cuối chứa điểm 10
+GRID_STEP = 0.25
+GRID_SIZE = int(10 / GRID_STEP) + 1
+
+
+def grid_index(values):
+    """
+    Vị trí ô lưới 0.25 của mảng điểm (giá trị ngoài [0, 10] bị cắt về biên)
+    """
+    return np.clip(np.floor(np.asarray(values, dtype='float64') / GRID_STEP + 1e-9), 0, GRID_SIZE - 1).astype('int64')
+
+
+def coarse_counts(counts, width, low=0.0, high=10.0):
+    """
+    Gộp các ô lưới 0.25 thành các khoảng rộng `width` trên [low, high].
+    Trả về (biên các khoảng, số lượng); khi high = 10 khoảng cuối gồm cả điểm 10.
+    """
+    step = int(round(width / GRID_STEP))
+    start, stop = int(round(low / GRID_STEP)), int(round(high / GRID_STEP))
+    if step <= 0 or abs(step * GRID_STEP - width) > 1e-9 or (stop - start) % step:
+        raise ValueError('Độ rộng khoảng phải là bội của 0.25 và chia hết khoảng điểm')
+    if not 0 <= start < stop <= GRID_SIZE - 1:
+        raise ValueError('Khoảng điểm phải nằm trong [0, 10]')
+    fine = counts[start:stop].copy()
+    if stop == GRID_SIZE - 1:
+        fine[-1] += counts[stop]
+    edges = [(start + i * step) * GRID_STEP for i in range((stop - start) // step + 1)]
+    return edges, fine.reshape(-1, step).sum(axis=1)
+
+
+def density_grid(x_codes, y_codes, width=0.25):
+    """
+    Đếm số cặp điểm (x, y) theo lưới ô vuông cạnh `width` từ hai cột mã điểm uint8.
+    Trả về (các mép dưới của ô, ma trận đếm [ô x, ô y]); ô cuối gồm cả điểm 10.
+    """
+    step = int(round(width * SCORE_SCALE))
+    if step <= 0 or abs(step / SCORE_SCALE - width) > 1e-9 or SCORE_MAX_CODE % step:
+        raise ValueError('Độ rộng ô phải là bội của 0.05 và chia hết 10')
+    x_codes, y_codes = np.asarray(x_codes), np.asarray(y_codes)
+    both = (x_codes != SCORE_MISSING) & (y_codes != SCORE_MISSING)
+    bins = SCORE_MAX_CODE // step
+    x_bin = np.minimum(x_codes[both] // step, bins - 1).astype('int64')
+    y_bin = np.minimum(y_codes[both] // step, bins - 1).astype('int64')
+    counts = np.bincount(x_bin * bins + y_bin, minlength=bins * bins).reshape(bins, bins)
+    return [i * step / SCORE_SCALE for i in range(bins)], counts
+
+
+class ScoreHistograms(CopyOnWrite):
+    """
+    Histogram theo lưới 0.25 cho từng (Year, môn) và (Year, khối).
+    Khóa khối có dạng 'Khối A'; điểm khối là trung bình các môn có điểm.
+    """
+
+    STATE = ('counts',)
+
+    def __init__(self):
+        self.counts = {}
+
+    def _keys(self):
+        return [(subject, [subject]) for subject in SUBJECTS] + \
+               [(f'Khối {khoi}', subjects) for khoi, subjects in KHOI_HOC.items()]
+
+    def rebuild(self, frame):
+        self.counts = {}
+        self._shared = False
+        self._accumulate(frame, 1)
+
+    def _accumulate(self, frame, sign):
+        self._own()
+        if frame.empty or 'Year' not in frame.columns:
+            return
+        years = numeric_frame(frame, ['Year'])['Year'].values
+        valid = ~np.isnan(years)
+        years = years[valid].astype('int64')
+        unique_years = np.unique(years)
+        subjects = [s for s in SUBJECTS if s in frame.columns]
+        scores = numeric_frame(frame, subjects)[valid]
+        for key, columns in self._keys():
+            if not all(c in scores.columns for c in columns):
+                continue
+            values = scores[columns].to_numpy()
+            present = (~np.isnan(values)).sum(axis=1)
+            has_score = present > 0
+            values = np.nansum(values[has_score], axis=1) / present[has_score]
+            index = grid_index(values)
+            for year in unique_years:
+                in_year = years[has_score] == year
+                counts = self.counts.setdefault((int(year), key), np.zeros(GRID_SIZE, dtype='int64'))
+                counts += sign * np.bincount(index[in_year], minlength=GRID_SIZE)
+
+    def _add(self, row, sign):
+        self._own()
+        year = year_value(row)
+        if year is None:
+            return
+        for key, columns in self._keys():
+            values = [score_value(row.get(c)) for c in columns]
+            values = [v for v in values if v is not None]
+            if not values:
+                continue
+            counts = self.counts.setdefault((year, key), np.zeros(GRID_SIZE, dtype='int64'))
+            counts[grid_index(sum(values) / len(values))] += sign
+
+    def apply(self, old, new):
+        if old is not None:
+            self._add(old, -1)
+        if new is not None:
+            self._add(new, 1)
+
+    def apply_many(self, changes):
+        old_frame, new_frame = change_frames(changes)
+        self._accumulate(old_frame, -1)
+        self._accumulate(new_frame, 1)
+
+    def extend(self, frame):
+        self._accumulate(frame, 1)
+
+    def get(self, key, year=None):
+        """
+        Mảng đếm theo lưới 0.25 của một môn/khối, cộng dồn mọi năm nếu year là None
+        """
+        total = np.zeros(GRID_SIZE, dtype='int64')
+        for (y, k), counts in list(self.counts.items()):
+            if k == key and (year is None or y == year):
+                total += counts
+        return total
+
+
+class PairwiseMoments(CopyOnWrite):
+    """
+    Thống kê đủ theo từng cặp cột cho mỗi Year: số dòng có cả hai giá trị, tổng,
+    tổng bình phương và tổng tích chéo. Giá trị được lưu dạng mã nguyên của schema
+    gọn (điểm * 20, Year, MaTinh) nên mọi tổng đều chính xác và hệ số tương quan
+    (bất biến theo tỉ lệ) khớp corr() của pandas trên các cặp không thiếu.
+    """
+
+    STATE = ('moments',)
+
+    COLUMNS = SUBJECTS + ['Year', 'MaTinh']
+
+    def __init__(self):
+        self.moments = {}
+
+    def _empty(self):
+        k = len(self.COLUMNS)
+        return {name: np.zeros((k, k), dtype='int64') for name in ('n', 'sx', 'sxx', 'sxy')}
+
+    def rebuild(self, frame):
+        self.moments = {}
+        self._shared = False
+        self._accumulate(frame, 1)
+
+    def _accumulate(self, frame, sign):
+        self._own()
+        if frame.empty or 'Year' not in frame.columns:
+            return
+        years = numeric_frame(frame, ['Year'])['Year'].values
+        codes, present = [], []
+        for col in self.COLUMNS:
+            if col in frame.columns:
+                values = np.asarray(frame[col].values)
+                missing = np.isnan(decode_column(col, values).astype('float64'))
+                values = encode_column(col, values).astype('float64')
+            else:
+                values = np.zeros(len(frame))
+                missing = np.ones(len(frame), dtype=bool)
+            values[missing] = 0
+            codes.append(values)
+            present.append((~missing).astype('float64'))
+        codes, present = np.column_stack(codes), np.column_stack(present)
+        for year in np.unique(years[~np.isnan(years)]):
+            in_year = years == year
+            x, m = codes[in_year], present[in_year]
+            # Tích ma trận trên float64 vẫn chính xác vì các tổng nhỏ hơn 2^53
+            moments = self.moments.setdefault(int(year), self._empty())
+            moments['n'] += sign * np.rint(m.T @ m).astype('int64')
+            moments['sx'] += sign * np.rint(x.T @ m).astype('int64')
+            moments['sxx'] += sign * np.rint((x * x).T @ m).astype('int64')
+            moments['sxy'] += sign * np.rint(x.T @ x).astype('int64')
+
+    def _add(self, row, sign):
+        self._own()
+        year = year_value(row)
+        if year is None:
+            return
+        codes = np.zeros(len(self.COLUMNS), dtype='int64')
+        present = np.zeros(len(self.COLUMNS), dtype='int64')
+        for i, col in enumerate(self.COLUMNS):
+            value = score_value(row.get(col))
+            if value is not None:
+                codes[i] = encode_value(col, value)
+                present[i] = 1
+        moments = self.moments.setdefault(year, self._empty())
+        moments['n'] += sign * np.outer(present, present)
+        moments['sx'] += sign * np.outer(codes, present)
+        moments['sxx'] += sign * np.outer(codes * codes, present)
+        moments['sxy'] += sign * np.outer(codes, codes)
+
+    def apply(self, old, new):
+        if old is not None:
+            self._add(old, -1)
+        if new is not None:
+            self._add(new, 1)
+
+    def apply_many(self, changes):
+        old_frame, new_frame = change_frames(changes)
+        self._accumulate(old_frame, -1)
+        self._accumulate(new_frame, 1)
+
+    def extend(self, frame):
+        self._accumulate(frame, 1)
+
+    def corr(self, year, columns):
+        """
+        Ma trận tương quan Pearson (NaN khi không đủ dữ liệu) giữa các cột trong năm
+        """
+        result = np.full((len(columns), len(columns)), np.nan)
+        moments = self.moments.get(year)
+        if moments is None:
+            return result
+        index = [self.COLUMNS.index(col) for col in columns]
+        n, sx, sxx, sxy = (moments[name][np.ix_(index, index)].tolist()
+                           for name in ('n', 'sx', 'sxx', 'sxy'))
+        for i in range(len(columns)):
+            for j in range(len(columns)):
+                # Tính bằng số nguyên Python để không bị tràn hay sai số trước phép chia cuối
+                count = n[i][j]
+                cov = count * sxy[i][j] - sx[i][j] * sx[j][i]
+                var_x = count * sxx[i][j] - sx[i][j] ** 2
+                var_y = count * sxx[j][i] - sx[j][i] ** 2
+                if count > 1 and var_x > 0 and var_y > 0:
+                    result[i, j] = max(-1.0, min(1.0, cov / math.sqrt(var_x * var_y)))
+        return result
+
+
+class ScoreRanks(CopyOnWrite):
+    """
+    Số thí sinh theo từng mức điểm chính xác (mã điểm, bước 0.05) cho mỗi (Year, môn) và
+    (Year, 'Khối X'); điểm khối là tổng ba môn, chỉ tính thí sinh có đủ ba môn.
+    Thứ hạng và percentile tra trên mảng cộng dồn (tính lại sau khi có ghi), O(1) mỗi lượt.
+    """
+
+    STATE = ('counts',)
+
+    def __init__(self):
+        self.counts = {}
+        self._cumulative = {}
+
+    def _keys(self):
+        return [(subject, [subject]) for subject in SUBJECTS] + \
+               [(f'Khối {khoi}', subjects) for khoi, subjects in KHOI_HOC.items()]
+
+    def rebuild(self, frame):
+        self.counts = {}
+        self._shared = False
+        self._accumulate(frame, 1)
+
+    def _accumulate(self, frame, sign):
+        self._own()
+        self._cumulative = {}
+        if frame.empty or 'Year' not in frame.columns:
+            return
+        years = numeric_frame(frame, ['Year'])['Year'].values
+        valid = ~np.isnan(years)
+        years = years[valid].astype('int64')
+        unique_years = np.unique(years)
+        codes = {s: encode_column(s, frame[s].values)[valid].astype('int64') for s in SUBJECTS if s in frame.columns}
+        for key, columns in self._keys():
+            if not all(c in codes for c in columns):
+                continue
+            present = np.all([codes[c] != SCORE_MISSING for c in columns], axis=0)
+            values = np.sum([codes[c] for c in columns], axis=0)[present]
+            size = SCORE_MAX_CODE * len(columns) + 1
+            for year in unique_years:
+                counts = self.counts.setdefault((int(year), key), np.zeros(size, dtype='int64'))
+                counts += sign * np.bincount(values[years[present] == year], minlength=size)
+
+    def score_code(self, row, key):
+        """
+        Mã điểm (tổng mã với khối) của một dòng, None nếu không có
+        """
+        columns = KHOI_HOC[key[len('Khối '):]] if key.startswith('Khối ') else [key]
+        values = [score_value(row.get(c)) for c in columns]
+        if any(v is None for v in values):
+            return None
+        return sum(encode_value(c, v) for c, v in zip(columns, values))
+
+    def _add(self, row, sign):
+        self._own()
+        year = year_value(row)
+        if year is None:
+            return
+        for key, columns in self._keys():
+            code = self.score_code(row, key)
+            if code is None:
+                continue
+            counts = self.counts.setdefault((year, key), np.zeros(SCORE_MAX_CODE * len(columns) + 1, dtype='int64'))
+            counts[code] += sign
+            self._cumulative.pop((year, key), None)
+
+    def apply(self, old, new):
+        if old is not None:
+            self._add(old, -1)
+        if new is not None:
+            self._add(new, 1)
+
+    def apply_many(self, changes):
+        old_frame, new_frame = change_frames(changes)
+        self._accumulate(old_frame, -1)
+        self._accumulate(new_frame, 1)
+
+    def extend(self, frame):
+        self._accumulate(frame, 1)
+
+    def rank(self, year, key, code):
+        """
+        Thứ hạng (1 + số thí sinh điểm cao hơn), tổng số thí sinh và percentile
+        (tỉ lệ điểm thấp hơn cộng một nửa số bằng điểm) của mức điểm code
+        """
+        counts = self.counts.get((year, key))
+        if counts is None:
+            return None
+        cumulative = self._cumulative.get((year, key))
+        if cumulative is None:
+            cumulative = np.concatenate([[0], np.cumsum(counts)])
+            self._cumulative[(year, key)] = cumulative
+        total = int(cumulative[-1])
+        if total <= 0:
+            return None
+        below, equal = int(cumulative[code]), int(counts[code])
+        return {
+            'rank': total - below - equal + 1,
+            'total': total,
+            'percentile': round((below + 0.5 * equal) / total * 100, 2)
+        }
+
+    def student_ranks(self, row):
+        """
+        Điểm, thứ hạng và percentile của một dòng theo từng môn và khối trong năm của dòng đó
+        """
+        year = year_value(row)
+        result = {}
+        for key, _ in self._keys():
+            code = self.score_code(row, key)
+            ranking = None if year is None or code is None else self.rank(year, key, code)
+            if ranking is not None:
+                result[key] = dict(ranking, score=code / SCORE_SCALE)
+        return result
+
+
+# MaTinh lưu dạng uint8 (0 = không có) nên trục tỉnh của cube có 256 ô
+PROVINCE_SIZE = 256
+
+
+class ProvinceCube(CopyOnWrite):
+    """
+    Khối thống kê Year × MaTinh × môn: số lượng, tổng, tổng bình phương, số đậu và
+    histogram lưới 0.25. Tổng được lưu theo mã điểm nguyên (điểm * 20) nên việc cộng/trừ
+    khi ghi luôn chính xác. Mỗi năm là các mảng numpy [MaTinh, môn] ('hist': [MaTinh, môn, ô]).
+    """
+
+    STATE = ('cube',)
+
+    FIELDS = ['count', 'sum', 'sumsq', 'pass']
+
+    def __init__(self):
+        self.cube = {}
+
+    def _empty(self):
+        cube = {field: np.zeros((PROVINCE_SIZE, len(SUBJECTS)), dtype='int64') for field in self.FIELDS}
+        cube['hist'] = np.zeros((PROVINCE_SIZE, len(SUBJECTS), GRID_SIZE), dtype='int64')
+        return cube
+
+    def rebuild(self, frame):
+        self.cube = {}
+        self._shared = False
+        self._accumulate(frame, 1)
+
+    def _accumulate(self, frame, sign):
+        self._own()
+        if frame.empty or 'Year' not in frame.columns:
+            return
+        years = numeric_frame(frame, ['Year'])['Year'].values
+        valid = ~np.isnan(years)
+        years = years[valid].astype('int64')
+        if 'MaTinh' in frame.columns:
+            provinces = encode_column('MaTinh', frame['MaTinh'].values)[valid].astype('int64')
+        else:
+            provinces = np.zeros(len(years), dtype='int64')
+        grid_codes = int(round(GRID_STEP * SCORE_SCALE))
+        for j, subject in enumerate(SUBJECTS):
+            if subject not in frame.columns:
+                continue
+            codes = encode_column(subject, frame[subject].values)[valid].astype('int64')
+            has_score = codes != SCORE_MISSING
+            for year in np.unique(years[has_score]):
+                rows = has_score & (years == year)
+                p, c = provinces[rows], codes[rows]
+                cube = self.cube.setdefault(int(year), self._empty())
+                cube['count'][:, j] += sign * np.bincount(p, minlength=PROVINCE_SIZE)
+                # Trọng số float64 vẫn chính xác vì các tổng nhỏ hơn 2^53
+                cube['sum'][:, j] += sign * np.rint(np.bincount(p, weights=c, minlength=PROVINCE_SIZE)).astype('int64')
+                cube['sumsq'][:, j] += sign * np.rint(np.bincount(p, weights=c * c, minlength=PROVINCE_SIZE)).astype('int64')
+                cube['pass'][:, j] += sign * np.bincount(p[c >= PASS_SCORE * SCORE_SCALE], minlength=PROVINCE_SIZE)
+                cube['hist'][:, j, :] += sign * np.bincount(p * GRID_SIZE + c // grid_codes,
+                                                            minlength=PROVINCE_SIZE * GRID_SIZE).reshape(PROVINCE_SIZE, GRID_SIZE)
+
+    def _add(self, row, sign):
+        self._own()
+        year = year_value(row)
+        if year is None:
+            return
+        province = score_value(row.get('MaTinh'))
+        province = 0 if province is None else int(province)
+        for j, subject in enumerate(SUBJECTS):
+            value = score_value(row.get(subject))
+            if value is None:
+                continue
+            code = encode_value(subject, value)
+            cube = self.cube.setdefault(year, self._empty())
+            cube['count'][province, j] += sign
+            cube['sum'][province, j] += sign * code
+            cube['sumsq'][province, j] += sign * code * code
+            cube['pass'][province, j] += sign * (code >= PASS_SCORE * SCORE_SCALE)
+            cube['hist'][province, j, code // int(round(GRID_STEP * SCORE_SCALE))] += sign
+
+    def apply(self, old, new):
+        if old is not None:
+            self._add(old, -1)
+        if new is not None:
+            self._add(new, 1)
+
+    def apply_many(self, changes):
+        old_frame, new_frame = change_frames(changes)
+        self._accumulate(old_frame, -1)
+        self._accumulate(new_frame, 1)
+
+    def extend(self, frame):
+        self._accumulate(frame, 1)
+
+    def years(self):
+        return sorted(year for year, cube in list(self.cube.items()) if cube['count'].any())
+
+    def rollup(self, years=None):
+        """
+        Cộng dồn cube theo các năm (mọi năm nếu years là None): dict trường -> mảng [MaTinh, môn]
+        """
+        total = self._empty()
+        for year, cube in list(self.cube.items()):
+            if years is None or year in years:
+                for field, values in cube.items():
+                    total[field] += values
+        return total
+
+    @staticmethod
+    def summary(count, total, sumsq, passed):
+        """
+        Số lượng, điểm trung bình, độ lệch chuẩn và tỉ lệ đậu từ các tổng theo mã điểm
+        """
+        count, total, sumsq, passed = int(count), int(total), int(sumsq), int(passed)
+        if count <= 0:
+            return {'count': 0, 'mean': None, 'std': None, 'pass_rate': None}
+        std = None
+        if count > 1:
+            variance = (sumsq - total * total / count) / (count - 1)
+            std = round(float(np.sqrt(max(variance, 0.0))) / SCORE_SCALE, 4)
+        return {
+            'count': count,
+            'mean': round(total / count / SCORE_SCALE, 4),
+            'std': std,
+            'pass_rate': round(passed / count * 100, 2)
+        }
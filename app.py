@@ -1,124 +1,513 @@
-from flask import Flask, request, jsonify, send_file
+import time
+_import_started = time.perf_counter()
+
+from flask import Flask, request, jsonify, send_file, make_response, Response, stream_with_context, g
 import pandas as pd
 from datetime import datetime, timedelta
 import os
+import hashlib
+import atexit
+import threading
+import tempfile
+import functools
+import multiprocessing
+import zlib
 from flask_cors import CORS
-import requests
-from io import StringIO
 import numpy as np
-from sklearn.preprocessing import StandardScaler
-import seaborn as sns
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import io
-import base64
+from schema import SUBJECTS, SUBJECT_LABELS, SCORE_SCALE, SCORE_MISSING, coerce_column, coerce_frame, decode_frame, decode_column, format_column
+from store import StudentStore, normalize_key
+from query import StudentQueryIndex, SORT_COLUMNS, score_range
+from shared import SharedData, CoordinatorUnavailable, PUBLISH
+from cache import ResponseCache
+from chart import ChartRenderer, FIGURES, IMAGE_FORMATS
+from metrics import (Metrics, RequestProfiler, CountedBody, LATENCY_BUCKETS, SIZE_BUCKETS, resident_memory_bytes,
+                     peak_resident_memory_bytes)
+from snapshot import save_snapshot, load_snapshot, read_manifest, write_csv_column_cache, update_manifest, map_column_cache
+from history import OperationJournal, HistoryIndex, read_legacy_history
+from aggregates import (PROVINCE_SIZE, YearSubjectStats, ScoreHistograms, PairwiseMoments, ScoreRanks, ProvinceCube, KHOI_HOC,
+                        coarse_counts, density_grid)
 
 app = Flask(__name__)
 CORS(app, resources={
-    r"/students/*": {"origins": "*", "methods": ["GET", "POST", "DELETE", "PUT", "OPTIONS"]},
+    r"/students/*": {"origins": "*", "methods": ["GET", "POST", "DELETE", "PUT", "OPTIONS"],
+                     "expose_headers": ["X-Next-Cursor"]},
     r"/save": {"origins": "*", "methods": ["POST", "OPTIONS"]},
-    r"/history*": {"origins": "*", "methods": ["GET", "POST", "DELETE", "PUT", "OPTIONS"]},
-    r"/chart/*": {"origins": "*", "methods": ["GET", "OPTIONS"]}
+    r"/history*": {"origins": "*", "methods": ["GET", "POST", "DELETE", "PUT", "OPTIONS"],
+                   "expose_headers": ["X-Next-Cursor", "X-Total-Count"]},
+    r"/chart/*": {"origins": "*", "methods": ["GET", "OPTIONS"]},
+    r"/ranking/*": {"origins": "*", "methods": ["GET", "OPTIONS"]},
+    r"/provinces*": {"origins": "*", "methods": ["GET", "OPTIONS"]},
+    r"/export": {"origins": "*", "methods": ["GET", "OPTIONS"]},
+    r"/report*": {"origins": "*", "methods": ["GET", "OPTIONS"]},
+    r"/ready": {"origins": "*", "methods": ["GET", "OPTIONS"]}
 })
 
 RAW_DATA_API = 'https://andyanh.id.vn/index.php/s/p7XMy828G8NKiZp/download'
 UPDATED_FILE_PATH = 'Updated_Data.csv'
+SNAPSHOT_DIR = 'snapshot'
+RAW_CACHE_DIR = 'raw_data_cache'
+DOWNLOAD_CHUNK_BYTES = 1 << 20
+HISTORY_FILE_PATH = 'operation_history.jsonl'
+LEGACY_HISTORY_FILE_PATH = 'operation_history.csv'
+
+store = StudentStore()
+year_stats = YearSubjectStats()
+store.add_listener(year_stats)
+histograms = ScoreHistograms()
+store.add_listener(histograms)
+pairwise_moments = PairwiseMoments()
+store.add_listener(pairwise_moments)
+score_ranks = ScoreRanks()
+store.add_listener(score_ranks)
+province_cube = ProvinceCube()
+store.add_listener(province_cube)
+student_index = StudentQueryIndex(store)
+data_ready = threading.Event()
+
+# Ngân sách thời gian khởi động (giây), vượt quá sẽ in cảnh báo
+IMPORT_BUDGET_SECONDS = float(os.environ.get('IMPORT_BUDGET_SECONDS', 1.0))
+LOAD_BUDGET_SECONDS = float(os.environ.get('LOAD_BUDGET_SECONDS', 30.0))
+startup_status = {'import_seconds': None, 'load_seconds': None, 'error': None}
+
+BAR_COLORS = ['rgba(54, 162, 235, 0.5)', 'rgba(255, 99, 132, 0.5)', 'rgba(75, 192, 192, 0.5)',
+              'rgba(255, 206, 86, 0.5)', 'rgba(153, 102, 255, 0.5)', 'rgba(255, 159, 64, 0.5)']
+PIE_COLORS = [['rgba(75, 192, 192, 0.5)', 'rgba(255, 99, 132, 0.5)'],
+              ['rgba(54, 162, 235, 0.5)', 'rgba(255, 206, 86, 0.5)'],
+              ['rgba(153, 102, 255, 0.5)', 'rgba(255, 159, 64, 0.5)']]
+# Màu cố định theo môn (biểu đồ đường) và theo khối (biểu đồ vùng) để response cache được
+SUBJECT_COLORS = {
+    'Toan': 'rgb(54, 162, 235)', 'Van': 'rgb(255, 99, 132)', 'Ly': 'rgb(75, 192, 192)',
+    'Hoa': 'rgb(255, 206, 86)', 'Sinh': 'rgb(153, 102, 255)', 'Ngoai ngu': 'rgb(255, 159, 64)',
+    'Lich su': 'rgb(201, 203, 207)', 'Dia ly': 'rgb(46, 139, 87)', 'GDCD': 'rgb(139, 69, 19)'
+}
+KHOI_COLORS = {'A': 'rgba(54, 162, 235, 0.5)', 'B': 'rgba(75, 192, 192, 0.5)',
+               'C': 'rgba(255, 99, 132, 0.5)', 'D': 'rgba(255, 206, 86, 0.5)'}
+
+# Cache response các biểu đồ theo (đường dẫn, tham số, phiên bản dữ liệu), giới hạn theo byte
+CHART_CACHE_BYTES = int(os.environ.get('CHART_CACHE_BYTES', 64 << 20))
+chart_cache = ResponseCache(CHART_CACHE_BYTES)
+
+# Metrics dạng Prometheus cho /metrics (theo từng tiến trình)
+metrics = Metrics()
+request_duration = metrics.histogram('http_request_duration_seconds', 'Thời gian xử lý request theo route',
+                                     LATENCY_BUCKETS, labels=['method', 'route', 'status'])
+response_size = metrics.histogram('http_response_size_bytes', 'Kích thước nội dung response theo route',
+                                  SIZE_BUCKETS, labels=['method', 'route'])
+rows_processed = metrics.counter('rows_processed_total', 'Số dòng đã xử lý theo thao tác', labels=['operation'])
+# PROFILE_SAMPLE_RATE (0..1): tỉ lệ request chạy cProfile, thống kê ghi vào PROFILE_DIR
+profiler = RequestProfiler(float(os.environ.get('PROFILE_SAMPLE_RATE', 0)), os.environ.get('PROFILE_DIR', 'profiles'))
+
+@app.before_request
+def start_request_metrics():
+    # Đăng ký trước các before_request khác để đo cả request bị từ chối (503)
+    g.request_started = time.perf_counter()
+    g.profile = profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    started, profile = g.pop('request_started', None), g.pop('profile', None)
+    if started is None:
+        return response
+    method = request.method
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    status = str(response.status_code)
 
-df = None
-data_loaded = False
+    def finish(size):
+        request_duration.observe(time.perf_counter() - started, method=method, route=route, status=status)
+        response_size.observe(size, method=method, route=route)
+        if profile is not None:
+            profiler.stop(profile, f'{method}-{route}')
 
-operation_history = []
+    if response.is_streamed:
+        # Response dạng luồng: đo khi gửi xong nội dung
+        response.response = CountedBody(response.response, finish)
+    else:
+        finish(response.content_length or 0)
+    return response
+
+operation_history = HistoryIndex()
+journal = OperationJournal(HISTORY_FILE_PATH)
+# Tuần tự hóa ghi nhật ký và chỉ mục lịch sử để thứ tự id giữ nguyên khi chạy nhiều luồng
+history_lock = threading.Lock()
+atexit.register(journal.flush)
 
 def init_history():
     global operation_history
-    history_file = 'operation_history.csv'
-    if os.path.exists(history_file):
-        try:
-            history_df = pd.read_csv(history_file)
-            # Chuyển đổi dữ liệu từ CSV thành list of dictionaries
-            operation_history = []
-            for _, row in history_df.iterrows():
-                record = {
-                    'operation': row['operation'],
-                    'time': row['time']
-                }
-                
-                # Xử lý trường sbd nếu có
-                if not pd.isna(row['sbd']):
-                    record['sbd'] = int(row['sbd'])
-                    
-                # Xử lý trường data nếu có
-                if not pd.isna(row['data']):
-                    try:
-                        # Nếu data là string representation của dict
-                        if row['data'].startswith('{'):
-                            record['data'] = eval(row['data'])
-                        else:
-                            record['data'] = row['data']
-                    except:
-                        record['data'] = row['data']
-                        
-                operation_history.append(record)
-                
-            print("Đã tải lịch sử từ file:", operation_history)
-        except Exception as e:
-            print(f"Lỗi khi đọc file lịch sử: {str(e)}")
-            operation_history = []
-    else:
-        print("Chưa có file lịch sử, tạo mới operation_history")
-        operation_history = []
+    try:
+        if not os.path.exists(HISTORY_FILE_PATH) and os.path.exists(LEGACY_HISTORY_FILE_PATH):
+            # Chuyển lịch sử từ file CSV cũ sang nhật ký mới (chỉ một lần)
+            records = read_legacy_history(LEGACY_HISTORY_FILE_PATH)
+            journal.compact(records)
+            print(f"Đã chuyển {len(records)} mục lịch sử từ {LEGACY_HISTORY_FILE_PATH}")
+        else:
+            records = journal.load()
+            print(f"Đã tải {len(records)} mục lịch sử từ file")
+        operation_history = HistoryIndex(records)
+    except Exception as e:
+        print(f"Lỗi khi đọc file lịch sử: {str(e)}")
+        operation_history = HistoryIndex()
+
+def append_history(record):
+    # Ghi thêm một dòng vào nhật ký (gán id) rồi đưa vào chỉ mục lịch sử
+    with history_lock:
+        journal.append(record)
+        operation_history.append(record)
+
+def remove_history(entry_id):
+    # Xóa mục lịch sử theo id, ghi tombstone vào nhật ký
+    with history_lock:
+        record = operation_history.remove(entry_id)
+        if record is not None:
+            journal.delete(entry_id)
+            if journal.needs_compaction():
+                journal.compact(operation_history.records())
+        return record
+
+def clear_history_records():
+    # Xóa lịch sử trong bộ nhớ và làm rỗng file nhật ký
+    with history_lock:
+        operation_history.clear()
+        journal.clear()
+
+def replay_history_append(record):
+    # Phát lại ở worker (lũy đẳng theo id): chỉ cập nhật chỉ mục, nhật ký do coordinator ghi
+    with history_lock:
+        if record['id'] not in operation_history.entries:
+            operation_history.append(record)
+
+def replay_history_remove(entry_id):
+    with history_lock:
+        operation_history.remove(entry_id)
+
+def replay_history_clear():
+    with history_lock:
+        operation_history.clear()
+
+def export_history():
+    with history_lock:
+        return operation_history.records()
+
+def import_history(records):
+    global operation_history
+    with history_lock:
+        operation_history = HistoryIndex(records)
+
+def save_dataset(fmt=None):
+    """
+    Lưu dữ liệu ra đĩa, trả về file/thư mục đã lưu
+    """
+    if fmt == 'csv':
+        with metrics.span('save.csv'):
+            export_csv(UPDATED_FILE_PATH)
+        return UPDATED_FILE_PATH
+    with metrics.span('save.snapshot'):
+        written = save_snapshot(store, SNAPSHOT_DIR)
+    print(f"Đã ghi {written} khối dữ liệu vào snapshot")
+    # Đẩy nhật ký lịch sử xuống đĩa
+    save_history()
+    return SNAPSHOT_DIR
+
+# Các thao tác ghi: tên -> (hàm thực hiện, hàm phát lại ở worker khi dùng chung dữ liệu)
+WRITE_OPERATIONS = {
+    'insert': (store.insert, store.insert),
+    'update': (store.update, store.update),
+    'delete': (store.delete, store.delete),
+    'apply_batch': (store.apply_batch, store.apply_batch),
+    'append_frame': (store.append_frame, store.append_frame),
+    'history_append': (append_history, replay_history_append),
+    'history_remove': (remove_history, replay_history_remove),
+    'history_clear': (clear_history_records, replay_history_clear),
+    'save': (save_dataset, None),
+}
+
+# SHARED_DATA_DIR: chạy nhiều tiến trình (pre-fork) dùng chung bảng qua memory-map,
+# mọi thao tác ghi đi qua một coordinator (xem shared.py)
+shared = None
+if os.environ.get('SHARED_DATA_DIR'):
+    shared = SharedData(os.environ['SHARED_DATA_DIR'], store, WRITE_OPERATIONS, export_history, import_history,
+                        authkey=os.environ.get('SHARED_AUTHKEY', 'diem-thi').encode(),
+                        state_operations=['history_append', 'history_remove', 'history_clear'])
+
+def data_version():
+    """
+    Phiên bản dữ liệu bảng, tăng sau mỗi thao tác ghi (khi dùng chung dữ liệu thì giống nhau
+    ở mọi tiến trình); lịch sử thao tác không tính
+    """
+    return shared.data_version if shared is not None else store.snapshot().version
+
+def write(name, *args):
+    """
+    Thực hiện một thao tác ghi trong WRITE_OPERATIONS (qua coordinator nếu dùng chung dữ liệu)
+    """
+    if shared is not None:
+        return shared.write(name, *args)
+    return WRITE_OPERATIONS[name][0](*args)
+
+def record_history(record):
+    write('history_append', record)
 
 def fetch_csv_from_api(api_url):
     """
-    Tải dữ liệu từ API và lưu cache
+    Tải dữ liệu từ API và lưu cache dạng cột nhị phân, mở lại bằng memory-map.
+    Khi cache hết hạn, gửi yêu cầu có điều kiện (ETag/Last-Modified): nếu nguồn
+    không đổi chỉ cập nhật thời điểm tải, nếu có dữ liệu mới thì ghi thẳng ra đĩa
+    theo từng khối rồi đọc CSV theo khối.
     """
-    cache_file = 'raw_data_cache.csv'
     cache_timeout = timedelta(hours=24)
+    time_format = "%Y-%m-%d %H:%M:%S"
+    
+    manifest = read_manifest(RAW_CACHE_DIR)
+    if manifest is not None and manifest.get('source') != api_url:
+        manifest = None
+    if manifest is not None:
+        fetched_at = datetime.strptime(manifest['fetched_at'], time_format)
+        if datetime.now() - fetched_at < cache_timeout:
+            print(f"Đang tải dữ liệu từ cache {RAW_CACHE_DIR} ({manifest['rows']} dòng)...")
+            return map_column_cache(RAW_CACHE_DIR)
     
-    if os.path.exists(cache_file):
-        modified_time = datetime.fromtimestamp(os.path.getmtime(cache_file))
+    # Chuyển cache CSV cũ (nếu còn hạn) sang cache cột
+    legacy_cache = 'raw_data_cache.csv'
+    if manifest is None and os.path.exists(legacy_cache):
+        modified_time = datetime.fromtimestamp(os.path.getmtime(legacy_cache))
         if datetime.now() - modified_time < cache_timeout:
-            print(f"Đang tải dữ liệu từ cache {cache_file}...")
-            return pd.read_csv(cache_file)
+            print(f"Đang chuyển cache {legacy_cache} sang {RAW_CACHE_DIR}...")
+            write_csv_column_cache(RAW_CACHE_DIR, legacy_cache, source=api_url,
+                                   checksum=file_checksum(legacy_cache),
+                                   fetched_at=modified_time.strftime(time_format))
+            return map_column_cache(RAW_CACHE_DIR)
+    
+    # requests chỉ cần khi tải lại dữ liệu nên import khi dùng
+    import requests
+    headers = {}
+    if manifest is not None:
+        if manifest.get('etag'):
+            headers['If-None-Match'] = manifest['etag']
+        if manifest.get('last_modified'):
+            headers['If-Modified-Since'] = manifest['last_modified']
     
     print(f"Đang tải dữ liệu từ API {api_url}...")
-    response = requests.get(api_url)
-    if response.status_code == 200:
-        df = pd.read_csv(StringIO(response.text))
-        df.to_csv(cache_file, index=False)
-        return df
-    else:
-        raise Exception(f"Không thể tải dữ liệu: {response.status_code}")
+    fd, download_path = tempfile.mkstemp(prefix=RAW_CACHE_DIR + '.', suffix='.download.tmp', dir='.')
+    os.close(fd)
+    now = datetime.now().strftime(time_format)
+    try:
+        with requests.get(api_url, headers=headers, stream=True, timeout=60) as response:
+            if response.status_code == 304 and manifest is not None:
+                print("Dữ liệu nguồn không thay đổi, dùng lại cache")
+                update_manifest(RAW_CACHE_DIR, fetched_at=now)
+                return map_column_cache(RAW_CACHE_DIR)
+            if response.status_code != 200:
+                raise Exception(f"Không thể tải dữ liệu: {response.status_code}")
+            
+            checksum = hashlib.sha256()
+            with open(download_path, 'wb') as f:
+                for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                    checksum.update(block)
+                    f.write(block)
+            validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')
+            }
+        
+        checksum = checksum.hexdigest()
+        if manifest is not None and manifest.get('checksum') == checksum:
+            print("Nội dung tải về trùng với cache, dùng lại cache")
+            update_manifest(RAW_CACHE_DIR, fetched_at=now, **validators)
+        else:
+            write_csv_column_cache(RAW_CACHE_DIR, download_path, source=api_url,
+                                   checksum=checksum, fetched_at=now, **validators)
+        return map_column_cache(RAW_CACHE_DIR)
+    finally:
+        if os.path.exists(download_path):
+            os.remove(download_path)
+
+def file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
 
 # Thay thế @app.before_first_request bằng hàm init_app
 def init_app():
-    global df, data_loaded
-    if not data_loaded:
-        try:
-            df = fetch_csv_from_api(RAW_DATA_API)
+    if data_ready.is_set():
+        return
+    started = time.perf_counter()
+    try:
+        if shared is not None and not shared.is_coordinator:
+            # Worker: gắn bảng do coordinator công bố thay vì tự tải
+            shared.attach()
+        else:
+            snapshot = load_snapshot(SNAPSHOT_DIR)
+            if snapshot is not None:
+                # Dữ liệu đã lưu bằng /save được ưu tiên hơn dữ liệu gốc
+                print(f"Đang tải dữ liệu từ snapshot {SNAPSHOT_DIR}...")
+                store.load(*snapshot)
+                store.mark_clean()
+            else:
+                store.load(fetch_csv_from_api(RAW_DATA_API))
+            store.start_compactor()
             init_history()
-            data_loaded = True
-            print("Đã tải dữ liệu thành công")
-        except Exception as e:
-            print(f"Lỗi khi tải dữ liệu: {str(e)}")
-            df = pd.DataFrame()
-            data_loaded = True
+            if shared is not None:
+                shared.start()
+        print(f"Đã tải dữ liệu thành công ({len(store)} dòng, {store.memory_per_row():.1f} byte/dòng)")
+    except Exception as e:
+        print(f"Lỗi khi tải dữ liệu: {str(e)}")
+        startup_status['error'] = str(e)
+        store.load(pd.DataFrame())
+    startup_status['load_seconds'] = round(time.perf_counter() - started, 3)
+    if startup_status['load_seconds'] > LOAD_BUDGET_SECONDS:
+        print(f"Cảnh báo: tải dữ liệu mất {startup_status['load_seconds']}s, vượt ngân sách {LOAD_BUDGET_SECONDS}s")
+    data_ready.set()
 
-# Gọi init_app() khi khởi động ứng dụng
-init_app()
+def start_app():
+    """
+    Tải dữ liệu ở luồng nền (mặc định) hoặc đồng bộ khi SYNC_STARTUP=1
+    """
+    if os.environ.get('SYNC_STARTUP') == '1':
+        init_app()
+    else:
+        threading.Thread(target=init_app, name='init_app', daemon=True).start()
 
 @app.before_request
 def load_data():
-    global df, data_loaded
-    if not data_loaded:
-        init_app()
+    # Trong lúc dữ liệu đang tải, các route dữ liệu trả về 503
+    if not data_ready.is_set() and request.method != 'OPTIONS' and request.endpoint not in ('ready', 'metrics'):
+        response = jsonify({'error': 'Dữ liệu đang được tải, vui lòng thử lại sau'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    if shared is not None and data_ready.is_set():
+        # Bắt kịp các thao tác ghi mới của coordinator trước khi xử lý request
+        with metrics.span('shared.sync'):
+            shared.sync()
+
+@app.errorhandler(CoordinatorUnavailable)
+def coordinator_unavailable(e):
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    status = dict(startup_status, ready=data_ready.is_set())
+    if data_ready.is_set():
+        status['rows'] = len(store)
+        status['version'] = store.version
+        status['chart_cache'] = {'entries': len(chart_cache.entries), 'bytes': chart_cache.size,
+                                 'hits': chart_cache.hits, 'misses': chart_cache.misses}
+        if shared is not None:
+            status['shared'] = {'role': shared.role, 'version': shared.version, 'pid': os.getpid()}
+        status['bytes_per_row'] = round(store.memory_per_row(), 2)
+    return jsonify(status), 200 if data_ready.is_set() else 503
+
+def shared_gauge(fn):
+    return lambda: fn() if shared is not None else None
+
+metrics.gauge('data_ready', 'Dữ liệu đã tải xong (1) hay chưa (0)', lambda: int(data_ready.is_set()))
+metrics.gauge('table_rows', 'Số dòng trong bảng điểm', lambda: len(store) if data_ready.is_set() else None)
+metrics.gauge('data_version', 'Phiên bản dữ liệu bảng', lambda: data_version() if data_ready.is_set() else None)
+metrics.gauge('history_entries', 'Số mục lịch sử thao tác', lambda: len(operation_history))
+metrics.gauge('chart_cache_bytes', 'Tổng kích thước các response biểu đồ trong cache', lambda: chart_cache.size)
+metrics.gauge('chart_cache_entries', 'Số response biểu đồ trong cache', lambda: len(chart_cache.entries))
+metrics.gauge('chart_cache_requests', 'Số lần tra cache biểu đồ theo kết quả',
+              lambda: {('hit',): chart_cache.hits, ('miss',): chart_cache.misses}, labels=['result'])
+metrics.gauge('process_resident_memory_bytes', 'Bộ nhớ RSS hiện tại của tiến trình', resident_memory_bytes)
+metrics.gauge('process_peak_resident_memory_bytes', 'Bộ nhớ RSS cao nhất của tiến trình', peak_resident_memory_bytes)
+metrics.gauge('shared_coordinator', 'Tiến trình là coordinator (1) hay worker (0) khi dùng chung dữ liệu',
+              shared_gauge(lambda: int(shared.is_coordinator)))
+metrics.gauge('shared_version', 'Phiên bản thao tác đã áp dụng khi dùng chung dữ liệu', shared_gauge(lambda: shared.version))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Metrics dạng văn bản Prometheus của tiến trình đang xử lý request
+    (khi chạy nhiều worker, mỗi worker có bộ đếm riêng)
+    """
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Chuyển đổi tên trường về format frontend
+STUDENT_FIELD_LABELS = {
+    'Toan': 'Toán',
+    'Van': 'Văn',
+    'Ly': 'Lý', 
+    'Hoa': 'Hóa',
+    'Sinh': 'Sinh',
+    'Ngoai ngu': 'Ngoại ngữ',
+    'Lich su': 'Lịch sử',
+    'Dia ly': 'Địa lý',
+    'GDCD': 'GDCD',
+    'MaTinh': 'MaTinh',
+    'Year': 'Năm',
+    'SBD': 'Số Báo Danh'
+}
+
+def format_student(student):
+    formatted_record = {}
+    for df_field, frontend_field in STUDENT_FIELD_LABELS.items():
+        if df_field in student:
+            value = student[df_field]
+            if pd.isna(value):  # Kiểm tra nếu là NaN
+                formatted_record[frontend_field] = "Không có"
+            else:
+                formatted_record[frontend_field] = value
+    return formatted_record
+
+STUDENT_PAGE_SIZE = 100
+STUDENT_MAX_PAGE_SIZE = 1000
 
-@app.route('/students', methods=['POST', 'GET', 'OPTIONS'])
+def query_int_list(name):
+    # Tham số dạng "2018,2019" -> [2018, 2019]
+    value = request.args.get(name)
+    return [int(v) for v in value.split(',') if v.strip()] if value else None
+
+@app.route('/students', methods=['GET'])
+def query_students():
+    """
+    Tra cứu thí sinh: lọc theo year, matinh (có thể nhiều giá trị, cách nhau dấu phẩy),
+    khoảng điểm <môn>_min/<môn>_max và total_min/total_max (tổng điểm các môn);
+    sort=<môn>|total|SBD, order=asc|desc, limit và cursor (header X-Next-Cursor).
+    Khi sắp xếp theo môn hoặc tổng điểm chỉ gồm thí sinh có điểm ở cột đó.
+    """
+    sort = request.args.get('sort', 'SBD')
+    if sort not in SORT_COLUMNS:
+        return jsonify({'error': f'Cột sắp xếp không hợp lệ: {sort}'}), 400
+    try:
+        years = query_int_list('year')
+        provinces = query_int_list('matinh')
+        ranges = {}
+        for col in SUBJECTS + ['total']:
+            low, high = request.args.get(f'{col}_min'), request.args.get(f'{col}_max')
+            if low is not None or high is not None:
+                ranges[col] = score_range(None if low is None else float(low),
+                                          None if high is None else float(high))
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        limit = min(int(request.args.get('limit', STUDENT_PAGE_SIZE)), STUDENT_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Tham số truy vấn không hợp lệ'}), 400
+    if limit <= 0:
+        return jsonify({'error': 'Tham số truy vấn không hợp lệ'}), 400
+
+    with metrics.span('students.query'):
+        students, next_cursor = student_index.query(
+            years, provinces, ranges, sort, request.args.get('order', 'asc') == 'desc', cursor, limit)
+
+    results = []
+    with metrics.span('students.format'):
+        for student in students:
+            record = format_student(student)
+            if sort == 'total':
+                scores = [student.get(subject) for subject in SUBJECTS]
+                record['Tổng điểm'] = round(sum(v for v in scores if v is not None and not pd.isna(v)), 2)
+            results.append(record)
+    response = jsonify(results)
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+@app.route('/students', methods=['POST', 'OPTIONS'])
 def create_student():
     if request.method == 'OPTIONS':
         return '', 204
-    global df, operation_history
     data = request.get_json()
     
     sbd = data.get('SBD')
@@ -152,15 +541,20 @@ def create_student():
             except ValueError:
                 new_student_data[df_field] = None
     
-    # Kiểm tra dữ liệu đã tồn tại
-    if not df[(df['SBD'] == sbd) & (df['Year'] == year)].empty:
+    # Kiểm tra dữ liệu đã tồn tại (trạng thái hiện tại, không phải ảnh chụp)
+    if store.contains(sbd, year):
         return jsonify({'error': f'SBD {sbd} đã tồn tại trong năm {year}'}), 400
     
-    new_student_df = pd.DataFrame([new_student_data])
-    df = pd.concat([df, new_student_df], ignore_index=True)
+    try:
+        new_student_data = write('insert', new_student_data)
+    except KeyError:
+        # Một yêu cầu khác vừa thêm cùng (SBD, Year) sau lần kiểm tra ở trên
+        return jsonify({'error': f'SBD {sbd} đã tồn tại trong năm {year}'}), 400
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     # Thêm vào lịch sử
-    operation_history.append({
+    record_history({
         'operation': 'CREATE',
         'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         'data': new_student_data
@@ -172,44 +566,23 @@ def create_student():
 def read_student(sbd):
     if request.method == 'OPTIONS':
         return '', 204
-    global operation_history
     try:
         sbd = int(sbd)
-        students = df[df['SBD'] == sbd].to_dict('records')
+        # Dòng và thứ hạng đọc trên cùng một ảnh chụp, không chờ các thao tác ghi
+        snapshot = store.snapshot()
+        students = snapshot.find(sbd)
         if not students:
             return jsonify({'error': 'Không tìm thấy thí sinh'}), 404
             
-        # Chuyển đổi tên trường về format frontend
-        field_mapping = {
-            'Toan': 'Toán',
-            'Van': 'Văn',
-            'Ly': 'Lý', 
-            'Hoa': 'Hóa',
-            'Sinh': 'Sinh',
-            'Ngoai ngu': 'Ngoại ngữ',
-            'Lich su': 'Lịch sử',
-            'Dia ly': 'Địa lý',
-            'GDCD': 'GDCD',
-            'MaTinh': 'MaTinh',
-            'Year': 'Năm',
-            'SBD': 'Số Báo Danh'
-        }
-        
-        # Format tất cả các bản ghi tìm được
-        formatted_students = []
-        for student in students:
-            formatted_record = {}
-            for df_field, frontend_field in field_mapping.items():
-                if df_field in student:
-                    value = student[df_field]
-                    if pd.isna(value):  # Kiểm tra nếu là NaN
-                        formatted_record[frontend_field] = "Không có"
-                    else:
-                        formatted_record[frontend_field] = value
-            formatted_students.append(formatted_record)
+        # Format tất cả các bản ghi tìm được theo tên trường frontend
+        formatted_students = [format_student(student) for student in students]
+        if request.args.get('rank') in ('1', 'true'):
+            ranks = snapshot.view(score_ranks)
+            for student, formatted_record in zip(students, formatted_students):
+                formatted_record['Xếp hạng'] = format_ranks(ranks.student_ranks(student))
             
         # Thêm vào lịch sử
-        operation_history.append({
+        record_history({
             'operation': 'READ',
             'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'sbd': sbd
@@ -219,26 +592,89 @@ def read_student(sbd):
     except ValueError:
         return jsonify({'error': 'SBD không hợp lệ'}), 400
 
+def rank_label(key):
+    # 'Toan' -> 'Toán', 'Khối A' giữ nguyên
+    return SUBJECT_LABELS[SUBJECTS.index(key)] if key in SUBJECTS else key
+
+def format_ranks(ranks):
+    return {rank_label(key): ranking for key, ranking in ranks.items()}
+
+@app.route('/ranking/<int:sbd>', methods=['GET'])
+def get_student_ranking(sbd):
+    """
+    Điểm, thứ hạng và percentile theo từng môn và khối trong năm của từng bản ghi của SBD
+    (lọc một năm bằng ?year=)
+    """
+    snapshot = store.snapshot()
+    students = snapshot.find(sbd)
+    if 'year' in request.args:
+        try:
+            year = int(request.args['year'])
+        except ValueError:
+            return jsonify({'error': 'Năm không hợp lệ'}), 400
+        students = [student for student in students if normalize_key(student.get('Year')) == year]
+    if not students:
+        return jsonify({'error': 'Không tìm thấy thí sinh'}), 404
+    ranks = snapshot.view(score_ranks)
+    return jsonify([{
+        'Số Báo Danh': sbd,
+        'Năm': normalize_key(student.get('Year')),
+        'Xếp hạng': format_ranks(ranks.student_ranks(student))
+    } for student in students])
+
+@app.route('/ranking/top', methods=['GET'])
+def get_top_students():
+    """
+    Bảng xếp hạng top N (?limit=, mặc định 10) của một năm (?year=, mặc định năm mới nhất)
+    theo môn (?subject=) hoặc khối (?khoi=A|B|C|D, tổng ba môn)
+    """
+    if 'khoi' in request.args:
+        if request.args['khoi'] not in KHOI_HOC:
+            return jsonify({'error': f'Khối không hợp lệ: {request.args["khoi"]}'}), 400
+        key = f'Khối {request.args["khoi"]}'
+    else:
+        key = request.args.get('subject', 'Toan')
+        if key not in SUBJECTS:
+            return jsonify({'error': f'Môn học không hợp lệ: {key}'}), 400
+    snapshot = store.snapshot()
+    try:
+        years = snapshot.view(year_stats).years()
+        year = int(request.args['year']) if 'year' in request.args else (years[-1] if years else None)
+        limit = min(int(request.args.get('limit', 10)), STUDENT_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Tham số không hợp lệ'}), 400
+    if year is None or limit <= 0:
+        return jsonify([])
+
+    with metrics.span('ranking.top'):
+        students, _ = student_index.query(years=[year], sort=key, descending=True, limit=limit, snapshot=snapshot)
+        ranks = snapshot.view(score_ranks)
+        results = []
+        for student in students:
+            code = ranks.score_code(student, key)
+            record = format_student(student)
+            record['Điểm'] = code / SCORE_SCALE
+            record['Hạng'] = ranks.rank(year, key, code)['rank']
+            results.append(record)
+    return jsonify(results)
+
 @app.route('/students/<sbd>/<year>', methods=['DELETE', 'OPTIONS'])
 def delete_student(sbd, year):
     if request.method == 'OPTIONS':
         return '', 204
-    global df, operation_history
     try:
         sbd = int(sbd)
         year = int(year)
         
-        student_data = df[(df['SBD'] == sbd) & (df['Year'] == year)].to_dict('records')
-        if not student_data:
+        student_data = write('delete', sbd, year)
+        if student_data is None:
             return jsonify({'error': 'Không tìm thấy thí sinh'}), 404
-            
-        df = df[~((df['SBD'] == sbd) & (df['Year'] == year))]
         
         # Thêm vào lịch sử
-        operation_history.append({
+        record_history({
             'operation': 'DELETE',
             'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'data': student_data[0]
+            'data': student_data
         })
         
         return jsonify({'message': f'Đã xóa thí sinh SBD {sbd} năm {year}'})
@@ -261,9 +697,8 @@ def update_student(sbd, year):
         sbd = int(sbd)
         year = int(year)
         
-        # Tìm thí sinh cần cập nhật
-        mask = (df['SBD'] == sbd) & (df['Year'] == year)
-        if df[mask].empty:
+        # Tìm thí sinh cần cập nhật (trạng thái hiện tại, không phải ảnh chụp)
+        if not store.contains(sbd, year):
             return jsonify({'error': 'Không tìm thấy thí sinh'}), 404
             
         # Mapping tên trường từ frontend sang backend
@@ -282,31 +717,40 @@ def update_student(sbd, year):
             'MaTinh': 'MaTinh'
         }
 
-        # Lưu dữ liệu cũ trước khi cập nhật
-        old_data = df[mask].to_dict('records')[0]
-        
-        # Cập nhật từng trường
+        # Kiểm tra và chuyển đổi từng trường trước khi ghi
+        updates = {}
         for frontend_field, value in changes.items():
             if frontend_field in field_mapping:
                 backend_field = field_mapping[frontend_field]
                 # Xử lý các trường điểm số
                 if backend_field not in ['SBD', 'Year', 'MaTinh']:
                     if value is None or value == '' or value == 'Không có':
-                        df.loc[mask, backend_field] = None
+                        updates[backend_field] = None
                     else:
                         try:
-                            df.loc[mask, backend_field] = float(value)
+                            updates[backend_field] = float(value)
                         except ValueError:
                             return jsonify({'error': f'Giá trị không hợp lệ cho trường {frontend_field}'}), 400
                 else:
                     # Xử lý các trường không phải điểm số
                     if value is None or value == '':
-                        df.loc[mask, backend_field] = None
+                        updates[backend_field] = None
                     else:
-                        df.loc[mask, backend_field] = value
+                        updates[backend_field] = normalize_key(value)
+
+        # Cập nhật tại chỗ, lấy lại dữ liệu cũ
+        try:
+            old_data = write('update', sbd, year, updates)
+        except KeyError:
+            return jsonify({'error': 'Số báo danh và năm mới đã tồn tại'}), 400
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if old_data is None:
+            # Bản ghi vừa bị xóa bởi một yêu cầu khác sau lần kiểm tra ở trên
+            return jsonify({'error': 'Không tìm thấy thí sinh'}), 404
 
         # Thêm vào lịch sử
-        operation_history.append({
+        record_history({
             'operation': 'UPDATE',
             'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             'data': {
@@ -321,92 +765,398 @@ def update_student(sbd, year):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+BATCH_MAX_OPERATIONS = 10000
+
+# Tên trường frontend -> tên cột trong bảng
+BATCH_FIELD_MAPPING = {
+    'Số Báo Danh': 'SBD',
+    'Năm': 'Year',
+    'Toán': 'Toan',
+    'Văn': 'Van',
+    'Lý': 'Ly',
+    'Hóa': 'Hoa',
+    'Sinh': 'Sinh',
+    'Ngoại ngữ': 'Ngoai ngu',
+    'Lịch sử': 'Lich su',
+    'Địa lý': 'Dia ly',
+    'GDCD': 'GDCD',
+    'MaTinh': 'MaTinh'
+}
+
+def validate_batch(items):
+    """
+    Kiểm tra toàn bộ lô theo từng cột (vector hóa).
+    Trả về (list các (loại, khóa, dòng) đã chuẩn hóa, list lỗi theo từng mục)
+    """
+    errors = [None] * len(items)
+    kinds = []
+    cells = {}
+    for i, item in enumerate(items):
+        kind = str(item.get('op', '')).lower() if isinstance(item, dict) else ''
+        if kind not in ('create', 'update', 'delete'):
+            errors[i] = 'Thao tác không hợp lệ, phải là create, update hoặc delete'
+        elif not isinstance(item.get('data', {}), dict):
+            errors[i] = 'Trường data phải là object'
+        kinds.append(kind)
+        if errors[i] is not None:
+            continue
+        cells.setdefault('SBD', []).append((i, 'key', item.get('SBD')))
+        cells.setdefault('Year', []).append((i, 'key', item.get('Year')))
+        if kind != 'delete':
+            for field, value in item.get('data', {}).items():
+                if field in BATCH_FIELD_MAPPING:
+                    cells.setdefault(BATCH_FIELD_MAPPING[field], []).append((i, 'data', value))
+
+    keys = [[None, None] for _ in items]
+    rows = [{} for _ in items]
+    for col, entries in cells.items():
+        values, col_errors = coerce_column(col, [value for _, _, value in entries])
+        for (i, part, _), value, error in zip(entries, values.tolist(), col_errors):
+            if error is not None:
+                errors[i] = errors[i] or error
+            elif part == 'key':
+                keys[i][col == 'Year'] = None if np.isnan(value) else int(value)
+            elif col in SUBJECTS:
+                rows[i][col] = None if np.isnan(value) else value
+            else:
+                rows[i][col] = None if np.isnan(value) else int(value)
+
+    operations = []
+    for i, kind in enumerate(kinds):
+        if errors[i] is not None:
+            operations.append(None)
+            continue
+        key = tuple(keys[i])
+        if kind == 'create':
+            # Khóa của dòng mới lấy theo SBD/Year của thao tác
+            rows[i].update(SBD=key[0], Year=key[1])
+        elif kind == 'update' and not rows[i]:
+            errors[i] = 'Không có dữ liệu cập nhật'
+            operations.append(None)
+            continue
+        operations.append((kind, key, rows[i]))
+    return operations, errors
+
+@app.route('/students/batch', methods=['POST', 'OPTIONS'])
+def batch_students():
+    """
+    Thêm/sửa/xóa nhiều thí sinh trong một request. Nhận list (hoặc {"operations": list})
+    các mục {"op": "create"|"update"|"delete", "SBD", "Year", "data": {trường frontend}};
+    trả về kết quả theo từng mục và chỉ ghi một mục lịch sử cho cả lô.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+    payload = request.get_json(silent=True)
+    items = payload.get('operations') if isinstance(payload, dict) else payload
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Dữ liệu phải là danh sách thao tác'}), 400
+    if len(items) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'Tối đa {BATCH_MAX_OPERATIONS} thao tác mỗi lần'}), 413
+
+    operations, errors = validate_batch(items)
+    valid = [i for i, operation in enumerate(operations) if operation is not None]
+    with metrics.span('batch.apply'):
+        outcomes = dict(zip(valid, write('apply_batch', [operations[i] for i in valid])))
+    rows_processed.inc(len(valid), operation='batch')
+
+    results = []
+    applied = {'created': [], 'updated': [], 'deleted': []}
+    for i, operation in enumerate(operations):
+        if operation is None:
+            results.append({'index': i, 'status': 400, 'error': errors[i]})
+            continue
+        kind, (sbd, year), row = operation
+        outcome = outcomes[i]
+        if isinstance(outcome, KeyError):
+            error = f'SBD {sbd} đã tồn tại trong năm {year}' if kind == 'create' else 'Số báo danh và năm mới đã tồn tại'
+            results.append({'index': i, 'status': 400, 'error': error})
+        elif kind == 'create':
+            applied['created'].append(outcome)
+            results.append({'index': i, 'status': 201, 'message': 'Thêm thí sinh thành công'})
+        elif outcome is None:
+            results.append({'index': i, 'status': 404, 'error': 'Không tìm thấy thí sinh'})
+        elif kind == 'update':
+            applied['updated'].append({'old': outcome, 'new': row, 'SBD': sbd, 'Year': year})
+            results.append({'index': i, 'status': 200, 'message': f'Đã cập nhật thí sinh SBD {sbd} năm {year}'})
+        else:
+            applied['deleted'].append(outcome)
+            results.append({'index': i, 'status': 200, 'message': f'Đã xóa thí sinh SBD {sbd} năm {year}'})
+
+    summary = {kind: len(rows) for kind, rows in applied.items()}
+    summary['failed'] = sum(1 for result in results if result['status'] >= 400)
+    if any(applied.values()):
+        # Một mục lịch sử cho cả lô
+        record_history({
+            'operation': 'BATCH',
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'data': dict(applied, summary=summary)
+        })
+    return jsonify(dict(summary, results=results))
+
+IMPORT_CHUNK_ROWS = 200000
+IMPORT_MAX_ERROR_SAMPLES = 20
+
+@app.route('/students/import', methods=['POST', 'OPTIONS'])
+def import_students():
+    """
+    Nhập hàng loạt từ file CSV (nội dung request hoặc trường file 'file' của form).
+    Tiêu đề cột dùng tên frontend (Số Báo Danh, Năm, Toán, ...) hoặc tên cột trong bảng.
+    File được đọc và kiểm tra theo từng khối IMPORT_CHUNK_ROWS dòng rồi nối thẳng vào
+    bảng; dòng lỗi hoặc trùng (SBD, Year) với dữ liệu hiện có bị bỏ qua và được thống kê.
+    Khi dùng chung dữ liệu, bảng được công bố lại một lần sau khi nhập xong.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+    upload = request.files.get('file')
+    stream = upload.stream if upload is not None else request.stream
+    started = time.perf_counter()
+
+    rows = imported = invalid = duplicate = 0
+    error_samples = []
+    ignored_columns = []
+    try:
+        for chunk in pd.read_csv(stream, chunksize=IMPORT_CHUNK_ROWS):
+            if rows == 0:
+                columns = {col: BATCH_FIELD_MAPPING.get(col, col) for col in chunk.columns}
+                ignored_columns = [col for col, name in columns.items()
+                                   if name not in SUBJECTS and name not in ('SBD', 'Year', 'MaTinh')]
+                if not {'SBD', 'Year'} <= set(columns.values()):
+                    return jsonify({'error': 'File CSV phải có cột Số Báo Danh (SBD) và Năm (Year)'}), 400
+            chunk = chunk.rename(columns=columns).drop(columns=ignored_columns)
+            with metrics.span('import.coerce'):
+                frame, errors = coerce_frame(chunk)
+            valid = pd.isna(errors)
+            for i in np.flatnonzero(~valid)[:IMPORT_MAX_ERROR_SAMPLES - len(error_samples)]:
+                # Dòng 1 là tiêu đề
+                error_samples.append({'line': rows + int(i) + 2, 'error': errors[i]})
+            with metrics.span('import.append'):
+                added = write('append_frame', frame[valid])
+            rows += len(chunk)
+            rows_processed.inc(len(chunk), operation='import')
+            invalid += int((~valid).sum())
+            imported += int(added.sum())
+            duplicate += int((~added).sum())
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        return jsonify({'error': f'File CSV không hợp lệ: {e}', 'imported': imported}), 400
+    except pd.errors.EmptyDataError:
+        return jsonify({'error': 'File CSV rỗng'}), 400
+    finally:
+        if shared is not None and imported:
+            with metrics.span('import.publish'):
+                write(PUBLISH)
+
+    seconds = time.perf_counter() - started
+    summary = {
+        'rows': rows,
+        'imported': imported,
+        'rejected': {'invalid': invalid, 'duplicate': duplicate},
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds) if seconds > 0 else None
+    }
+    if imported:
+        record_history({
+            'operation': 'IMPORT',
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'data': summary
+        })
+    return jsonify(dict(summary, errors=error_samples, ignored_columns=ignored_columns)), 201 if imported else 200
+
 @app.route('/save', methods=['POST', 'OPTIONS'])
 def save_data():
+    """
+    Lưu dữ liệu: mặc định là snapshot nhị phân theo cột (chỉ ghi phần thay đổi),
+    ?format=csv để xuất toàn bộ ra file CSV như trước
+    """
     if request.method == 'OPTIONS':
         return '', 204
-    global df, operation_history
     
-    # Lưu file CSV
-    df.to_csv(UPDATED_FILE_PATH, index=False)
+    saved_file = write('save', request.args.get('format'))
     
     # Thêm vào lịch sử
-    operation_history.append({
+    record_history({
         'operation': 'FINISH',
         'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'data': {'file': UPDATED_FILE_PATH}
+        'data': {'file': saved_file}
     })
     
-    # Lưu lịch sử thao tác với hàm mới
-    save_history()
-    
-    return jsonify({
-        'message': 'ã lưu dữ liệu thành công',
-        'download_url': f'/download/{os.path.basename(UPDATED_FILE_PATH)}'
-    })
+    response = {'message': 'Đã lưu dữ liệu thành công'}
+    # Chỉ bản CSV mới tải về được; snapshot là thư mục nội bộ
+    if saved_file == UPDATED_FILE_PATH:
+        response['download_url'] = f'/download/{os.path.basename(UPDATED_FILE_PATH)}'
+    return jsonify(response)
+
+def export_csv(path):
+    # Xuất bảng hiện tại ra CSV (ghi file tạm rồi đổi tên)
+    with open(path + '.tmp', 'wb') as f:
+        for block in export_chunks(store.snapshot().frame, 'csv'):
+            f.write(block)
+    os.replace(path + '.tmp', path)
+
+EXPORT_CHUNK_ROWS = 20000
+# Mức nén thấp: nén dạng luồng cần nhanh hơn là nhỏ nhất
+EXPORT_GZIP_LEVEL = 1
+EXPORT_FORMATS = {'csv': ('text/csv', 'csv'), 'ndjson': ('application/x-ndjson', 'ndjson')}
+
+def export_chunks(frame, fmt, years=None, provinces=None):
+    """
+    Sinh nội dung xuất (bytes) theo từng khối EXPORT_CHUNK_ROWS dòng của bảng gọn:
+    lọc, giải mã và tuần tự hóa từng khối nên bộ nhớ không phụ thuộc kích thước bảng
+    """
+    columns = list(frame.columns)
+    if fmt == 'csv':
+        yield (','.join(columns) + '\n').encode('utf-8')
+    for start in range(0, len(frame), EXPORT_CHUNK_ROWS):
+        chunk = frame.iloc[start:start + EXPORT_CHUNK_ROWS]
+        mask = np.ones(len(chunk), dtype=bool)
+        if years:
+            mask &= np.isin(chunk['Year'].to_numpy(), years)
+        if provinces:
+            mask &= np.isin(chunk['MaTinh'].to_numpy(), provinces)
+        if not mask.any():
+            continue
+        if not mask.all():
+            chunk = chunk[mask]
+        with metrics.span(f'export.{fmt}'):
+            if fmt == 'csv':
+                # Định dạng thẳng từ mã (bảng tra chuỗi) thay vì DataFrame.to_csv trên float
+                texts = [format_column(col, chunk[col].to_numpy()) for col in columns]
+                block = ('\n'.join(map(','.join, zip(*texts))) + '\n').encode('utf-8')
+            else:
+                rows = decode_frame(chunk, columns)
+                lines = rows.to_json(orient='records', lines=True, force_ascii=False)
+                # Tùy phiên bản pandas, dòng cuối có thể chưa có ký tự xuống dòng
+                block = (lines if lines.endswith('\n') else lines + '\n').encode('utf-8')
+        rows_processed.inc(len(chunk), operation='export')
+        yield block
+
+def gzip_chunks(chunks):
+    # Nén gzip dạng luồng từng khối
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for block in chunks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@app.route('/export', methods=['GET', 'OPTIONS'])
+def export_data():
+    """
+    Xuất dữ liệu hiện tại dạng luồng, không qua file trung gian.
+    Tham số: format (csv | ndjson, mặc định csv), year, matinh (danh sách cách nhau bởi dấu phẩy),
+    gzip=1 để nén. Dữ liệu lấy từ một ảnh chụp nên không bị ảnh hưởng bởi các thao tác ghi đồng thời.
+    """
+    if request.method == 'OPTIONS':
+        return '', 204
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Định dạng không hợp lệ: {fmt} (csv hoặc ndjson)'}), 400
+    try:
+        years = query_int_list('year')
+        provinces = query_int_list('matinh')
+    except ValueError:
+        return jsonify({'error': 'Tham số year/matinh không hợp lệ'}), 400
+    frame = store.snapshot().frame
+    if (years and 'Year' not in frame.columns) or (provinces and 'MaTinh' not in frame.columns):
+        frame = frame.iloc[:0]
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    chunks = export_chunks(frame, fmt, years, provinces)
+    filename = f'export.{extension}'
+    if request.args.get('gzip') in ('1', 'true'):
+        chunks, mimetype, filename = gzip_chunks(chunks), 'application/gzip', filename + '.gz'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
 
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
+        # File CSV cập nhật được xuất thẳng dạng luồng từ dữ liệu hiện tại
+        if filename == os.path.basename(UPDATED_FILE_PATH):
+            response = Response(stream_with_context(export_chunks(store.snapshot().frame, 'csv')), mimetype='text/csv')
+            response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+            return response
         return send_file(
-            filename,
+            os.path.abspath(filename),
             as_attachment=True,
             download_name=filename
         )
     except Exception as e:
         return jsonify({'error': str(e)}), 404
 
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+
+def format_history_record(record):
+    formatted_record = {
+        'id': record['id'],
+        'index': operation_history.position(record['id']),
+        'operation': record['operation'],
+        'time': record['time']
+    }
+    
+    # Xử lý data để tránh lỗi NaN
+    if 'data' in record:
+        if isinstance(record['data'], dict):
+            formatted_data = {}
+            for key, value in record['data'].items():
+                if isinstance(value, float) and pd.isna(value):  # Kiểm tra nếu là NaN
+                    formatted_data[key] = None
+                else:
+                    formatted_data[key] = value
+            formatted_record['data'] = formatted_data
+        else:
+            formatted_record['data'] = None
+            
+    if 'sbd' in record:
+        formatted_record['sbd'] = record['sbd']
+    return formatted_record
+
 @app.route('/history', methods=['GET', 'OPTIONS'])
 def get_history():
+    """
+    Lịch sử thao tác theo trang. Tham số: operation, sbd, year, from, to (thời gian
+    dạng 'YYYY-mm-dd HH:MM:SS'), cursor, limit, order (asc|desc).
+    Cursor của trang sau nằm trong header X-Next-Cursor.
+    """
     if request.method == 'OPTIONS':
         return '', 204
     
-    print("Current operation_history:", operation_history)  # Debug log
-        
-    # Xử lý dữ liệu trước khi gửi về frontend
-    formatted_history = []
-    for record in operation_history:
-        formatted_record = {
-            'operation': record['operation'],
-            'time': record['time']
-        }
-        
-        # Xử lý data để tránh lỗi NaN
-        if 'data' in record:
-            if isinstance(record['data'], dict):
-                formatted_data = {}
-                for key, value in record['data'].items():
-                    if pd.isna(value):  # Kiểm tra nếu là NaN
-                        formatted_data[key] = None
-                    else:
-                        formatted_data[key] = value
-                formatted_record['data'] = formatted_data
-            else:
-                formatted_record['data'] = None
-                
-        if 'sbd' in record:
-            formatted_record['sbd'] = record['sbd']
-            
-        formatted_history.append(formatted_record)  # Thêm dòng này
-            
-    print("Formatted history:", formatted_history)  # Debug log
-    return jsonify(formatted_history)
+    try:
+        args = request.args
+        limit = min(int(args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+        if limit <= 0:
+            raise ValueError(limit)
+        with history_lock, metrics.span('history.query'):
+            records, next_cursor = operation_history.query(
+                operation=args.get('operation'),
+                sbd=int(args['sbd']) if 'sbd' in args else None,
+                year=int(args['year']) if 'year' in args else None,
+                time_from=args.get('from'),
+                time_to=args.get('to'),
+                cursor=int(args['cursor']) if 'cursor' in args else None,
+                limit=limit,
+                descending=args.get('order') == 'desc'
+            )
+    except ValueError:
+        return jsonify({'error': 'Tham số truy vấn lịch sử không hợp lệ'}), 400
+    
+    response = jsonify([format_history_record(record) for record in records])
+    response.headers['X-Total-Count'] = str(len(operation_history))
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
 
 @app.route('/history/<int:index>', methods=['DELETE', 'OPTIONS'])
 def delete_history_item(index):
     if request.method == 'OPTIONS':
         return '', 204
     
-    global operation_history
     try:
-        if 0 <= index < len(operation_history):
-            # Xóa mục lịch sử tại vị trí index
-            operation_history.pop(index)
-            
-            # Lưu lại file CSV
-            history_df = pd.DataFrame(operation_history)
-            history_df.to_csv('operation_history.csv', index=False)
-            
+        with history_lock:
+            entry_id = operation_history.entry_id(index)
+        # Xóa theo id của mục tại vị trí index
+        if entry_id is not None and write('history_remove', entry_id) is not None:
             return jsonify({'message': 'Đã xóa mục lịch sử thành công'})
         else:
             return jsonify({'error': 'Không tìm thấy mục lịch sử'}), 404
@@ -418,106 +1168,181 @@ def clear_history():
     if request.method == 'OPTIONS':
         return '', 204
     
-    global operation_history
     try:
-        # Xóa lịch sử từ biến global
-        operation_history = []
-        
-        # Tạo file CSV mới với các cột cần thiết
-        history_df = pd.DataFrame(columns=['operation', 'time', 'sbd', 'data'])
-        history_df.to_csv('operation_history.csv', index=False)
+        write('history_clear')
             
         return jsonify({'message': 'Đã xóa toàn bộ lịch sử'})
     except Exception as e:
         return jsonify({'error': f'Lỗi khi xóa lịch sử: {str(e)}'}), 500
 
-# Cập nhật hàm lưu lịch sử
+# Các thao tác đã được ghi vào nhật ký khi xảy ra, chỉ cần đẩy xuống đĩa
 def save_history():
-    global operation_history
-    history_file = 'operation_history.csv'
-    
     try:
-        # Tạo DataFrame từ operation_history
-        history_records = []
-        for record in operation_history:
-            history_record = {
-                'operation': record['operation'],
-                'time': record['time'],
-                'sbd': record.get('sbd', None),
-                'data': str(record.get('data', '')) if record.get('data') else None
-            }
-            history_records.append(history_record)
-            
-        # Tạo DataFrame mới và lưu
-        if history_records:
-            history_df = pd.DataFrame(history_records)
-        else:
-            # Tạo DataFrame trống với các cột cần thiết
-            history_df = pd.DataFrame(columns=['operation', 'time', 'sbd', 'data'])
-            
-        history_df.to_csv(history_file, index=False)
+        journal.flush()
         print(f"Đã lưu lịch sử thành công")
     except Exception as e:
         print(f"Lỗi khi lưu lịch sử: {str(e)}")
 
+PROVINCE_SORT_FIELDS = ['MaTinh', 'count', 'mean', 'std', 'pass_rate']
+
+def province_years():
+    # ?year=2018,2019 -> [2018, 2019]; không có -> None (mọi năm)
+    value = request.args.get('year')
+    return [int(v) for v in value.split(',') if v.strip()] if value else None
+
+@app.route('/provinces', methods=['GET'])
+def get_province_summary():
+    """
+    So sánh các tỉnh theo một môn (?subject=, mặc định Toán) trong các năm ?year=
+    (mặc định mọi năm): số lượng, điểm trung bình, độ lệch chuẩn, tỉ lệ đậu của từng tỉnh
+    và toàn quốc; sắp xếp bằng ?sort= và ?order=asc|desc
+    """
+    subject = request.args.get('subject', 'Toan')
+    if subject not in SUBJECTS:
+        return jsonify({'error': f'Môn học không hợp lệ: {subject}'}), 400
+    sort = request.args.get('sort', 'MaTinh')
+    if sort not in PROVINCE_SORT_FIELDS:
+        return jsonify({'error': f'Trường sắp xếp không hợp lệ: {sort}'}), 400
+    try:
+        years = province_years()
+    except ValueError:
+        return jsonify({'error': 'Năm không hợp lệ'}), 400
+
+    j = SUBJECTS.index(subject)
+    provinces_view = store.snapshot().view(province_cube)
+    with metrics.span('provinces.rollup'):
+        cube = provinces_view.rollup(years)
+    fields = [cube[field][:, j] for field in ProvinceCube.FIELDS]
+    provinces = [dict(ProvinceCube.summary(*(values[p] for values in fields)), MaTinh=p)
+                 for p in np.flatnonzero(fields[0]).tolist() if p != 0]
+    provinces.sort(key=lambda row: (row[sort] is None, row[sort]), reverse=request.args.get('order') == 'desc')
+    return jsonify({
+        'subject': SUBJECT_LABELS[j],
+        'years': years or provinces_view.years(),
+        'national': ProvinceCube.summary(*(values.sum() for values in fields)),
+        'provinces': provinces
+    })
+
+@app.route('/provinces/<int:matinh>', methods=['GET'])
+def get_province_detail(matinh):
+    """
+    Thống kê từng môn của một tỉnh trong các năm ?year= (mặc định mọi năm)
+    """
+    try:
+        years = province_years()
+    except ValueError:
+        return jsonify({'error': 'Năm không hợp lệ'}), 400
+    if not 0 < matinh < PROVINCE_SIZE:
+        return jsonify({'error': 'Mã tỉnh không hợp lệ'}), 400
+    provinces_view = store.snapshot().view(province_cube)
+    with metrics.span('provinces.rollup'):
+        cube = provinces_view.rollup(years)
+    if not cube['count'][matinh].any():
+        return jsonify({'error': 'Không có dữ liệu của tỉnh'}), 404
+    return jsonify({
+        'MaTinh': matinh,
+        'years': years or provinces_view.years(),
+        'subjects': {
+            label: ProvinceCube.summary(*(cube[field][matinh, j] for field in ProvinceCube.FIELDS))
+            for j, label in enumerate(SUBJECT_LABELS)
+        }
+    })
+
+@app.route('/provinces/<int:matinh>/histogram', methods=['GET'])
+def get_province_histogram(matinh):
+    """
+    Phổ điểm một môn của một tỉnh (cùng tham số khoảng với /chart/histogram; ?year= mặc định mọi năm)
+    """
+    subject = request.args.get('subject', 'Toan')
+    if subject not in SUBJECTS:
+        return jsonify({'error': f'Môn học không hợp lệ: {subject}'}), 400
+    if not 0 < matinh < PROVINCE_SIZE:
+        return jsonify({'error': 'Mã tỉnh không hợp lệ'}), 400
+    try:
+        years = province_years()
+        with metrics.span('provinces.rollup'):
+            fine = store.snapshot().view(province_cube).rollup(years)['hist'][matinh, SUBJECTS.index(subject)]
+        edges, counts = coarse_counts(fine, *histogram_params(0.5))
+    except (ValueError, ZeroDivisionError) as e:
+        return jsonify({'error': f'Tham số không hợp lệ: {str(e)}'}), 400
+    return jsonify({
+        'labels': histogram_labels(edges),
+        'datasets': [{
+            'label': f'Số lượng học sinh tỉnh {matinh}',
+            'data': counts.tolist(),
+            'backgroundColor': 'rgba(54, 162, 235, 0.5)',
+        }]
+    })
+
+def cached_chart(bypass=None):
+    """
+    Cache response 200 của route biểu đồ theo (đường dẫn, tham số, phiên bản dữ liệu),
+    kèm ETag mạnh (băm nội dung) để request lặp lại với If-None-Match nhận 304.
+    bypass(args) trả về True khi response không được cache (ví dụ lấy mẫu ngẫu nhiên).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if bypass is not None and bypass(request.args):
+                with metrics.span(f'chart.{request.endpoint}'):
+                    return view(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), data_version())
+            entry = chart_cache.get(key)
+            if entry is None:
+                with metrics.span(f'chart.{request.endpoint}'):
+                    response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = chart_cache.put(key, response.get_data(), response.mimetype)
+            body, mimetype, etag = entry
+            response = app.response_class(body, mimetype=mimetype)
+            response.set_etag(etag)
+            # Trình duyệt luôn hỏi lại bằng ETag thay vì dùng bản cũ
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
 @app.route('/chart/bar', methods=['GET'])
+@cached_chart()
 def get_bar_chart_data():
-    global df
     try:
-        # Đảm bảo dữ liệu được tải
-        if df is None or df.empty:
-            load_data()
-            
-        print("Processing bar chart data...")
-        # Tính điểm trung bình cho từng môn theo năm
-        df_2018 = df[df['Year'] == 2018]
-        df_2019 = df[df['Year'] == 2019]
-        
-        if df_2018.empty or df_2019.empty:
-            return jsonify({'error': 'Không có dữ liệu cho năm 2018 hoặc 2019'}), 400
-            
-        subjects = ['Toan', 'Van', 'Ly', 'Hoa', 'Sinh', 'Ngoai ngu', 'Lich su', 'Dia ly', 'GDCD']
-        mean_2018 = [float(df_2018[subject].mean()) for subject in subjects]
-        mean_2019 = [float(df_2019[subject].mean()) for subject in subjects]
-        
-        print("Mean 2018:", mean_2018)
-        print("Mean 2019:", mean_2019)
+        # Điểm trung bình từng môn theo năm, đọc từ thống kê đã tính sẵn (trong ảnh chụp hiện tại)
+        stats = store.snapshot().view(year_stats)
+        years = stats.years()
+        if not years:
+            return jsonify({'error': 'Không có dữ liệu điểm theo năm'}), 400
         
         data = {
-            'labels': ['Toán', 'Văn', 'Lý', 'Hóa', 'Sinh', 'Ngoại ngữ', 'Lịch sử', 'Địa lý', 'GDCD'],
+            'labels': SUBJECT_LABELS,
             'datasets': [
                 {
-                    'label': '2018',
-                    'data': mean_2018,
-                    'backgroundColor': 'rgba(54, 162, 235, 0.5)',
-                },
-                {
-                    'label': '2019',
-                    'data': mean_2019,
-                    'backgroundColor': 'rgba(255, 99, 132, 0.5)',
+                    'label': str(year),
+                    'data': [stats.mean(year, subject) for subject in SUBJECTS],
+                    'backgroundColor': BAR_COLORS[i % len(BAR_COLORS)],
                 }
+                for i, year in enumerate(years)
             ]
         }
-        print("Bar chart data:", data)
         return jsonify(data)
     except Exception as e:
         print("Error in get_bar_chart_data:", str(e))
         return jsonify({'error': str(e)}), 500
 
 @app.route('/chart/line', methods=['GET'])
+@cached_chart()
 def get_line_chart_data():
-    global df
-    subjects = ['Toan', 'Van', 'Ly', 'Hoa', 'Sinh', 'Ngoai ngu', 'Lich su', 'Dia ly', 'GDCD']
-    years = sorted(df['Year'].unique())
+    stats = store.snapshot().view(year_stats)
+    years = stats.years()
     
     datasets = []
-    for subject in subjects:
-        means = [df[df['Year'] == year][subject].mean() for year in years]
+    for subject in SUBJECTS:
+        means = [stats.mean(year, subject) for year in years]
         datasets.append({
             'label': subject,
             'data': means,
             'fill': False,
-            'borderColor': f'rgb({np.random.randint(0, 255)}, {np.random.randint(0, 255)}, {np.random.randint(0, 255)})'
+            'borderColor': SUBJECT_COLORS[subject]
         })
     
     data = {
@@ -526,15 +1351,44 @@ def get_line_chart_data():
     }
     return jsonify(data)
 
+def histogram_params(default_width):
+    """
+    Đọc tham số khoảng điểm từ query string: width (bội của 0.25) hoặc bins, min, max
+    """
+    low = float(request.args.get('min', 0))
+    high = float(request.args.get('max', 10))
+    if 'bins' in request.args:
+        width = (high - low) / int(request.args['bins'])
+    else:
+        width = float(request.args.get('width', default_width))
+    return width, low, high
+
+def histogram_labels(edges):
+    return [f'{edges[i]:g}-{edges[i+1]:g}' for i in range(len(edges)-1)]
+
 @app.route('/chart/histogram', methods=['GET'])
+@cached_chart()
 def get_histogram_data():
-    global df
-    df_2018 = df[df['Year'] == 2018]['Toan'].dropna()
-    
-    counts, bins = np.histogram(df_2018, bins=20)
+    # Mặc định: môn Toán năm đầu tiên có dữ liệu, khoảng 0.5 điểm
+    snapshot = store.snapshot()
+    try:
+        years = snapshot.view(year_stats).years()
+        year = int(request.args.get('year', years[0] if years else 2018))
+        khoi = request.args.get('khoi')
+        if khoi is not None:
+            if khoi not in KHOI_HOC:
+                return jsonify({'error': f'Khối không hợp lệ: {khoi}'}), 400
+            key = f'Khối {khoi}'
+        else:
+            key = request.args.get('subject', 'Toan')
+            if key not in SUBJECTS:
+                return jsonify({'error': f'Môn học không hợp lệ: {key}'}), 400
+        edges, counts = coarse_counts(snapshot.view(histograms).get(key, year), *histogram_params(0.5))
+    except (ValueError, ZeroDivisionError) as e:
+        return jsonify({'error': f'Tham số không hợp lệ: {str(e)}'}), 400
     
     data = {
-        'labels': [f'{bins[i]:.1f}-{bins[i+1]:.1f}' for i in range(len(bins)-1)],
+        'labels': histogram_labels(edges),
         'datasets': [{
             'label': 'Số lượng học sinh',
             'data': counts.tolist(),
@@ -544,109 +1398,132 @@ def get_histogram_data():
     return jsonify(data)
 
 @app.route('/chart/pie', methods=['GET'])
+@cached_chart()
 def get_pie_chart_data():
-    global df
-    
-    def calculate_pass_fail(year_df):
-        pass_count = len(year_df[year_df['Toan'] >= 5])
-        fail_count = len(year_df[year_df['Toan'] < 5])
-        return pass_count, fail_count
-    
-    df_2018 = df[df['Year'] == 2018]
-    df_2019 = df[df['Year'] == 2019]
-    
-    pass_2018, fail_2018 = calculate_pass_fail(df_2018)
-    pass_2019, fail_2019 = calculate_pass_fail(df_2019)
-    
+    # Số thí sinh đậu/rớt môn Toán theo năm
+    stats = store.snapshot().view(year_stats)
     data = {
         'labels': ['Đậu', 'Rớt'],
         'datasets': [
             {
-                'label': '2018',
-                'data': [pass_2018, fail_2018],
-                'backgroundColor': ['rgba(75, 192, 192, 0.5)', 'rgba(255, 99, 132, 0.5)'],
-            },
-            {
-                'label': '2019',
-                'data': [pass_2019, fail_2019],
-                'backgroundColor': ['rgba(54, 162, 235, 0.5)', 'rgba(255, 206, 86, 0.5)'],
+                'label': str(year),
+                'data': [int(stats.get(year, 'Toan', 'pass')), int(stats.get(year, 'Toan', 'fail'))],
+                'backgroundColor': PIE_COLORS[i % len(PIE_COLORS)],
             }
+            for i, year in enumerate(stats.years())
         ]
     }
     return jsonify(data)
 
 @app.route('/chart/area', methods=['GET'])
+@cached_chart()
 def get_area_chart_data():
-    global df
-    khoi_hoc = {
-        'A': ['Toan', 'Ly', 'Hoa'],
-        'B': ['Toan', 'Hoa', 'Sinh'],
-        'C': ['Van', 'Lich su', 'Dia ly'],
-        'D': ['Toan', 'Van', 'Ngoai ngu']
-    }
+    # Phân phối điểm trung bình theo khối, mọi năm hoặc một năm (?year=)
+    try:
+        year = int(request.args['year']) if 'year' in request.args else None
+        width, low, high = histogram_params(1)
+        counts = store.snapshot().view(histograms)
+        distributions = {khoi: coarse_counts(counts.get(f'Khối {khoi}', year), width, low, high)
+                         for khoi in KHOI_HOC}
+    except (ValueError, ZeroDivisionError) as e:
+        return jsonify({'error': f'Tham số không hợp lệ: {str(e)}'}), 400
     
     data = {
-        'labels': ['0-1', '1-2', '2-3', '3-4', '4-5', '5-6', '6-7', '7-8', '8-9', '9-10'],
+        'labels': histogram_labels(next(iter(distributions.values()))[0]),
         'datasets': []
     }
     
-    for khoi, subjects in khoi_hoc.items():
-        avg_scores = df[subjects].mean(axis=1)
-        hist, _ = np.histogram(avg_scores, bins=10, range=(0, 10))
+    for khoi, (_, hist) in distributions.items():
         data['datasets'].append({
             'label': f'Khối {khoi}',
             'data': hist.tolist(),
             'fill': True,
-            'backgroundColor': f'rgba({np.random.randint(0, 255)}, {np.random.randint(0, 255)}, {np.random.randint(0, 255)}, 0.5)'
+            'backgroundColor': KHOI_COLORS[khoi]
         })
     
     return jsonify(data)
 
+SCATTER_MAX_POINTS = 5000
+
 @app.route('/chart/scatter', methods=['GET'])
+@cached_chart(bypass=lambda args: args.get('mode') == 'points' and 'seed' not in args)
 def get_scatter_data():
-    global df
-    toan_scores = df['Toan'].values
-    van_scores = df['Van'].values
+    """
+    Phân tán điểm hai môn (mặc định Toán - Văn), có thể lọc theo năm (?year=).
+    Mặc định trả về lưới mật độ (?width=, mặc định 0.25 điểm); ?mode=points trả về
+    tối đa ?limit= điểm được lấy mẫu ngẫu nhiên đều (không hoàn lại).
+    """
+    x_subject = request.args.get('x', 'Toan')
+    y_subject = request.args.get('y', 'Van')
+    for subject in (x_subject, y_subject):
+        if subject not in SUBJECTS:
+            return jsonify({'error': f'Môn học không hợp lệ: {subject}'}), 400
+    
+    # Ảnh chụp bất biến: không chờ các thao tác ghi đang chạy
+    df = store.snapshot().frame
+    x_codes = df[x_subject].values
+    y_codes = df[y_subject].values
+    try:
+        if 'year' in request.args:
+            in_year = df['Year'].values == int(request.args['year'])
+            x_codes, y_codes = x_codes[in_year], y_codes[in_year]
+        width = float(request.args.get('width', 0.25))
+        limit = min(int(request.args.get('limit', 1000)), SCATTER_MAX_POINTS)
+    except ValueError:
+        return jsonify({'error': 'Tham số không hợp lệ'}), 400
     
+    label = f'Điểm {SUBJECT_LABELS[SUBJECTS.index(x_subject)]} - {SUBJECT_LABELS[SUBJECTS.index(y_subject)]}'
+    if request.args.get('mode') == 'points':
+        x_scores = decode_column(x_subject, x_codes)
+        y_scores = decode_column(y_subject, y_codes)
+        valid = np.flatnonzero(~(np.isnan(x_scores) | np.isnan(y_scores)))
+        if len(valid) > limit:
+            seed = int(request.args['seed']) if request.args.get('seed', '').isdigit() else None
+            valid = np.sort(np.random.default_rng(seed).choice(valid, size=limit, replace=False))
+        points = [{'x': x, 'y': y} for x, y in zip(x_scores[valid].tolist(), y_scores[valid].tolist())]
+        return jsonify({
+            'mode': 'points',
+            'datasets': [{
+                'label': label,
+                'data': points,
+                'backgroundColor': 'rgba(54, 162, 235, 0.5)'
+            }]
+        })
+    
+    try:
+        edges, counts = density_grid(x_codes, y_codes, width)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    x_index, y_index = np.nonzero(counts)
     data = {
+        'mode': 'density',
+        'binWidth': width,
+        'max': int(counts.max()) if counts.size else 0,
         'datasets': [{
-            'label': 'Điểm Toán - Văn',
-            'data': [{'x': t, 'y': v} for t, v in zip(toan_scores, van_scores) if not (np.isnan(t) or np.isnan(v))],
+            'label': label,
+            'data': [{'x': edges[i], 'y': edges[j], 'count': int(counts[i, j])}
+                     for i, j in zip(x_index.tolist(), y_index.tolist())],
             'backgroundColor': 'rgba(54, 162, 235, 0.5)'
         }]
     }
     return jsonify(data)
 
+# Các cột của ma trận tương quan, theo thứ tự mong muốn
+HEATMAP_COLUMNS = ['Toan', 'Van', 'Ly', 'Sinh', 'Ngoai ngu', 'Year', 'Hoa', 'Lich su', 'Dia ly', 'GDCD', 'MaTinh']
+HEATMAP_LABELS = ['Toán', 'Văn', 'Lý', 'Sinh', 'Ngoại ngữ', 'Year', 'Hóa', 'Lịch sử', 'Địa lý', 'GDCD', 'MaTinh']
+
 @app.route('/chart/heatmap/<int:year>', methods=['GET'])
+@cached_chart()
 def get_heatmap_data(year):
-    global df
-    year_df = df[df['Year'] == year]
+    subject_labels = HEATMAP_LABELS
     
-    # Chọn các cột điểm số và sắp xếp theo thứ tự mong muốn
-    subjects = ['Toan', 'Van', 'Ly', 'Sinh', 'Ngoai ngu', 'Year', 'Hoa', 'Lich su', 'Dia ly', 'GDCD', 'MaTinh']
-    subject_labels = ['Toán', 'Văn', 'Lý', 'Sinh', 'Ngoại ngữ', 'Year', 'Hóa', 'Lịch sử', 'Địa lý', 'GDCD', 'MaTinh']
-    
-    # Tính ma trận tương quan và xử lý NaN
-    corr_matrix = year_df[subjects].corr().round(2)
+    # Ma trận tương quan từ thống kê cặp cột duy trì theo từng thao tác, NaN -> 0
+    corr_matrix = np.nan_to_num(store.snapshot().view(pairwise_moments).corr(year, HEATMAP_COLUMNS).round(2))
+    values = corr_matrix.tolist()
     
     # Chuyển ma trận tương quan thành format phù hợp cho heatmap
-    data = []
-    for i, row_subject in enumerate(subjects):
-        for j, col_subject in enumerate(subjects):
-            value = corr_matrix.loc[row_subject, col_subject]
-            # Xử lý NaN
-            if pd.isna(value):
-                value = 0
-            data.append({
-                'x': j,
-                'y': i,
-                'value': float(value)
-            })
-    
-    # Chuyển ma trận thành list và xử lý NaN
-    values = []
-    for row in corr_matrix.values.tolist():
-        values.append([0 if pd.isna(x) else float(x) for x in row])
+    data = [{'x': j, 'y': i, 'value': value}
+            for i, row in enumerate(values) for j, value in enumerate(row)]
     
     return jsonify({
         'data': data,
@@ -656,5 +1533,133 @@ def get_heatmap_data(year):
         'values': values
     })
 
+def figure_params(name, args):
+    """
+    Tham số của một ảnh biểu đồ từ query string (đã kiểm tra và điền giá trị mặc định)
+    """
+    if name not in FIGURES:
+        raise KeyError(name)
+    years = store.snapshot().view(year_stats).years()
+    params = {}
+    if name in ('distribution', 'heatmap') or (name in ('area', 'scatter') and 'year' in args):
+        params['year'] = int(args['year']) if 'year' in args else (years[0] if years else 2018)
+    if name == 'distribution':
+        params['subject'] = args.get('subject', 'Toan')
+        if params['subject'] not in SUBJECTS:
+            raise ValueError(f'Môn học không hợp lệ: {params["subject"]}')
+    return params
+
+def figure_inputs(name, params):
+    """
+    Dữ liệu đã tổng hợp để vẽ một ảnh biểu đồ, đọc từ các thống kê duy trì sẵn
+    trong ảnh chụp hiện tại (không giữ lock của store)
+    """
+    year = params.get('year')
+    snapshot = store.snapshot()
+    stats, counts_view = snapshot.view(year_stats), snapshot.view(histograms)
+    years = stats.years()
+    if name in ('bar', 'line'):
+        means = [[stats.mean(y, subject) for subject in SUBJECTS] for y in years]
+        means = [[np.nan if mean is None else mean for mean in row] for row in means]
+        return {'years': years, 'labels': SUBJECT_LABELS, 'means': means}
+    if name == 'distribution':
+        edges, counts = coarse_counts(counts_view.get(params['subject'], year), 0.5)
+        return {'subject': SUBJECT_LABELS[SUBJECTS.index(params['subject'])], 'year': year,
+                'edges': edges, 'counts': counts.tolist()}
+    if name == 'pie':
+        return {'years': years,
+                'passed': [int(stats.get(y, 'Toan', 'pass')) for y in years],
+                'failed': [int(stats.get(y, 'Toan', 'fail')) for y in years]}
+    if name == 'area':
+        distributions = {khoi: coarse_counts(counts_view.get(f'Khối {khoi}', year), 1) for khoi in KHOI_HOC}
+        edges = next(iter(distributions.values()))[0]
+        return {'labels': histogram_labels(edges),
+                'series': {f'Khối {khoi}': counts.tolist() for khoi, (_, counts) in distributions.items()}}
+    if name == 'heatmap':
+        return {'year': year, 'labels': HEATMAP_LABELS,
+                'matrix': np.nan_to_num(snapshot.view(pairwise_moments).corr(year, HEATMAP_COLUMNS)).tolist()}
+    # Phân tán: điểm Toán trung bình theo từng mức điểm Văn, tính trên cùng ảnh chụp
+    df = snapshot.frame
+    x_codes, y_codes = df['Van'].to_numpy(), df['Toan'].to_numpy()
+    valid = (x_codes != SCORE_MISSING) & (y_codes != SCORE_MISSING)
+    if year is not None:
+        valid &= df['Year'].to_numpy() == year
+    counts = np.bincount(x_codes[valid], minlength=SCORE_MISSING)
+    sums = np.bincount(x_codes[valid], weights=y_codes[valid], minlength=SCORE_MISSING)
+    present = np.flatnonzero(counts)
+    return {'x': (present / SCORE_SCALE).tolist(), 'y': (sums[present] / counts[present] / SCORE_SCALE).tolist()}
+
+# Ảnh biểu đồ (chart.py) được vẽ song song trong process pool và cache theo dữ liệu vẽ
+CHART_DIR = os.environ.get('CHART_DIR', 'charts')
+chart_renderer = ChartRenderer(CHART_DIR, figure_inputs, workers=int(os.environ.get('CHART_WORKERS', 0)) or None)
+atexit.register(chart_renderer.shutdown)
+
+def report_figures():
+    # Bộ biểu đồ đầy đủ: mỗi năm một heatmap
+    years = store.snapshot().view(year_stats).years()
+    figures = [(name, figure_params(name, {})) for name in ('bar', 'line', 'distribution', 'pie', 'area')]
+    figures += [('heatmap', {'year': year}) for year in years]
+    figures.append(('scatter', {}))
+    return figures
+
+def figure_url(name, params, fmt):
+    query = '&'.join(f'{key}={value}' for key, value in sorted(params.items()))
+    return f'/report/{name}.{fmt}' + (f'?{query}' if query else '')
+
+@app.route('/report', methods=['GET'])
+def get_report():
+    """
+    Vẽ (song song) hoặc lấy từ cache cả bộ ảnh biểu đồ của dữ liệu hiện tại,
+    trả về danh sách đường dẫn ảnh; ?format=png|svg
+    """
+    fmt = request.args.get('format', 'png')
+    if fmt not in IMAGE_FORMATS:
+        return jsonify({'error': f'Định dạng không hợp lệ: {fmt} (png hoặc svg)'}), 400
+    started = time.perf_counter()
+    figures = report_figures()
+    try:
+        with metrics.span('report.render'):
+            chart_renderer.render(figures, fmt, data_version())
+    except Exception as e:
+        return jsonify({'error': f'Lỗi khi vẽ biểu đồ: {str(e)}'}), 500
+    return jsonify({
+        'version': data_version(),
+        'seconds': round(time.perf_counter() - started, 3),
+        'figures': [{'name': name, 'params': params, 'url': figure_url(name, params, fmt)} for name, params in figures]
+    })
+
+@app.route('/report/<name>.<fmt>', methods=['GET'])
+def get_report_figure(name, fmt):
+    """
+    Một ảnh biểu đồ (bar, line, distribution, pie, area, heatmap, scatter) dạng png hoặc svg;
+    tham số ?year= (distribution, heatmap, area, scatter) và ?subject= (distribution)
+    """
+    if fmt not in IMAGE_FORMATS:
+        return jsonify({'error': f'Định dạng không hợp lệ: {fmt} (png hoặc svg)'}), 400
+    try:
+        params = figure_params(name, request.args)
+    except KeyError:
+        return jsonify({'error': f'Không có biểu đồ {name}'}), 404
+    except ValueError as e:
+        return jsonify({'error': f'Tham số không hợp lệ: {str(e)}'}), 400
+    try:
+        with metrics.span('report.render'):
+            path, = chart_renderer.render([(name, params)], fmt, data_version())
+    except Exception as e:
+        return jsonify({'error': f'Lỗi khi vẽ biểu đồ: {str(e)}'}), 500
+    response = send_file(os.path.abspath(path), mimetype=IMAGE_FORMATS[fmt], etag=os.path.basename(path))
+    # Tên file gồm băm dữ liệu vẽ: trình duyệt hỏi lại bằng ETag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+startup_status['import_seconds'] = round(time.perf_counter() - _import_started, 3)
+if startup_status['import_seconds'] > IMPORT_BUDGET_SECONDS:
+    print(f"Cảnh báo: import app mất {startup_status['import_seconds']}s, vượt ngân sách {IMPORT_BUDGET_SECONDS}s")
+
+# Gọi start_app() khi khởi động ứng dụng; tiến trình con của process pool vẽ biểu đồ
+# (spawn) import lại module chính nên không tải dữ liệu ở đó
+if multiprocessing.current_process().name == 'MainProcess':
+    start_app()
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,323 @@
+"""
+Đo hiệu năng ứng dụng trên dữ liệu thi tổng hợp.
+
+Sinh bộ dữ liệu giả lập (số dòng tùy chọn, nhiều năm, tỉ lệ bỏ trống từng môn theo tổ hợp
+KHTN/KHXH, điểm trên lưới 0.25, Toán và Ngoại ngữ lưới 0.2) vào thư mục làm việc dưới dạng cache
+CSV để ứng dụng nạp mà không cần API gốc; đo thời gian khởi động, /save, nạp lại lịch sử
+và gọi mọi route qua Flask test client. Kết quả (p50/p99, thông lượng, RSS cao nhất)
+được in ra dạng JSON để so sánh giữa các commit.
+
+    python benchmark.py --rows 1000000 --years 2018 2019 2020 --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+from schema import SUBJECTS  # noqa: E402
+
+CSV_COLUMNS = ['SBD', 'Toan', 'Van', 'Ly', 'Sinh', 'Ngoai ngu', 'Year', 'Hoa', 'Lich su', 'Dia ly', 'GDCD', 'MaTinh']
+GENERATE_BLOCK_ROWS = 1000000
+PROVINCES = 64
+
+# (điểm trung bình, độ lệch chuẩn, bước lưới) của từng môn
+SCORE_PROFILES = {
+    'Toan': (5.2, 1.6, 0.2), 'Van': (5.5, 1.3, 0.25), 'Ly': (5.0, 1.5, 0.25),
+    'Hoa': (5.0, 1.6, 0.25), 'Sinh': (4.7, 1.2, 0.25), 'Ngoai ngu': (4.2, 1.8, 0.2),
+    'Lich su': (4.0, 1.5, 0.25), 'Dia ly': (6.0, 1.2, 0.25), 'GDCD': (7.2, 1.2, 0.25)
+}
+# Tỉ lệ dự thi các môn bắt buộc và hai tổ hợp (thí sinh chọn một trong hai hoặc không thi)
+TAKE_RATES = {'Toan': 0.98, 'Van': 0.985, 'Ngoai ngu': 0.88}
+KHTN_RATE, KHXH_RATE = 0.37, 0.6
+KHTN, KHXH = ['Ly', 'Hoa', 'Sinh'], ['Lich su', 'Dia ly', 'GDCD']
+# Thí sinh tự do (giáo dục thường xuyên) thi KHXH không thi GDCD
+GDCD_SKIP_RATE = 0.1
+
+
+def generate_block(rng, n, year, offsets, weights, shift):
+    """
+    Một khối n dòng của năm year; offsets (số thí sinh đã sinh của từng tỉnh) được cập nhật
+    để SBD (mã tỉnh * 10^6 + số thứ tự) không trùng trong năm
+    """
+    provinces = rng.choice(PROVINCES, size=n, p=weights) + 1
+    order = np.argsort(provinces, kind='stable')
+    counts = np.bincount(provinces, minlength=PROVINCES + 1)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sequence = np.empty(n, dtype='int64')
+    sequence[order] = np.arange(n) - starts[provinces[order]]
+    sbds = provinces * 1000000 + offsets[provinces] + sequence
+    offsets += counts
+
+    block = {'SBD': sbds, 'Year': np.full(n, year), 'MaTinh': provinces}
+    combination = rng.random(n)
+    takes = {subject: rng.random(n) < rate for subject, rate in TAKE_RATES.items()}
+    for subject in KHTN:
+        takes[subject] = combination < KHTN_RATE
+    for subject in KHXH:
+        takes[subject] = (combination >= KHTN_RATE) & (combination < KHTN_RATE + KHXH_RATE)
+    takes['GDCD'] &= rng.random(n) >= GDCD_SKIP_RATE
+    for subject in SUBJECTS:
+        mean, std, step = SCORE_PROFILES[subject]
+        scores = np.clip(rng.normal(mean + shift, std, n), 0, 10)
+        block[subject] = np.where(takes[subject], np.round(scores / step) * step, np.nan)
+    return pd.DataFrame(block)[CSV_COLUMNS]
+
+
+def generate_dataset(path, rows, years, seed):
+    """
+    Ghi bộ dữ liệu tổng hợp ra CSV theo từng khối, trả về mẫu (SBD, Year) để tạo request
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.gamma(2.0, size=PROVINCES)
+    weights /= weights.sum()
+    samples = []
+    per_year = np.full(len(years), rows // len(years))
+    per_year[:rows % len(years)] += 1
+    with open(path, 'w', encoding='utf-8') as f:
+        header = True
+        for year, count in zip(years, per_year):
+            offsets = np.zeros(PROVINCES + 1, dtype='int64')
+            # Mỗi năm điểm trung bình lệch một chút
+            shift = rng.normal(0, 0.3)
+            for start in range(0, count, GENERATE_BLOCK_ROWS):
+                block = generate_block(rng, min(GENERATE_BLOCK_ROWS, count - start), year, offsets, weights, shift)
+                block.to_csv(f, header=header, index=False)
+                header = False
+                picks = rng.choice(len(block), size=min(len(block), 2000), replace=False)
+                samples += list(zip(block['SBD'].values[picks].tolist(), block['Year'].values[picks].tolist()))
+    return samples
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def summarize(durations, statuses):
+    durations = np.array(durations)
+    return {
+        'count': len(durations),
+        'p50_ms': round(float(np.percentile(durations, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(durations, 99)) * 1000, 3),
+        'mean_ms': round(float(durations.mean()) * 1000, 3),
+        'throughput_rps': round(len(durations) / float(durations.sum()), 1) if durations.sum() > 0 else None,
+        'status': {str(code): statuses.count(code) for code in sorted(set(statuses))}
+    }
+
+
+class RouteBenchmark:
+    """
+    Gọi một route nhiều lần qua test client; make_request(i) trả về (phương thức, đường dẫn, kwargs)
+    """
+
+    def __init__(self, client, requests, before=None):
+        self.client = client
+        self.requests = requests
+        self.before = before
+
+    def run(self, make_request):
+        durations, statuses = [], []
+        for i in range(self.requests):
+            method, path, kwargs = make_request(i)
+            if self.before is not None:
+                self.before()
+            started = time.perf_counter()
+            response = self.client.open(path, method=method, **kwargs)
+            # Đọc hết nội dung (kể cả response dạng luồng)
+            response.get_data()
+            durations.append(time.perf_counter() - started)
+            statuses.append(response.status_code)
+        return summarize(durations, statuses)
+
+
+def import_csv(rng, rows, base_sbd, year):
+    frame = pd.DataFrame({'SBD': base_sbd + np.arange(rows), 'Year': year,
+                          'Toan': np.round(rng.uniform(0, 10, rows) * 4) / 4,
+                          'Van': np.round(rng.uniform(0, 10, rows) * 4) / 4,
+                          'MaTinh': rng.integers(1, PROVINCES + 1, rows)})
+    return frame.to_csv(index=False).encode('utf-8')
+
+
+def run_routes(A, samples, args, rng):
+    client = A.app.test_client()
+    results = {}
+    pick = lambda: samples[int(rng.integers(len(samples)))]  # noqa: E731
+    years = sorted({year for _, year in samples})
+    subjects = SUBJECTS
+    n = args.requests
+
+    def bench(name, make_request, requests=n, before=None):
+        results[name] = RouteBenchmark(client, requests, before).run(make_request)
+        print(f"{name}: p50 {results[name]['p50_ms']}ms p99 {results[name]['p99_ms']}ms", file=sys.stderr)
+
+    bench('GET /ready', lambda i: ('GET', '/ready', {}))
+    bench('GET /metrics', lambda i: ('GET', '/metrics', {}))
+
+    # Đọc, xếp hạng, truy vấn
+    bench('GET /students/<sbd>', lambda i: ('GET', f'/students/{pick()[0]}', {}))
+    bench('GET /students/<sbd>?rank=1', lambda i: ('GET', f'/students/{pick()[0]}?rank=1', {}))
+    bench('GET /ranking/<sbd>', lambda i: ('GET', f'/ranking/{pick()[0]}', {}))
+    bench('GET /ranking/top', lambda i: ('GET', f'/ranking/top?year={years[i % len(years)]}&khoi=A&limit=50', {}))
+    queries = ['sort=Toan&order=desc&limit=100', 'year={y}&Toan_min=8&sort=total&order=desc',
+               'matinh=1,2,3&sort=Van&limit=50', 'year={y}&Ly_min=9&Hoa_min=9&sort=Khối A&order=desc']
+    bench('GET /students (query)',
+          lambda i: ('GET', '/students?' + queries[i % len(queries)].format(y=years[i % len(years)]), {}))
+
+    # Biểu đồ: lần đầu (xóa cache trước mỗi request) và khi đã có trong cache
+    charts = ['/chart/bar', '/chart/line', '/chart/histogram', '/chart/pie', '/chart/area',
+              '/chart/scatter', f'/chart/heatmap/{years[0]}', '/provinces', '/provinces/1',
+              '/provinces/1/histogram']
+    for path in charts:
+        bench(f'GET {path} (uncached)', lambda i, path=path: ('GET', path, {}), before=A.chart_cache.clear)
+        bench(f'GET {path}', lambda i, path=path: ('GET', path, {}))
+    # Ảnh biểu đồ: lần đầu vẽ cả bộ song song, sau đó lấy từ cache file
+    bench('GET /report (render)', lambda i: ('GET', '/report', {}), requests=1)
+    bench('GET /report', lambda i: ('GET', '/report', {}))
+    bench('GET /report/heatmap.png', lambda i: ('GET', f'/report/heatmap.png?year={years[0]}', {}))
+    bench('GET /chart/scatter?mode=points', lambda i: ('GET', '/chart/scatter?mode=points&limit=2000', {}))
+
+    # Ghi: thêm, sửa, xóa từng thí sinh (SBD mới, ngoài dải của dữ liệu tổng hợp)
+    base = 990000000
+    bench('POST /students', lambda i: ('POST', '/students', {'json': {
+        'SBD': str(base + i), 'Year': str(years[-1]), 'Toán': '7.5', 'Văn': '6', 'MaTinh': '1'}}))
+    bench('PUT /students/<sbd>/<year>', lambda i: ('PUT', f'/students/{base + i}/{years[-1]}', {'json': {'Toán': '8.25'}}))
+    bench('DELETE /students/<sbd>/<year>', lambda i: ('DELETE', f'/students/{base + i}/{years[-1]}', {}))
+    batch_base = base + n
+
+    def batch(i):
+        operations = [{'op': 'create', 'SBD': batch_base + i * 100 + k, 'Year': years[-1], 'data': {'Toán': 5}}
+                      for k in range(100)]
+        return 'POST', '/students/batch', {'json': operations}
+    bench('POST /students/batch (100 ops)', batch)
+    imports = max(1, n // 10)
+    bench(f'POST /students/import ({args.import_rows} rows)', lambda i: ('POST', '/students/import', {
+        'data': import_csv(rng, args.import_rows, 800000000 + i * args.import_rows, years[-1]),
+        'content_type': 'text/csv'}), requests=imports)
+
+    # Lịch sử, xuất dữ liệu
+    bench('GET /history', lambda i: ('GET', '/history?limit=100&order=desc', {}))
+    bench('GET /history?operation=READ', lambda i: ('GET', '/history?operation=READ&limit=100', {}))
+    bench('DELETE /history/<index>', lambda i: ('DELETE', '/history/0', {}), requests=max(1, n // 10))
+    bench('DELETE /history', lambda i: ('DELETE', '/history', {}), requests=max(1, n // 10))
+
+    # Lưu: snapshot (chỉ ghi phần thay đổi) và xuất CSV (file để /download)
+    saves = max(1, n // 25)
+    bench('POST /save', lambda i: ('POST', '/save', {}), requests=saves)
+    bench('POST /save?format=csv', lambda i: ('POST', '/save?format=csv', {}), requests=saves)
+    exports = max(1, n // 25)
+    bench('GET /export', lambda i: ('GET', '/export', {}), requests=exports)
+    bench('GET /export?format=ndjson&gzip=1', lambda i: ('GET', '/export?format=ndjson&gzip=1', {}), requests=exports)
+    bench('GET /download/Updated_Data.csv', lambda i: ('GET', '/download/Updated_Data.csv', {}), requests=exports)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ứng dụng trên dữ liệu thi tổng hợp')
+    parser.add_argument('--rows', type=int, default=100000, help='số dòng dữ liệu (100k - 10M)')
+    parser.add_argument('--years', type=int, nargs='+', default=[2018, 2019, 2020])
+    parser.add_argument('--requests', type=int, default=50, help='số request mỗi route')
+    parser.add_argument('--import-rows', type=int, default=10000, help='số dòng mỗi lần /students/import')
+    parser.add_argument('--history', type=int, default=100000, help='số mục lịch sử tổng hợp để đo nạp lại')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='thư mục làm việc (mặc định thư mục tạm)')
+    parser.add_argument('--output', help='ghi kết quả JSON ra file thay vì stdout')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='benchmark.')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    rng = np.random.default_rng(args.seed)
+    phases = {}
+    rss = {}
+
+    # Dữ liệu được đặt vào vị trí cache CSV cũ nên ứng dụng nạp mà không gọi API
+    phases['generate_seconds'], samples = timed(lambda: generate_dataset('raw_data_cache.csv', args.rows, args.years, args.seed))
+    rss['after_generate'] = current_rss_mb()
+
+    # Log của ứng dụng ra stderr để stdout chỉ có JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        os.environ['SYNC_STARTUP'] = '1'
+        phases['startup_cold_seconds'], A = timed(lambda: __import__('app'))
+        phases['startup_status'] = dict(A.startup_status)
+        rss['after_startup'] = current_rss_mb()
+
+        # Khởi động lại từ cache cột (memory-map)
+        A.data_ready.clear()
+        phases['startup_warm_seconds'], _ = timed(A.init_app)
+
+        save = lambda: A.app.test_client().post('/save').get_data()  # noqa: E731
+        phases['save_full_seconds'], _ = timed(save)
+        routes = run_routes(A, samples, args, rng)
+        rss['after_routes'] = current_rss_mb()
+        phases['save_incremental_seconds'], _ = timed(save)
+
+        # Nạp lại nhật ký lịch sử sau khi ghi thêm các mục tổng hợp
+        for i in range(args.history):
+            sbd, _ = samples[i % len(samples)]
+            A.record_history({'operation': 'READ', 'time': time.strftime("%Y-%m-%d %H:%M:%S"), 'sbd': sbd})
+        A.journal.flush()
+        seconds, _ = timed(A.init_history)
+        phases['history_replay'] = {'seconds': round(seconds, 3), 'entries': len(A.operation_history)}
+
+    for key, value in phases.items():
+        if isinstance(value, float):
+            phases[key] = round(value, 3)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'rows': args.rows,
+            'years': args.years,
+            'requests_per_route': args.requests,
+            'seed': args.seed,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'workdir': workdir
+        },
+        'phases': phases,
+        'routes': routes,
+        'rss_mb': {key: round(value, 1) for key, value in rss.items()},
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(os.path.join(REPO_DIR, args.output) if not os.path.isabs(args.output) else args.output, 'w',
+                  encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
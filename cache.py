@@ -0,0 +1,52 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Cache LRU các response đã tuần tự hóa, giới hạn theo tổng số byte nội dung.
+    Khóa do nơi gọi tạo (ví dụ (đường dẫn, tham số, phiên bản dữ liệu)); mỗi mục giữ
+    nội dung, mimetype và ETag mạnh tính từ nội dung.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype):
+        """
+        Lưu nội dung, trả về mục (body, mimetype, etag); nội dung lớn hơn giới hạn không được lưu
+        """
+        entry = (body, mimetype, hashlib.blake2b(body, digest_size=16).hexdigest())
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+            self.entries[key] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[0])
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
@@ -1,24 +1,51 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import requests
+import numpy as np
 from io import StringIO
 from datetime import datetime, timedelta
+import hashlib
 import os
-import seaborn as sns
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 # Tải dữ liệu từ API
 cleaned_data_api = 'https://andyanh.id.vn/index.php/s/AQrkaif3HWgs9ke/download'
 
+# Định nghĩa các cột điểm
+score_columns = [
+    "Toan", "Van", "Ly", "Sinh", "Ngoai ngu", "Hoa", "Lich su", "Dia ly", "GDCD"
+]
+
+khối_học = {
+    'A': ['Toan', 'Ly', 'Hoa'],
+    'B': ['Toan', 'Hoa', 'Sinh'],
+    'C': ['Van', 'Lich su', 'Dia ly'],
+    'D': ['Toan', 'Van', 'Ngoai ngu']
+}
+
+AREA_LABELS = ["0-1", "1-2", "2-3", "3-4", "4-5", "5-6", "6-7", "7-8", "8-9", "9-10"]
+
+# Định dạng ảnh được hỗ trợ -> mimetype
+IMAGE_FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+IMAGE_DPI = 100
+# Số file ảnh tối đa giữ trong thư mục cache (xóa file cũ nhất khi vượt)
+MAX_CACHED_FILES = 256
+RENDER_TIMEOUT = 120
+
 def fetch_csv_from_api(api_url):
     cache_file = 'cleaned_data_cache.csv'
     cache_timeout = timedelta(hours=24)
-    
+
     if os.path.exists(cache_file):
         modified_time = datetime.fromtimestamp(os.path.getmtime(cache_file))
         if datetime.now() - modified_time < cache_timeout:
             print(f"Đang tải dữ liệu từ cache {cache_file}...")
             return pd.read_csv(cache_file)
-    
+
+    # Import khi cần: app.py import module này để vẽ ảnh, không dùng phần tải dữ liệu
+    import requests
+
     print(f"Đang tải dữ liệu từ API {api_url}...")
     response = requests.get(api_url)
     if response.status_code == 200:
@@ -28,116 +55,68 @@ def fetch_csv_from_api(api_url):
     else:
         raise Exception(f"Không thể tải dữ liệu: {response.status_code}")
 
-# Tải dữ liệu từ API
-df = fetch_csv_from_api(cleaned_data_api)
+# Các hàm vẽ nhận dữ liệu đã tổng hợp (dict nhỏ, gửi được sang tiến trình khác)
+# và trả về Figure của matplotlib
 
-# Lọc dữ liệu theo năm
-df_years = {2018: df[df["Year"] == 2018], 2019: df[df["Year"] == 2019]}
-
-# Định nghĩa các cột điểm
-score_columns = [
-    "Toan", "Van", "Ly", "Sinh", "Ngoai ngu", "Hoa", "Lich su", "Dia ly", "GDCD"
-]
-
-# Tính điểm trung bình cho từng môn theo năm
-mean_scores_2018 = df_years[2018][score_columns].replace(-1, float("nan")).mean()
-mean_scores_2019 = df_years[2019][score_columns].replace(-1, float("nan")).mean()
-mean_scores = pd.DataFrame({"2018": mean_scores_2018, "2019": mean_scores_2019})
-
-# Biểu đồ thanh so sánh điểm trung bình giữa 2 năm
-def plot_bar_chart():
+# Biểu đồ thanh so sánh điểm trung bình giữa các năm
+def plot_bar_chart(plt, sns, data):
+    mean_scores = pd.DataFrame({str(year): means for year, means in zip(data['years'], data['means'])},
+                               index=data['labels'])
     fig, ax = plt.subplots(figsize=(10, 6))
     mean_scores.plot(kind="bar", ax=ax)
-    ax.set_title("So sánh điểm trung bình các môn giữa năm 2018 và 2019")
+    ax.set_title(f"So sánh điểm trung bình các môn giữa năm {' và '.join(map(str, data['years']))}")
     ax.set_xlabel("Môn học")
     ax.set_ylabel("Điểm trung bình")
     ax.legend(title="Năm")
-    plt.show()
+    return fig
 
 # Biểu đồ đường thay đổi điểm trung bình
-def plot_line_chart():
+def plot_line_chart(plt, sns, data):
     fig, ax = plt.subplots(figsize=(15, 6))
-    mean_scores_by_year = df.groupby("Year")[score_columns].mean()
+    mean_scores_by_year = pd.DataFrame(data['means'], index=data['years'], columns=data['labels'])
     mean_scores_by_year.plot(kind="line", marker="o", ax=ax)
     ax.set_title("Biểu đồ thay đổi điểm trung bình")
     ax.set_ylabel("Điểm trung bình")
+    ax.set_xticks(data['years'])
     ax.legend(title="Môn học")
-    plt.xticks(rotation=90)
-    plt.show()
+    plt.setp(ax.get_xticklabels(), rotation=90)
+    return fig
 
-# Biểu đồ phân phối điểm cho môn học năm 2018
-def plot_distribution_chart(subject="Toan"):
+# Biểu đồ phân phối điểm cho một môn học của một năm
+def plot_distribution_chart(plt, sns, data):
     fig, ax = plt.subplots(figsize=(8, 5))
-    df_years[2018][subject].replace(-1, float("nan")).dropna().hist(
-        bins=20, color="skyblue", edgecolor="black", ax=ax
-    )
-    ax.set_title(f"Phân phối điểm cho môn {subject} (2018)")
+    edges = np.asarray(data['edges'])
+    ax.bar(edges[:-1], data['counts'], width=np.diff(edges), align='edge', color="skyblue", edgecolor="black")
+    ax.set_title(f"Phân phối điểm cho môn {data['subject']} ({data['year']})")
     ax.set_xlabel("Điểm")
     ax.set_ylabel("Số lượng thí sinh")
-    plt.show()
+    return fig
 
-# Biểu đồ tròn so sánh tỉ lệ đậu rớt của năm 2018 2019
-def plot_pie_chart():
-    Summary_Result_By_Year = "Summary_Result_By_Year.csv"
-    df_2 = pd.read_csv(Summary_Result_By_Year)
+# Biểu đồ tròn so sánh tỉ lệ đậu rớt theo năm
+def plot_pie_chart(plt, sns, data):
     labels = ["Đậu", "Rớt"]
+    fig, ax = plt.subplots(1, len(data['years']), figsize=(6 * len(data['years']), 6), squeeze=False)
+    for axis, year, passed, failed in zip(ax[0], data['years'], data['passed'], data['failed']):
+        axis.pie([passed, failed], labels=labels, autopct="%1.1f%%", startangle=140, colors=["#4CAF50", "#F44336"])
+        axis.set_title(f"{year} Đậu Rớt")
+    return fig
 
-    passed_2018 = df_2["Số thí sinh đậu 2018"].sum()
-    failed_2018 = df_2["Số thí sinh rớt 2018"].sum()
-    values_2018 = [passed_2018, failed_2018]
-
-    passed_2019 = df_2["Số thí sinh đậu 2019"].sum()
-    failed_2019 = df_2["Số thí sinh rớt 2019"].sum()
-    values_2019 = [passed_2019, failed_2019]
-
-    fig, ax = plt.subplots(1, 2, figsize=(12, 6))
-    ax[0].pie(values_2018, labels=labels, autopct="%1.1f%%", startangle=140, colors=["#4CAF50", "#F44336"])
-    ax[0].set_title("2018 Đậu Rớt")
-    ax[1].pie(values_2019, labels=labels, autopct="%1.1f%%", startangle=140, colors=["#4CAF50", "#F44336"])
-    ax[1].set_title("2019 Đậu Rớt")
-    plt.show()
-
-# Biểu đồ khu vực học sinh các khối A, B, C, D đạt các mức điểm năm 2018 - 2019
-def plot_area_chart():
-    khối_học = {
-        'A': ['Toan', 'Ly', 'Hoa'],
-        'B': ['Toan', 'Hoa', 'Sinh'], 
-        'C': ['Van', 'Lich su', 'Dia ly'],
-        'D': ['Toan', 'Van', 'Ngoai ngu']
-    }
-
-    def calculate_average_score(data, subjects):
-        data['Average_Score'] = data[subjects].mean(axis=1)
-        valid_scores = data['Average_Score'][(data['Average_Score'] >= 0) & (data['Average_Score'] <= 10)]
-        distribution = pd.cut(valid_scores, bins=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
-                               right=False, labels=["0-1", "1-2", "2-3", "3-4", "4-5",
-                                                    "5-6", "6-7", "7-8", "8-9", "9-10"]).value_counts()
-        return distribution
+# Biểu đồ khu vực học sinh các khối A, B, C, D đạt các mức điểm
+def plot_area_chart(plt, sns, data):
+    result_df = pd.DataFrame(data['series'], index=data['labels'])
+    fig, ax = plt.subplots(figsize=(10, 6))
+    result_df.plot(kind='area', stacked=False, alpha=0.5, ax=ax)
+    ax.set_title("Phân phối điểm theo khối (Area Chart)", fontsize=14)
+    ax.set_xlabel("Mức điểm", fontsize=12)
+    ax.set_ylabel("Số lượng học sinh", fontsize=12)
+    ax.legend(title="Khối học", bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=10)
+    fig.tight_layout()
+    return fig
 
-    distribution_by_khoi = {}
-    for khoi, subjects in khối_học.items():
-        distribution_by_khoi[khoi] = calculate_average_score(df, subjects)
-
-    result_df = pd.DataFrame(distribution_by_khoi).fillna(0).astype(int).sort_index()
-
-    plt.figure(figsize=(10, 6))
-    result_df.plot(kind='area', stacked=False, alpha=0.5)
-    plt.title("Phân phối điểm theo khối (Area Chart)", fontsize=14)
-    plt.xlabel("Mức điểm", fontsize=12)
-    plt.ylabel("Số lượng học sinh", fontsize=12)
-    plt.legend(title="Khối học", bbox_to_anchor=(1.05, 1), loc='upper left', fontsize=10)
-    plt.tight_layout()
-    plt.show()
-
-# Hàm vẽ heatmap cho các môn học
-def heatmapSubject(data, year):
-    data = data.fillna(0)
-    score_columns = data.columns[1:]
-    data = data[score_columns]
-    data_cleaned = data.drop(columns=["MaTinh"])
-    corr_matrix = data.corr()
-
-    plt.figure(figsize=(10, 8))
+# Heatmap ma trận tương quan giữa các môn học của một năm
+def heatmapSubject(plt, sns, data):
+    corr_matrix = pd.DataFrame(data['matrix'], index=data['labels'], columns=data['labels'])
+    fig, ax = plt.subplots(figsize=(10, 8))
     sns.heatmap(
         corr_matrix,
         annot=True,
@@ -146,33 +125,210 @@ def heatmapSubject(data, year):
         cbar=True,
         square=True,
         linewidths=0.5,
+        ax=ax,
     )
-    plt.title(f"Ma Trận Tương Quan Giữa Các Môn Học Năm {year} TPHCM", fontsize=16)
-    plt.xticks(rotation=45, ha="right")
-    plt.yticks(rotation=0)
-    plt.tight_layout()
-    plt.show()
+    ax.set_title(f"Ma Trận Tương Quan Giữa Các Môn Học Năm {data['year']}", fontsize=16)
+    plt.setp(ax.get_xticklabels(), rotation=45, ha="right")
+    plt.setp(ax.get_yticklabels(), rotation=0)
+    fig.tight_layout()
+    return fig
 
 # Biểu đồ phân tán giữa điểm trung bình môn Toán và môn Văn
-def plot_scatter_chart():
-    df_filtered = df[['Toan', 'Van']]
-    df_mean = df_filtered.groupby('Van')['Toan'].mean().reset_index()
-
-    plt.figure(figsize=(10, 6))
-    sns.scatterplot(x='Van', y='Toan', data=df_mean)
-    plt.title('Biểu đồ phân tán giữa điểm trung bình môn Toán và môn Văn', fontsize=12, pad=15)
-    plt.xlabel('Điểm môn Văn', fontsize=10)
-    plt.ylabel('Điểm môn Toán', fontsize=10)
-    plt.grid(True, linestyle='--', alpha=0.7)
-    plt.tight_layout()
-    plt.show()
-
-# Gọi các hàm để vẽ biểu đồ
-plot_bar_chart()
-plot_line_chart()
-plot_distribution_chart()
-plot_pie_chart()
-plot_area_chart()
-heatmapSubject(df_years[2018], 2018)
-heatmapSubject(df_years[2019], 2019)
-plot_scatter_chart()
\ No newline at end of file
+def plot_scatter_chart(plt, sns, data):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sns.scatterplot(x=data['x'], y=data['y'], ax=ax)
+    ax.set_title('Biểu đồ phân tán giữa điểm trung bình môn Toán và môn Văn', fontsize=12, pad=15)
+    ax.set_xlabel('Điểm môn Văn', fontsize=10)
+    ax.set_ylabel('Điểm môn Toán', fontsize=10)
+    ax.grid(True, linestyle='--', alpha=0.7)
+    fig.tight_layout()
+    return fig
+
+FIGURES = {
+    'bar': plot_bar_chart,
+    'line': plot_line_chart,
+    'distribution': plot_distribution_chart,
+    'pie': plot_pie_chart,
+    'area': plot_area_chart,
+    'heatmap': heatmapSubject,
+    'scatter': plot_scatter_chart,
+}
+
+def render_figure(name, data, fmt, path):
+    """
+    Vẽ một biểu đồ và ghi ra file (ghi file tạm rồi đổi tên); chạy trong tiến trình con
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig = FIGURES[name](plt, sns, data)
+    try:
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        # bbox_inches='tight' để giữ chú thích đặt ngoài vùng vẽ
+        fig.savefig(tmp_path, format=fmt, dpi=IMAGE_DPI, bbox_inches='tight')
+        os.replace(tmp_path, path)
+    finally:
+        plt.close(fig)
+    return path
+
+class ChartRenderer:
+    """
+    Vẽ các biểu đồ song song trong một process pool và cache file ảnh trong directory.
+    Tên file gồm tên biểu đồ và băm dữ liệu đầu vào nên ảnh luôn khớp dữ liệu hiện tại,
+    kể cả sau khi khởi động lại; các tiến trình dùng chung thư mục thì dùng chung cache.
+    inputs(name, params) tính dữ liệu đã tổng hợp cho biểu đồ (ở tiến trình gọi); với cùng
+    version, đường dẫn đã tính được nhớ lại để không phải tính lại dữ liệu.
+    """
+
+    def __init__(self, directory, inputs, workers=None):
+        self.directory = directory
+        self.inputs = inputs
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        if self._executor is None:
+            # spawn: không fork tiến trình đang có nhiều luồng (server, compactor)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def path(self, name, data, fmt):
+        digest = hashlib.blake2b(repr((name, data)).encode(), digest_size=12).hexdigest()
+        return os.path.join(self.directory, f'{name}-{digest}.{fmt}')
+
+    def render(self, figures, fmt, version=None):
+        """
+        Trả về đường dẫn file ảnh của từng (tên, tham số) trong figures; các ảnh chưa có
+        được vẽ đồng thời, ảnh đang được vẽ bởi request khác thì chờ kết quả đó
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        results = []
+        for name, params in figures:
+            key = (name, tuple(sorted(params.items())), fmt)
+            cached = self._paths.get(key)
+            if version is not None and cached is not None and cached[0] == version and os.path.exists(cached[1]):
+                results.append(cached[1])
+                continue
+            data = self.inputs(name, params)
+            path = self.path(name, data, fmt)
+            if version is not None:
+                if len(self._paths) >= MAX_CACHED_FILES:
+                    self._paths.clear()
+                self._paths[key] = (version, path)
+            results.append((path, name, data))
+
+        with self._lock:
+            for i, job in enumerate(results):
+                if isinstance(job, str):
+                    continue
+                path, name, data = job
+                if os.path.exists(path):
+                    results[i] = path
+                    continue
+                future = self._pending.get(path)
+                if future is None:
+                    try:
+                        future = self._pool().submit(render_figure, name, data, fmt, path)
+                    except BrokenProcessPool:
+                        self._executor = None
+                        future = self._pool().submit(render_figure, name, data, fmt, path)
+                    self._pending[path] = future
+                    future.add_done_callback(lambda _, path=path: self._done(path))
+                results[i] = future
+        try:
+            for future in as_completed([f for f in results if not isinstance(f, str)], timeout=RENDER_TIMEOUT):
+                future.result()
+        except BrokenProcessPool:
+            with self._lock:
+                self._executor = None
+            raise
+        self._prune()
+        return [f if isinstance(f, str) else f.result() for f in results]
+
+    def _done(self, path):
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def _prune(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory)
+                       if entry.name.rsplit('.', 1)[-1] in IMAGE_FORMATS]
+        except OSError:
+            return
+        if len(entries) <= MAX_CACHED_FILES:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - MAX_CACHED_FILES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+def report_inputs(df, summary_path="Summary_Result_By_Year.csv"):
+    """
+    Dữ liệu của cả bộ biểu đồ (tên, tham số, dữ liệu) tính từ bảng điểm đã làm sạch (-1 là thiếu điểm)
+    """
+    df = df.replace(-1, float("nan"))
+    years = sorted(int(year) for year in df["Year"].dropna().unique())
+    df_years = {year: df[df["Year"] == year] for year in years}
+    means = df.groupby("Year")[score_columns].mean().reindex(years)
+    mean_data = {'years': years, 'labels': score_columns, 'means': means.values.tolist()}
+    figures = [('bar', {}, mean_data), ('line', {}, mean_data)]
+
+    counts, edges = np.histogram(df_years[years[0]]["Toan"].dropna(), bins=20)
+    figures.append(('distribution', {}, {'subject': 'Toan', 'year': years[0], 'edges': edges.tolist(),
+                                         'counts': counts.tolist()}))
+
+    if os.path.exists(summary_path):
+        df_2 = pd.read_csv(summary_path)
+        pie_years = [year for year in years if f"Số thí sinh đậu {year}" in df_2.columns]
+        figures.append(('pie', {}, {
+            'years': pie_years,
+            'passed': [int(df_2[f"Số thí sinh đậu {year}"].sum()) for year in pie_years],
+            'failed': [int(df_2[f"Số thí sinh rớt {year}"].sum()) for year in pie_years]
+        }))
+
+    series = {}
+    for khoi, subjects in khối_học.items():
+        average = df[subjects].mean(axis=1)
+        valid_scores = average[(average >= 0) & (average <= 10)]
+        distribution = pd.cut(valid_scores, bins=[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+                              right=False, labels=AREA_LABELS).value_counts()
+        series[khoi] = distribution.reindex(AREA_LABELS).fillna(0).astype(int).tolist()
+    figures.append(('area', {}, {'labels': AREA_LABELS, 'series': series}))
+
+    for year in years:
+        data = df_years[year].fillna(0)
+        data = data[data.columns[1:]]
+        figures.append(('heatmap', {'year': year}, {'year': year, 'labels': list(data.columns),
+                                                     'matrix': data.corr().values.tolist()}))
+
+    df_mean = df[['Toan', 'Van']].groupby('Van')['Toan'].mean().reset_index()
+    figures.append(('scatter', {}, {'x': df_mean['Van'].tolist(), 'y': df_mean['Toan'].tolist()}))
+    return figures
+
+def main(directory='charts', fmt='png'):
+    # Vẽ cả bộ biểu đồ song song và ghi ra directory
+    df = fetch_csv_from_api(cleaned_data_api)
+    figures = report_inputs(df)
+    inputs = {(name, tuple(sorted(params.items()))): data for name, params, data in figures}
+    renderer = ChartRenderer(directory, lambda name, params: inputs[(name, tuple(sorted(params.items())))])
+    try:
+        for path in renderer.render([(name, params) for name, params, _ in figures], fmt):
+            print(f"Đã vẽ {path}")
+    finally:
+        renderer.shutdown()
+
+if __name__ == '__main__':
+    main()
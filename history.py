@@ -0,0 +1,324 @@
+import ast
+import bisect
+import csv
+import json
+import os
+import threading
+import time
+
+# Nén lại file nhật ký khi số tombstone vượt số mục còn hiệu lực (tối thiểu mức này)
+COMPACT_MIN_TOMBSTONES = 1000
+
+
+class OperationJournal:
+    """
+    Nhật ký thao tác dạng JSON lines, chỉ ghi thêm (append-only).
+    Mỗi thao tác là một dòng {"id": ..., "operation": ..., ...};
+    xóa một mục ghi thêm tombstone {"deleted": id}.
+    fsync được gom theo lô: sau sync_every dòng hoặc sync_interval giây.
+    """
+
+    def __init__(self, path, sync_every=100, sync_interval=1.0):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.next_id = 0
+        self.live = 0
+        self.tombstones = 0
+        self._pending = 0
+        self._last_sync = time.time()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Đọc tuần tự file nhật ký, trả về các mục còn hiệu lực theo thứ tự ghi
+        """
+        records = {}
+        self.tombstones = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Dòng cuối có thể bị ghi dở khi tiến trình dừng đột ngột
+                        print(f"Bỏ qua dòng nhật ký lỗi: {line[:80]}")
+                        continue
+                    if 'deleted' in entry:
+                        records.pop(entry['deleted'], None)
+                        self.tombstones += 1
+                    else:
+                        records[entry['id']] = entry
+                        self.next_id = max(self.next_id, entry['id'] + 1)
+        self.live = len(records)
+        return list(records.values())
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        return self._file
+
+    def _write(self, entry):
+        f = self._open()
+        f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        self._pending += 1
+        if self._pending >= self.sync_every or time.time() - self._last_sync >= self.sync_interval:
+            self._sync()
+
+    def _sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def append(self, record):
+        """
+        Ghi thêm một thao tác, gán và trả về id của mục
+        """
+        with self._lock:
+            record['id'] = self.next_id
+            self.next_id += 1
+            self.live += 1
+            self._write(record)
+            return record['id']
+
+    def delete(self, entry_id):
+        with self._lock:
+            self.live -= 1
+            self.tombstones += 1
+            self._write({'deleted': entry_id})
+
+    def flush(self):
+        with self._lock:
+            self._sync()
+
+    def clear(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            open(self.path, 'w').close()
+            self.live = 0
+            self.tombstones = 0
+            self._pending = 0
+
+    def needs_compaction(self):
+        return self.tombstones >= max(COMPACT_MIN_TOMBSTONES, self.live)
+
+    def compact(self, records):
+        """
+        Ghi lại file chỉ gồm các mục còn hiệu lực (ghi file tạm rồi đổi tên),
+        gán id cho các mục chưa có
+        """
+        with self._lock:
+            for record in records:
+                if 'id' not in record:
+                    record['id'] = self.next_id
+                    self.next_id += 1
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.live = len(records)
+            self.tombstones = 0
+            self._pending = 0
+
+
+def _index_key(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class HistoryIndex:
+    """
+    Lịch sử thao tác trong bộ nhớ kèm chỉ mục phụ theo loại thao tác, SBD và Year.
+    Các id tăng dần theo thứ tự ghi nên mỗi danh sách chỉ mục đã được sắp xếp.
+    Xóa một mục chỉ bỏ nó khỏi `entries` và để lại id (tombstone) trong các danh sách,
+    được bỏ qua khi truy vấn; vị trí của mục trong số các mục còn hiệu lực tính bằng
+    cây Fenwick trên các ô của `order`. Khi số tombstone vượt ngưỡng nén nhật ký
+    (COMPACT_MIN_TOMBSTONES hoặc số mục còn hiệu lực), chỉ mục được dựng lại.
+    """
+
+    def __init__(self, records=()):
+        self.clear()
+        for record in records:
+            self.append(record)
+
+    def clear(self):
+        self.entries = {}
+        self.order = []
+        self.times = []
+        self.by_operation = {}
+        self.by_sbd = {}
+        self.by_year = {}
+        self.removed = 0
+        # Cây Fenwick (chỉ số từ 1) đếm các ô còn hiệu lực của order
+        self._tree = [0]
+
+    def __len__(self):
+        return len(self.order) - self.removed
+
+    def rebuild(self):
+        # Dựng lại chỉ mục, bỏ hẳn id của các mục đã xóa
+        records = self.records()
+        self.clear()
+        for record in records:
+            self.append(record)
+
+    def records(self):
+        return [self.entries[entry_id] for entry_id in self.order if entry_id in self.entries]
+
+    def _count(self, slot):
+        # Số mục còn hiệu lực ở các ô trước slot
+        total, i = 0, slot
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _slot(self, index):
+        # Ô của mục còn hiệu lực thứ index (tìm xuống trên cây Fenwick)
+        slot, rest = 0, index + 1
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            if slot + step < len(self._tree) and self._tree[slot + step] < rest:
+                slot += step
+                rest -= self._tree[slot]
+            step >>= 1
+        return slot
+
+    def append(self, record):
+        entry_id = record['id']
+        self.entries[entry_id] = record
+        self.order.append(entry_id)
+        self.times.append(record.get('time', ''))
+        i = len(self._tree)
+        self._tree.append(1 + self._count(i - 1) - self._count(i - (i & -i)))
+        self.by_operation.setdefault(record.get('operation'), []).append(entry_id)
+        data = record.get('data') if isinstance(record.get('data'), dict) else {}
+        sbd = _index_key(record.get('sbd', data.get('SBD')))
+        if sbd is not None:
+            self.by_sbd.setdefault(sbd, []).append(entry_id)
+        year = _index_key(data.get('Year'))
+        if year is not None:
+            self.by_year.setdefault(year, []).append(entry_id)
+
+    def entry_id(self, index):
+        """
+        Id của mục tại vị trí index (trong số các mục còn hiệu lực, theo thứ tự ghi) hoặc None
+        """
+        if not 0 <= index < len(self):
+            return None
+        return self.order[self._slot(index)]
+
+    def pop(self, index):
+        """
+        Xóa mục tại vị trí index (theo thứ tự ghi), trả về mục đó
+        """
+        entry_id = self.entry_id(index)
+        if entry_id is None:
+            raise IndexError(index)
+        return self.remove(entry_id)
+
+    def remove(self, entry_id):
+        """
+        Xóa mục theo id, trả về mục đó hoặc None nếu không có
+        """
+        record = self.entries.pop(entry_id, None)
+        if record is None:
+            return None
+        i = bisect.bisect_left(self.order, entry_id) + 1
+        while i < len(self._tree):
+            self._tree[i] -= 1
+            i += i & -i
+        self.removed += 1
+        if self.removed >= max(COMPACT_MIN_TOMBSTONES, len(self)):
+            self.rebuild()
+        return record
+
+    def position(self, entry_id):
+        return self._count(bisect.bisect_left(self.order, entry_id))
+
+    def query(self, operation=None, sbd=None, year=None, time_from=None, time_to=None,
+              cursor=None, limit=100, descending=False):
+        """
+        Trả về (các mục, cursor trang sau). cursor là id của mục cuối trang trước.
+        """
+        candidates = [self.order]
+        if operation is not None:
+            candidates.append(self.by_operation.get(operation, []))
+        if sbd is not None:
+            candidates.append(self.by_sbd.get(sbd, []))
+        if year is not None:
+            candidates.append(self.by_year.get(year, []))
+        ids = min(candidates, key=len)
+
+        # Khoảng id theo thời gian (thời gian tăng cùng thứ tự ghi)
+        low, high = 0, len(self.order)
+        if time_from is not None:
+            low = bisect.bisect_left(self.times, time_from)
+        if time_to is not None:
+            high = bisect.bisect_right(self.times, time_to)
+        if low >= high:
+            return [], None
+        min_id, max_id = self.order[low], self.order[high - 1]
+        if cursor is not None:
+            if descending:
+                max_id = min(max_id, cursor - 1)
+            else:
+                min_id = max(min_id, cursor + 1)
+
+        start = bisect.bisect_left(ids, min_id)
+        stop = bisect.bisect_right(ids, max_id)
+        step = range(stop - 1, start - 1, -1) if descending else range(start, stop)
+        results = []
+        for i in step:
+            record = self.entries.get(ids[i])
+            if record is None:
+                continue
+            if operation is not None and record.get('operation') != operation:
+                continue
+            data = record.get('data') if isinstance(record.get('data'), dict) else {}
+            if sbd is not None and _index_key(record.get('sbd', data.get('SBD'))) != sbd:
+                continue
+            if year is not None and _index_key(data.get('Year')) != year:
+                continue
+            if len(results) == limit:
+                return results, results[-1]['id']
+            results.append(record)
+        return results, None
+
+
+def read_legacy_history(csv_path):
+    """
+    Đọc file lịch sử CSV cũ (operation,time,sbd,data), không dùng eval
+    """
+    records = []
+    with open(csv_path, encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            record = {
+                'operation': row['operation'],
+                'time': row['time']
+            }
+            if row.get('sbd'):
+                record['sbd'] = int(float(row['sbd']))
+            if row.get('data'):
+                try:
+                    record['data'] = ast.literal_eval(row['data'])
+                except (ValueError, SyntaxError):
+                    record['data'] = row['data']
+            records.append(record)
+    return records
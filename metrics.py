@@ -0,0 +1,237 @@
+import contextlib
+import cProfile
+import itertools
+import os
+import random
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows không có module resource
+    resource = None
+
+# Ngưỡng (giây) của histogram thời gian
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Ngưỡng (byte) của histogram kích thước response
+SIZE_BUCKETS = (256, 1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20, 64 << 20, 256 << 20)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_labels(self.label_names, key)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    """
+    Histogram kiểu Prometheus: số lần quan sát theo từng ngưỡng, tổng và số lượng, theo nhãn
+    """
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(labels)
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.label_names)
+        # Vị trí ngưỡng đầu tiên >= value (len(buckets) nghĩa là chỉ thuộc +Inf)
+        position = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self.series.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, [("le", _number(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+        return lines
+
+
+class Gauge:
+    """
+    Giá trị đọc lúc xuất metrics: collect() trả về số, hoặc dict (giá trị nhãn) -> số
+    """
+
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.label_names = tuple(labels)
+
+    def render(self):
+        value = self.collect()
+        if value is None:
+            return []
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        for key, item in items:
+            lines.append(f'{self.name}{_labels(self.label_names, key)} {_number(item)}')
+        return lines
+
+
+class Metrics:
+    """
+    Tập metrics của tiến trình, xuất dạng văn bản Prometheus (render).
+    span(name) đo thời gian một đoạn xử lý vào histogram span_duration_seconds.
+    """
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.metrics = []
+        self.spans = self.histogram('span_duration_seconds', 'Thời gian các đoạn xử lý bên trong handler',
+                                    LATENCY_BUCKETS, labels=['span'])
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self._add(Histogram(self.prefix + name, help, buckets, labels))
+
+    def gauge(self, name, help, collect, labels=()):
+        return self._add(Gauge(self.prefix + name, help, collect, labels))
+
+    @contextlib.contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.observe(time.perf_counter() - started, span=name)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:
+                lines.append(f'# Lỗi khi đọc {metric.name}: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+class CountedBody:
+    """
+    Bọc nội dung response dạng luồng: đếm số byte đã gửi và gọi on_close(số byte)
+    một lần khi gửi xong hoặc khi kết nối đóng giữa chừng
+    """
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+        self.sent = 0
+
+    def __iter__(self):
+        for block in self.body:
+            self.sent += len(block)
+            yield block
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close(self.sent)
+
+
+def resident_memory_bytes():
+    """
+    RSS hiện tại của tiến trình (Linux), None nếu không đọc được
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_resident_memory_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class RequestProfiler:
+    """
+    Chạy cProfile cho một phần request được lấy mẫu (tỉ lệ rate) và ghi thống kê
+    (định dạng pstats, mở bằng python -m pstats hoặc snakeviz) vào directory
+    """
+
+    def __init__(self, rate, directory):
+        self.rate = rate
+        self.directory = directory
+        self._sequence = itertools.count()
+
+    def start(self):
+        if self.rate <= 0 or random.random() >= self.rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Đã có profiler khác đang chạy
+            return None
+        return profile
+
+    def stop(self, profile, name):
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name).strip('_') or 'request'
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(self._sequence)}-{safe_name}.prof')
+        profile.dump_stats(path)
+        return path
@@ -0,0 +1,220 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from aggregates import KHOI_HOC
+from schema import SUBJECTS, SCORE_MISSING, SCORE_SCALE, encode_frame
+
+# Khóa dòng SBD << 16 | Year (SBD int32 dương) chiếm KEY_BITS bit thấp của giá trị sắp xếp
+KEY_BITS = 47
+# Giá trị sắp xếp lớn nhất (tổng mã điểm tối đa 9 * 200 < 2^12), để giá trị ghép vừa int64
+VALUE_MAX = (1 << 12) - 1
+SORT_COLUMNS = SUBJECTS + ['total', 'SBD'] + [f'Khối {khoi}' for khoi in KHOI_HOC]
+
+# Dựng lại thứ tự của một cột khi số vị trí bị sửa tại chỗ sau lần dựng vượt ngưỡng
+REBUILD_MIN_PATCHED = 1000
+REBUILD_PATCHED_RATIO = 0.01
+
+
+def row_keys(sbds, years):
+    return (np.asarray(sbds).astype('int64') << 16) | np.asarray(years).astype('int64')
+
+
+def sort_values(columns, col):
+    """
+    Giá trị sắp xếp nguyên của cột col (mã điểm, tổng mã điểm các môn, tổng mã điểm ba
+    môn của khối 'Khối X' hoặc 0 với SBD) từ dict tên cột -> mảng mã; -1 khi không có giá trị
+    """
+    n = len(columns['SBD'])
+    if col == 'SBD':
+        return np.zeros(n, dtype='int64')
+    if col.startswith('Khối '):
+        # Điểm khối chỉ có khi đủ cả ba môn
+        values = [sort_values(columns, subject) for subject in KHOI_HOC[col[len('Khối '):]]]
+        return np.where(np.all([v >= 0 for v in values], axis=0), np.sum(values, axis=0), -1)
+    if col == 'total':
+        codes = np.stack([columns[s] for s in SUBJECTS if s in columns] or [np.full(n, SCORE_MISSING)])
+        present = codes != SCORE_MISSING
+        total = np.where(present, codes, 0).astype('int64').sum(axis=0)
+        return np.where(present.any(axis=0), total, -1)
+    if col not in columns:
+        return np.full(n, -1, dtype='int64')
+    codes = np.asarray(columns[col]).astype('int64')
+    return np.where(codes == SCORE_MISSING, -1, codes)
+
+
+def combined_values(columns, col):
+    """
+    Giá trị sắp xếp ghép với khóa dòng (để thứ tự và cursor ổn định); -1 khi không có
+    """
+    values = sort_values(columns, col)
+    combined = (values << KEY_BITS) | row_keys(columns['SBD'], columns['Year'])
+    return np.where(values >= 0, combined, -1)
+
+
+def score_range(low, high):
+    """
+    Khoảng điểm (float, None = không giới hạn) -> khoảng mã nguyên [low, high]
+    """
+    low = 0 if low is None else math.ceil(low * SCORE_SCALE - 1e-9)
+    high = VALUE_MAX if high is None else math.floor(high * SCORE_SCALE + 1e-9)
+    return max(low, 0), min(high, VALUE_MAX)
+
+
+class StudentQueryIndex:
+    """
+    Truy vấn thí sinh có lọc (Year, MaTinh, khoảng điểm từng môn/tổng điểm), sắp xếp
+    và phân trang theo cursor.
+
+    Với mỗi cột sắp xếp (môn, 'total', 'SBD', 'Khối X') giữ một hoán vị các dòng bảng chính theo
+    (giá trị, SBD, Year), dựng lười khi được truy vấn và dựng lại khi bảng chính được thay
+    mới. Lọc theo khoảng dùng tìm kiếm nhị phân trên hoán vị thay vì quét cả bảng.
+    Truy vấn chạy trên ảnh chụp của store (không giữ lock). Các dòng bị sửa tại chỗ giữa
+    lúc dựng hoán vị và ảnh chụp (snapshot.patched) cùng phần delta được đánh giá trực tiếp
+    trên giá trị của ảnh chụp rồi gộp với kết quả từ hoán vị.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.orders = {}
+
+    @staticmethod
+    def _columns_at(snapshot, positions):
+        data = snapshot.data
+        return {col: data[col].values[positions] for col in data.columns if col in SUBJECTS or col in ('SBD', 'Year', 'MaTinh')}
+
+    def _order(self, snapshot, col):
+        """
+        (main_version, số vị trí patched lúc dựng, giá trị ghép đã sắp xếp, hoán vị vị trí) của cột
+        """
+        entry = self.orders.get(col)
+        if entry is not None and entry[0] == snapshot.main_version:
+            stale = abs(snapshot.patched_count - entry[1])
+            if stale <= max(REBUILD_MIN_PATCHED, REBUILD_PATCHED_RATIO * len(snapshot.data)):
+                return entry
+        data = snapshot.data
+        combined = combined_values({c: data[c].values for c in data.columns}, col)
+        valid = np.flatnonzero(combined >= 0)
+        order = np.argsort(combined[valid], kind='stable')
+        entry = (snapshot.main_version, snapshot.patched_count, combined[valid][order], valid[order].astype('int32'))
+        # Không thay hoán vị của bảng chính mới hơn bằng hoán vị dựng từ ảnh chụp cũ
+        current = self.orders.get(col)
+        if current is None or current[0] <= entry[0]:
+            self.orders[col] = entry
+        return entry
+
+    def _match(self, columns, years, provinces, ranges):
+        mask = np.ones(len(columns['SBD']), dtype=bool)
+        if years:
+            mask &= np.isin(columns['Year'], years)
+        if provinces:
+            mask &= np.isin(columns['MaTinh'], provinces) if 'MaTinh' in columns else False
+        for col, (low, high) in ranges.items():
+            values = sort_values(columns, col)
+            mask &= (values >= low) & (values <= high)
+        return mask
+
+    def query(self, years=None, provinces=None, ranges=None, sort='SBD', descending=False,
+              cursor=None, limit=100, snapshot=None):
+        """
+        Trả về (các dòng theo thứ tự, cursor trang sau hoặc None).
+        ranges: dict cột (môn hoặc 'total') -> khoảng mã nguyên [low, high] (xem score_range);
+        chỉ gồm các dòng có giá trị ở cột sắp xếp. snapshot mặc định là ảnh chụp hiện tại.
+        """
+        ranges = dict(ranges or {})
+        if snapshot is None:
+            snapshot = self.store.snapshot()
+        data = snapshot.data
+        if 'SBD' not in data.columns:
+            return [], None
+        order = self._order(snapshot, sort)
+
+        # Khoảng giá trị ghép cần lấy của cột sắp xếp (theo khoảng điểm và cursor)
+        low, high = ranges.get(sort, (0, VALUE_MAX))
+        low, high = low << KEY_BITS, ((high + 1) << KEY_BITS) - 1
+        if cursor is not None:
+            if descending:
+                high = min(high, cursor - 1)
+            else:
+                low = max(low, cursor + 1)
+
+        # Chọn khoảng điểm hẹp nhất làm điểm xuất phát nếu hẹp hơn hẳn việc duyệt theo thứ tự
+        plans = []
+        for col, (col_low, col_high) in ranges.items():
+            if col == sort:
+                continue
+            entry = self._order(snapshot, col)
+            start = np.searchsorted(entry[2], col_low << KEY_BITS, 'left')
+            stop = np.searchsorted(entry[2], ((col_high + 1) << KEY_BITS) - 1, 'right')
+            plans.append((stop - start, entry, start, stop))
+        start = np.searchsorted(order[2], low, 'left')
+        stop = np.searchsorted(order[2], high, 'right')
+        counts = [entry[1] for entry in [order] + [plan[1] for plan in plans]] + [snapshot.patched_count]
+
+        # Vị trí bị sửa giữa lúc dựng một trong các hoán vị được dùng và ảnh chụp
+        # (hoán vị có thể dựng từ ảnh chụp mới hơn): đánh giá riêng
+        stale = np.unique(np.array(snapshot.patched[min(counts):max(counts)], dtype='int64'))
+        usable = snapshot.alive.copy()
+        usable[stale] = False
+
+        plan = min(plans, key=lambda p: p[0]) if plans else None
+        if plan is not None and plan[0] * 4 < stop - start:
+            positions = plan[1][3][plan[2]:plan[3]]
+            positions = positions[usable[positions]]
+            columns = self._columns_at(snapshot, positions)
+            positions = positions[self._match(columns, years, provinces, ranges)]
+            combined = combined_values(self._columns_at(snapshot, positions), sort)
+            keep = (combined >= low) & (combined <= high)
+            main_positions, main_combined = positions[keep], combined[keep]
+        else:
+            main_positions, main_combined = self._scan(snapshot, order, start, stop, descending, usable,
+                                                       years, provinces, ranges, limit)
+
+        # Các dòng bị sửa tại chỗ (còn hiệu lực) và phần delta, theo giá trị của ảnh chụp
+        stale = stale[snapshot.alive[stale]]
+        delta_positions = [len(data) + i for i, row in enumerate(snapshot.delta) if row is not None]
+        columns = self._columns_at(snapshot, stale)
+        if delta_positions:
+            delta = encode_frame(pd.DataFrame([row for row in snapshot.delta if row is not None],
+                                              columns=snapshot.columns))
+            columns = {col: np.concatenate([values, delta[col].to_numpy()]) if col in delta.columns else values
+                       for col, values in columns.items()}
+        overlay = np.concatenate([stale, np.array(delta_positions, dtype='int64')])
+        if len(overlay):
+            combined = combined_values(columns, sort)
+            keep = self._match(columns, years, provinces, ranges) & (combined >= low) & (combined <= high)
+            main_positions = np.concatenate([main_positions.astype('int64'), overlay[keep]])
+            main_combined = np.concatenate([main_combined, combined[keep]])
+
+        ranked = np.argsort(-main_combined if descending else main_combined, kind='stable')[:limit + 1]
+        positions = main_positions[ranked].tolist()
+        next_cursor = None
+        if len(positions) > limit:
+            positions, next_cursor = positions[:limit], int(main_combined[ranked[limit - 1]])
+        return snapshot.rows(positions), next_cursor
+
+    def _scan(self, snapshot, order, start, stop, descending, usable, years, provinces, ranges, limit):
+        # Duyệt hoán vị theo thứ tự sắp xếp từng khối (khối lớn dần) tới khi đủ limit + 1 dòng
+        found_positions, found_combined, found = [], [], 0
+        block = max(4 * (limit + 1), 4096)
+        while start < stop and found <= limit:
+            if descending:
+                piece = slice(max(start, stop - block), stop)
+                stop = piece.start
+            else:
+                piece = slice(start, min(stop, start + block))
+                start = piece.stop
+            positions, combined = order[3][piece], order[2][piece]
+            if descending:
+                positions, combined = positions[::-1], combined[::-1]
+            keep = usable[positions]
+            positions, combined = positions[keep], combined[keep]
+            keep = self._match(self._columns_at(snapshot, positions), years, provinces, ranges)
+            found_positions.append(positions[keep])
+            found_combined.append(combined[keep])
+            found += int(keep.sum())
+            block *= 2
+        if not found_positions:
+            return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64')
+        return np.concatenate(found_positions), np.concatenate(found_combined)
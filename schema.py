@@ -0,0 +1,237 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+SUBJECTS = ['Toan', 'Van', 'Ly', 'Hoa', 'Sinh', 'Ngoai ngu', 'Lich su', 'Dia ly', 'GDCD']
+SUBJECT_LABELS = ['Toán', 'Văn', 'Lý', 'Hóa', 'Sinh', 'Ngoại ngữ', 'Lịch sử', 'Địa lý', 'GDCD']
+
+# Điểm lưu dạng mã uint8 = điểm * 20 (lượng tử 0.05 điểm, biểu diễn chính xác cả
+# lưới 0.25 của các môn lẫn lưới 0.2 của Ngoại ngữ); 255 nghĩa là không có điểm
+SCORE_SCALE = 20
+SCORE_MAX_CODE = 10 * SCORE_SCALE
+SCORE_MISSING = 255
+SCORE_DTYPE = np.dtype('uint8')
+
+# Các cột khóa; giá trị 0 nghĩa là không có
+KEY_DTYPES = {
+    'SBD': np.dtype('int32'),
+    'Year': np.dtype('int16'),
+    'MaTinh': np.dtype('uint8'),
+}
+KEY_MISSING = 0
+
+
+def column_dtype(col):
+    if col in SUBJECTS:
+        return SCORE_DTYPE
+    return KEY_DTYPES.get(col)
+
+
+def _is_missing(value):
+    return value is None or value == '' or (isinstance(value, float) and math.isnan(value))
+
+
+def coerce_score(col, value):
+    """
+    Điểm hợp lệ (float trên lưới 0.05) hoặc None; ValueError nếu không hợp lệ
+    """
+    if _is_missing(value) or value == 'Không có':
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Điểm {col} không hợp lệ: {value}')
+    if math.isnan(value):
+        return None
+    if not 0 <= value <= 10:
+        raise ValueError(f'Điểm {col} phải nằm trong khoảng 0-10')
+    return round(value * SCORE_SCALE) / SCORE_SCALE
+
+
+def coerce_key(col, value):
+    if _is_missing(value):
+        if col == 'MaTinh':
+            return None
+        raise ValueError(f'Thiếu giá trị {col}')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Giá trị {col} không hợp lệ: {value}')
+    if math.isnan(number) or number != int(number):
+        raise ValueError(f'Giá trị {col} không hợp lệ: {value}')
+    info = np.iinfo(KEY_DTYPES[col])
+    if not 0 < number <= info.max:
+        raise ValueError(f'Giá trị {col} nằm ngoài phạm vi: {value}')
+    return int(number)
+
+
+def coerce_row(row):
+    """
+    Chuẩn hóa một dòng (dict) theo schema: điểm về lưới 0.05, SBD/Year/MaTinh về int
+    """
+    result = {}
+    for col, value in row.items():
+        if col in SUBJECTS:
+            result[col] = coerce_score(col, value)
+        elif col in KEY_DTYPES:
+            result[col] = coerce_key(col, value)
+        else:
+            result[col] = value
+    return result
+
+
+def coerce_column(col, values):
+    """
+    Chuẩn hóa cả một cột giá trị thô theo cùng quy tắc với coerce_score/coerce_key,
+    vector hóa. Trả về (mảng float64, NaN khi không có; mảng lỗi, None nếu hợp lệ)
+    """
+    if getattr(values, 'dtype', None) is not None and values.dtype.kind in 'iuf':
+        # Cột đã là số (ví dụ do read_csv đọc ra): không cần phân tích chuỗi
+        numbers = np.array(values, dtype='float64')
+        missing = np.isnan(numbers)
+        raw = pd.Series(numbers)
+    else:
+        raw = pd.Series(list(values), dtype=object)
+        missing = (raw.isna() | (raw == '')).to_numpy()
+        if col in SUBJECTS:
+            missing = missing | (raw == 'Không có').to_numpy()
+        numbers = np.array(pd.to_numeric(raw.where(~missing), errors='coerce'), dtype='float64')
+    errors = np.full(len(raw), None, dtype=object)
+    invalid = ~missing & np.isnan(numbers)
+    if col in SUBJECTS:
+        out_of_range = ~invalid & ~missing & ~((numbers >= 0) & (numbers <= 10))
+        for i in np.flatnonzero(invalid):
+            errors[i] = f'Điểm {col} không hợp lệ: {raw[i]}'
+        errors[out_of_range] = f'Điểm {col} phải nằm trong khoảng 0-10'
+        numbers = np.round(numbers * SCORE_SCALE) / SCORE_SCALE
+    else:
+        with np.errstate(invalid='ignore'):
+            invalid |= ~missing & (numbers != np.trunc(numbers))
+        out_of_range = ~invalid & ~missing & ~((numbers > 0) & (numbers <= np.iinfo(KEY_DTYPES[col]).max))
+        for i in np.flatnonzero(invalid):
+            errors[i] = f'Giá trị {col} không hợp lệ: {raw[i]}'
+        for i in np.flatnonzero(out_of_range):
+            errors[i] = f'Giá trị {col} nằm ngoài phạm vi: {raw[i]}'
+        if col != 'MaTinh':
+            errors[missing] = f'Thiếu giá trị {col}'
+    numbers[missing | invalid | out_of_range] = np.nan
+    return numbers, errors
+
+
+def coerce_frame(frame):
+    """
+    Chuẩn hóa và mã hóa cả bảng giá trị thô (vector hóa theo từng cột).
+    Trả về (bảng theo schema gọn, mảng lỗi đầu tiên của từng dòng hoặc None)
+    """
+    errors = np.full(len(frame), None, dtype=object)
+    columns = {}
+    for col in frame.columns:
+        if column_dtype(col) is None:
+            columns[col] = frame[col].to_numpy()
+            continue
+        numbers, col_errors = coerce_column(col, frame[col])
+        errors = np.where(pd.isna(errors), col_errors, errors)
+        columns[col] = encode_column(col, numbers)
+    return pd.DataFrame(columns), errors
+
+
+def encode_value(col, value):
+    # Giá trị đã chuẩn hóa -> giá trị lưu trong cột gọn
+    if col in SUBJECTS:
+        return SCORE_MISSING if value is None else int(round(value * SCORE_SCALE))
+    if col in KEY_DTYPES:
+        return KEY_MISSING if value is None else value
+    return np.nan if value is None else value
+
+
+def decode_value(col, value):
+    # Giá trị trong cột gọn -> giá trị trả ra ngoài (NaN khi không có)
+    if col in SUBJECTS and isinstance(value, np.integer):
+        return np.nan if value == SCORE_MISSING else int(value) / SCORE_SCALE
+    if col in KEY_DTYPES and isinstance(value, np.integer):
+        return np.nan if value == KEY_MISSING else int(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def encode_column(col, values):
+    """
+    Mã hóa một cột (Series/mảng) theo schema, giữ nguyên nếu đã đúng kiểu
+    """
+    dtype = column_dtype(col)
+    if dtype is None or getattr(values, 'dtype', None) == dtype:
+        return values
+    numbers = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype='float64')
+    if col in SUBJECTS:
+        codes = np.round(numbers * SCORE_SCALE)
+        invalid = np.isnan(codes) | (codes < 0) | (codes > SCORE_MAX_CODE)
+        return np.where(invalid, SCORE_MISSING, codes).astype(dtype)
+    info = np.iinfo(dtype)
+    invalid = np.isnan(numbers) | (numbers <= 0) | (numbers > info.max)
+    return np.where(invalid, KEY_MISSING, numbers).astype(dtype)
+
+
+def encode_frame(frame):
+    """
+    Bảng theo schema gọn; các cột ngoài schema giữ nguyên
+    """
+    if all(column_dtype(col) in (None, frame[col].dtype) for col in frame.columns):
+        return frame
+    columns = {col: encode_column(col, frame[col]) for col in frame.columns}
+    return pd.DataFrame(columns, index=frame.index, copy=False)
+
+
+def decode_column(col, values):
+    """
+    Cột gọn -> float64 (điểm) hoặc int64 (khóa, float64 nếu có giá trị thiếu)
+    """
+    values = np.asarray(values)
+    dtype = column_dtype(col)
+    if dtype is None or values.dtype != dtype:
+        return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype='float64')
+    if col in SUBJECTS:
+        decoded = values.astype('float64') / SCORE_SCALE
+        decoded[values == SCORE_MISSING] = np.nan
+        return decoded
+    missing = values == KEY_MISSING
+    if missing.any():
+        decoded = values.astype('float64')
+        decoded[missing] = np.nan
+        return decoded
+    return values.astype('int64')
+
+
+# Chuỗi của từng mã điểm (giống cách pandas ghi float ra CSV), ô trống khi không có điểm
+SCORE_TEXT = np.array([repr(code / SCORE_SCALE) for code in range(256)], dtype=object)
+SCORE_TEXT[SCORE_MISSING] = ''
+
+
+def format_column(col, values):
+    """
+    Cột gọn -> mảng chuỗi để ghi CSV (chuỗi rỗng khi thiếu giá trị), không qua float
+    """
+    values = np.asarray(values)
+    dtype = column_dtype(col)
+    if col in SUBJECTS and values.dtype == dtype:
+        return SCORE_TEXT[values]
+    if dtype is not None and values.dtype == dtype:
+        texts = values.astype(str).astype(object)
+        texts[values == KEY_MISSING] = ''
+        return texts
+    return np.array(['' if pd.isna(v) else str(v) for v in decode_column(col, values).tolist()], dtype=object)
+
+
+def decode_frame(frame, columns=None):
+    """
+    Bảng giá trị thật (float/int) từ bảng gọn, chỉ giải mã các cột được chọn
+    """
+    columns = list(frame.columns) if columns is None else columns
+    return pd.DataFrame({col: decode_column(col, frame[col]) for col in columns}, index=frame.index)
+
+
+def memory_per_row(frame):
+    if len(frame) == 0:
+        return 0.0
+    return float(frame.memory_usage(index=False, deep=True).sum()) / len(frame)
@@ -0,0 +1,277 @@
+import fcntl
+import os
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from snapshot import publish_table, map_table, read_manifest
+
+LOCK_FILE = 'coordinator.lock'
+SOCKET_FILE = 'coordinator.sock'
+VERSION_FILE = 'version'
+TABLE_DIR = 'table'
+
+# Thao tác chỉ phát lại được bằng cách tải bảng vừa công bố; write(PUBLISH) công bố lại
+# bảng ngay (ví dụ sau khi nhập xong một file lớn)
+PUBLISH = 'publish'
+# Công bố lại bảng sau số thao tác đổi bảng (hoặc số dòng trong các khối dòng được nối thêm)
+# này để các worker bỏ các trang đã sao chép riêng; thao tác lịch sử không được tính
+PUBLISH_EVERY = 10000
+PUBLISH_ROWS = 1000000
+# Số thao tác gần nhất coordinator giữ lại cho worker bắt kịp
+LOG_LIMIT = 50000
+# Thời gian worker chờ coordinator tải xong dữ liệu (giây)
+ATTACH_TIMEOUT = 600
+
+
+class CoordinatorUnavailable(Exception):
+    pass
+
+
+class SharedData:
+    """
+    Dùng chung dữ liệu giữa các tiến trình pre-fork (ví dụ gunicorn -w N, không --preload).
+
+    Tiến trình đầu tiên giữ được khóa file trong thư mục là coordinator: nó tải dữ liệu,
+    là nơi duy nhất thực hiện thao tác ghi và công bố bảng thành các file cột
+    (snapshot.publish_table). Các tiến trình khác là worker: memory-map bảng đã công bố
+    (các trang được chia sẻ qua page cache, không nhân bộ nhớ theo số worker), gửi
+    thao tác ghi tới coordinator qua socket và phát lại các thao tác mới theo thứ tự.
+
+    operations: tên -> (hàm thực hiện trên coordinator, hàm phát lại ở worker); hàm phát
+    lại là None nếu thao tác không đổi dữ liệu, PUBLISH nếu worker phải tải lại bảng.
+    Tham số là bảng (ví dụ khối dòng nối thêm) được tính theo số dòng vào ngưỡng công bố lại.
+    state_operations là các thao tác chỉ đổi trạng thái ngoài bảng (không tính vào ngưỡng
+    công bố lại); data_version là version của thao tác gần nhất đổi bảng (giống nhau ở mọi
+    tiến trình). Worker tụt sau log gắn lại: tải bảng đã công bố, phát lại các thao tác đổi
+    bảng từ lần công bố đó (table_log) và nhận toàn bộ trạng thái ngoài bảng.
+    Sau mỗi thao tác, coordinator tăng version và ghi vào file version (memory-map, kèm
+    seq của lần công bố gần nhất) để worker biết cần bắt kịp (sync, gọi đầu mỗi request). export_state/import_state
+    chuyển phần trạng thái ngoài bảng (lịch sử thao tác) khi worker gắn vào.
+    """
+
+    def __init__(self, directory, store, operations, export_state, import_state, authkey, state_operations=()):
+        self.directory = directory
+        self.table_dir = os.path.join(directory, TABLE_DIR)
+        self.address = os.path.join(directory, SOCKET_FILE)
+        self.store = store
+        self.operations = operations
+        self.state_operations = set(state_operations)
+        self.export_state = export_state
+        self.import_state = import_state
+        self.authkey = authkey
+        self.lock = threading.RLock()
+        self.version = 0
+        self.data_version = 0
+        self.seq = None
+        self.log = []
+        self.table_log = []
+        self.since_publish = 0
+        self.rows_since_publish = 0
+        self.published_version = 0
+        self._counter = None
+        self._local = threading.local()
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.is_coordinator = True
+        except BlockingIOError:
+            self.is_coordinator = False
+
+    @property
+    def role(self):
+        return 'coordinator' if self.is_coordinator else 'worker'
+
+    # --- coordinator ---
+
+    def start(self):
+        """
+        Coordinator: công bố bảng đã tải rồi mở socket nhận thao tác từ các worker
+        """
+        with self.lock:
+            self._counter = np.memmap(os.path.join(self.directory, VERSION_FILE), dtype='int64', mode='w+', shape=(2,))
+            self.publish()
+        if os.path.exists(self.address):
+            os.remove(self.address)
+        listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self._accept, args=(listener,), name='coordinator', daemon=True).start()
+        print(f"Coordinator dữ liệu dùng chung: {self.address} (pid {os.getpid()})")
+
+    def publish(self):
+        with self.lock:
+            manifest = publish_table(self.store, self.table_dir, version=self.version, data_version=self.data_version)
+            self.seq = manifest['seq']
+            self.table_log = []
+            self.since_publish = 0
+            self.rows_since_publish = 0
+            # Worker chậm hơn lần công bố trước tải bảng mới thay vì phát lại,
+            # nên log chỉ cần giữ các thao tác từ lần công bố trước
+            del self.log[:sum(1 for entry in self.log if entry[0] <= self.published_version)]
+            self.published_version = self.version
+            self._counter[0] = self.version
+            self._counter[1] = self.seq
+            return manifest
+
+    def _accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Lỗi khi nhận kết nối worker: {str(e)}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    if request[0] == 'write':
+                        result = self._execute(request[1], request[2])
+                    elif request[0] == 'changes':
+                        result = self.changes(request[1])
+                    else:
+                        with self.lock:
+                            result = (read_manifest(self.table_dir), list(self.table_log), self.export_state(),
+                                      self.version, self.data_version)
+                    conn.send(('ok', result))
+                except Exception as e:
+                    conn.send(('error', e))
+
+    def _execute(self, name, args):
+        with self.lock:
+            if name == PUBLISH:
+                self.publish()
+                return None
+            execute, replay = self.operations[name]
+            result = execute(*args)
+            if replay is None:
+                return result
+            self.version += 1
+            if name not in self.state_operations:
+                self.data_version = self.version
+            if replay == PUBLISH:
+                # Worker không phát lại mà tải bảng có version từ đây trở đi
+                self.log.append((self.version, None, ()))
+                self.publish()
+            else:
+                self.log.append((self.version, name, args))
+                if name not in self.state_operations:
+                    self.table_log.append((self.version, name, args))
+                    self.since_publish += 1
+                    self.rows_since_publish += sum(len(arg) for arg in args if hasattr(arg, 'columns'))
+                    if self.since_publish >= PUBLISH_EVERY or self.rows_since_publish >= PUBLISH_ROWS:
+                        self.publish()
+            del self.log[:-LOG_LIMIT]
+            self._counter[0] = self.version
+            return result
+
+    def changes(self, since):
+        """
+        Các thao tác (version, tên, tham số) sau version since, hoặc None nếu log không còn đủ
+        """
+        with self.lock:
+            if since >= self.version:
+                return []
+            if not self.log or self.log[0][0] > since + 1:
+                return None
+            return self.log[since + 1 - self.log[0][0]:]
+
+    # --- worker ---
+
+    def _call(self, *request):
+        conn = getattr(self._local, 'conn', None)
+        try:
+            if conn is None:
+                conn = self._local.conn = Client(self.address, authkey=self.authkey)
+            conn.send(request)
+            status, result = conn.recv()
+        except (OSError, EOFError) as e:
+            self._local.conn = None
+            raise CoordinatorUnavailable(f'Không kết nối được coordinator: {e}')
+        if status == 'error':
+            raise result
+        return result
+
+    def attach(self):
+        """
+        Worker: chờ coordinator sẵn sàng, gắn bảng đã công bố và trạng thái lịch sử
+        """
+        deadline = time.time() + ATTACH_TIMEOUT
+        while True:
+            try:
+                self._reattach()
+                break
+            except CoordinatorUnavailable:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+        self._counter = np.memmap(os.path.join(self.directory, VERSION_FILE), dtype='int64', mode='r', shape=(2,))
+        self.sync()
+        print(f"Worker {os.getpid()} dùng bảng chung phiên bản {self.version}")
+
+    def _reattach(self):
+        # Bảng đã công bố + các thao tác đổi bảng từ đó + trạng thái ngoài bảng, cùng lấy
+        # dưới lock của coordinator nên khớp đúng version của coordinator lúc đó
+        manifest, entries, state, version, data_version = self._call('attach')
+        with self.lock:
+            self._load(manifest, notify=True)
+            for _, name, args in entries:
+                self.operations[name][1](*args)
+            self.import_state(state)
+            self.version, self.data_version = version, data_version
+
+    def _load(self, manifest, notify):
+        data, index = map_table(self.table_dir, manifest)
+        self.store.load(data, index=index, notify=notify)
+        self.seq, self.version, self.data_version = manifest['seq'], manifest['version'], manifest['data_version']
+
+    def sync(self):
+        """
+        Worker: phát lại các thao tác mới của coordinator; khi tới đúng version của bảng
+        vừa công bố thì chuyển sang bản memory-map đó (cùng nội dung, không dựng lại thống kê)
+        """
+        if self.is_coordinator or self._counter is None:
+            return
+        if int(self._counter[0]) == self.version and int(self._counter[1]) == self.seq:
+            return
+        with self.lock:
+            while self.version < int(self._counter[0]):
+                entries = self._call('changes', self.version)
+                manifest = read_manifest(self.table_dir)
+                if entries is None:
+                    self._reattach()
+                    continue
+                for version, name, args in entries:
+                    if name is None:
+                        self._reattach()
+                        break
+                    self.operations[name][1](*args)
+                    self.version = version
+                    if name not in self.state_operations:
+                        self.data_version = version
+                    if manifest['seq'] != self.seq and manifest['version'] == self.version:
+                        self._load(manifest, notify=False)
+            # Bảng được công bố lại mà không có thao tác mới (write(PUBLISH))
+            manifest = read_manifest(self.table_dir)
+            if manifest['seq'] != self.seq and manifest['version'] == self.version:
+                self._load(manifest, notify=False)
+
+    # --- chung ---
+
+    def write(self, name, *args):
+        """
+        Thực hiện thao tác ghi: tại coordinator, hoặc gửi tới coordinator rồi bắt kịp phiên bản mới
+        """
+        if self.is_coordinator:
+            return self._execute(name, args)
+        result = self._call('write', name, args)
+        self.sync()
+        return result
@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import column_dtype, encode_column
+from store import CHUNK_ROWS, KeyIndex
+
+MANIFEST_FILE = 'manifest.json'
+
+# Mỗi lúc chỉ một lần save_snapshot (kể cả bước dọn file)
+_save_lock = threading.Lock()
+
+
+def _write_atomic(path, write):
+    # Ghi ra file tạm, fsync rồi đổi tên để không bao giờ để lại file ghi dở
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _save_array(directory, name, values):
+    _write_atomic(os.path.join(directory, name),
+                  lambda f: np.save(f, values, allow_pickle=values.dtype == object))
+    return name
+
+
+def _write_manifest(directory, manifest):
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=1).encode('utf-8')
+    _write_atomic(os.path.join(directory, MANIFEST_FILE), lambda f: f.write(manifest_bytes))
+
+
+def _remove_unreferenced(directory, referenced):
+    # Xóa các file không còn được manifest tham chiếu
+    for name in os.listdir(directory):
+        if name not in referenced:
+            os.remove(os.path.join(directory, name))
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _chunk_digest(values):
+    # Dấu nội dung của một khối cột (None với cột object: không băm được theo byte)
+    if values.dtype == object:
+        return None
+    return hashlib.blake2b(np.ascontiguousarray(values).data, digest_size=16).hexdigest()
+
+
+def _save_chunks(directory, name, values, n_chunks, previous_chunks, previous_digests, clean):
+    """
+    Ghi các khối CHUNK_ROWS dòng của một cột. Khối k được giữ file cũ nếu clean(k)
+    (không bị sửa kể từ lần lưu trước) hoặc có cùng dấu nội dung với khối k cũ
+    (ví dụ các khối đầy phía trước sau khi gộp delta hoặc nối thêm dòng).
+    Trả về (tên file, dấu nội dung, số khối đã ghi).
+    """
+    chunks, digests, written = [], [], 0
+    for k in range(n_chunks):
+        block = values[k * CHUNK_ROWS:(k + 1) * CHUNK_ROWS]
+        if k < len(previous_chunks) and k < len(previous_digests) and clean(k):
+            chunks.append(previous_chunks[k])
+            digests.append(previous_digests[k])
+            continue
+        digest = _chunk_digest(block)
+        if digest is not None and k < len(previous_digests) and previous_digests[k] == digest:
+            chunks.append(previous_chunks[k])
+        else:
+            chunks.append(_save_array(directory, name(k), block))
+            written += 1
+        digests.append(digest)
+    return chunks, digests, written
+
+
+def save_snapshot(store, directory):
+    """
+    Lưu bảng dạng cột nhị phân (.npy theo từng khối CHUNK_ROWS dòng).
+    Chỉ ghi lại các khối có nội dung thay đổi kể từ lần lưu trước; manifest
+    được ghi cuối cùng nên snapshot cũ vẫn đọc được nếu quá trình lưu bị gián đoạn.
+    Chỉ giữ lock của store lúc lấy ảnh chụp và thông tin khối bẩn; băm và ghi file
+    chạy trên ảnh chụp (bất biến) sau khi nhả lock nên không chặn các thao tác ghi.
+    Các lần lưu được thực hiện lần lượt (_save_lock) vì bước dọn file xóa mọi file lạ.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with _save_lock:
+        snapshot, dirty = store.take_dirty()
+        try:
+            manifest = _write_snapshot(snapshot, dirty, directory)
+        except BaseException:
+            store.restore_dirty(dirty)
+            raise
+
+        referenced = {MANIFEST_FILE, manifest['delta'], *manifest['alive']}
+        referenced.update(chunk for col in manifest['columns'] for chunk in col['chunks'])
+        _remove_unreferenced(directory, referenced)
+    return manifest['written']
+
+
+def _write_snapshot(snapshot, dirty, directory):
+    # Ghi các khối thay đổi của ảnh chụp rồi manifest; trả về manifest (kèm số file đã ghi)
+    dirty_chunks, dirty_alive, delta_dirty = dirty
+    previous = read_manifest(directory)
+    data = snapshot.data
+    seq = previous['seq'] + 1 if previous else 0
+    n_chunks = (len(data) + CHUNK_ROWS - 1) // CHUNK_ROWS
+    # Dùng được thông tin khối bẩn khi bảng chính chưa bị thay thế kể từ lần lưu trước
+    tracked = (previous is not None and dirty_chunks is not None
+               and previous['rows'] == len(data) and previous['chunk_rows'] == CHUNK_ROWS)
+    previous_columns = {}
+    if previous is not None and previous['chunk_rows'] == CHUNK_ROWS:
+        previous_columns = {col['name']: col for col in previous['columns']}
+    written = 0
+
+    manifest_columns = []
+    for i, col in enumerate(data.columns):
+        old = previous_columns.get(str(col), {})
+        chunks, digests, count = _save_chunks(
+            directory, lambda k: f'c{i}_{k}_{seq}.npy', data[col].to_numpy(), n_chunks,
+            old.get('chunks', []), old.get('digests', []),
+            lambda k: tracked and (col, k) not in dirty_chunks)
+        manifest_columns.append({'name': str(col), 'dtype': str(data[col].dtype),
+                                 'chunks': chunks, 'digests': digests})
+        written += count
+
+    old_alive = previous if previous_columns else {}
+    alive_chunks, alive_digests, count = _save_chunks(
+        directory, lambda k: f'alive_{k}_{seq}.npy', snapshot.alive, n_chunks,
+        old_alive.get('alive', []), old_alive.get('alive_digests', []),
+        lambda k: tracked and k not in dirty_alive)
+    written += count
+
+    if previous is not None and not delta_dirty:
+        delta_file = previous['delta']
+    else:
+        delta_file = f'delta_{seq}.json'
+        delta = json.dumps(snapshot.delta, ensure_ascii=False, default=str).encode('utf-8')
+        _write_atomic(os.path.join(directory, delta_file), lambda f: f.write(delta))
+        written += 1
+
+    manifest = {
+        'seq': seq,
+        'rows': len(data),
+        'chunk_rows': CHUNK_ROWS,
+        'columns': manifest_columns,
+        'alive': alive_chunks,
+        'alive_digests': alive_digests,
+        'delta': delta_file,
+        'saved_at': time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    _write_manifest(directory, manifest)
+    return dict(manifest, written=written)
+
+
+def load_snapshot(directory):
+    """
+    Đọc snapshot, trả về (bảng chính, mảng alive, các dòng delta) hoặc None nếu chưa có
+    """
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(directory, name), allow_pickle=True)
+
+    columns = {}
+    for col in manifest['columns']:
+        chunks = [load(name) for name in col['chunks']]
+        columns[col['name']] = np.concatenate(chunks) if chunks else np.array([])
+    data = pd.DataFrame(columns)
+    alive = np.concatenate([load(name) for name in manifest['alive']]) if manifest['alive'] else np.ones(0, dtype=bool)
+    with open(os.path.join(directory, manifest['delta']), encoding='utf-8') as f:
+        delta = json.load(f)
+    return data, alive, delta
+
+
+def write_csv_column_cache(directory, csv_path, chunksize=200000, **meta):
+    """
+    Lưu file CSV thành các file cột .npy kèm manifest (schema, số dòng và các thông
+    tin trong meta) để lần sau memory-map thay vì đọc lại CSV. CSV được đọc theo
+    từng khối chunksize dòng nên bộ nhớ không phụ thuộc kích thước file.
+    Các cột trong schema được mã hóa theo schema gọn; các cột khác được đọc dạng số,
+    cột chỉ chứa số nguyên (không có ô trống) lưu int64, còn lại float64.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = read_manifest(directory)
+    seq = previous['seq'] + 1 if previous else 0
+    raw_files, raw_dtypes, integral, rows = {}, {}, {}, 0
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize):
+            for col in chunk.columns:
+                if col not in raw_files:
+                    raw_files[col] = open(os.path.join(directory, f'raw_{len(raw_files)}.tmp'), 'wb')
+                    raw_dtypes[col] = column_dtype(col) or np.dtype('float64')
+                    integral[col] = True
+                if column_dtype(col) is not None:
+                    values = encode_column(col, chunk[col])
+                else:
+                    values = pd.to_numeric(chunk[col], errors='coerce')
+                    integral[col] = integral[col] and values.dtype.kind in 'iu'
+                raw_files[col].write(np.asarray(values, dtype=raw_dtypes[col]).tobytes())
+            rows += len(chunk)
+        for f in raw_files.values():
+            f.close()
+
+        columns = []
+        block = chunksize * 8
+        for i, (col, f) in enumerate(raw_files.items()):
+            raw_dtype = raw_dtypes[col]
+            dtype = raw_dtype if column_dtype(col) is not None else np.dtype('int64' if integral[col] else 'float64')
+            name = f'c{i}_{seq}.npy'
+
+            def write(out, raw_path=f.name, raw_dtype=raw_dtype, dtype=dtype):
+                np.lib.format.write_array_header_1_0(out, {
+                    'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)})
+                with open(raw_path, 'rb') as raw:
+                    while True:
+                        data = raw.read(block)
+                        if not data:
+                            break
+                        out.write(np.frombuffer(data, dtype=raw_dtype).astype(dtype).tobytes())
+
+            _write_atomic(os.path.join(directory, name), write)
+            columns.append({'name': str(col), 'dtype': str(dtype), 'file': name})
+    finally:
+        for f in raw_files.values():
+            f.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+    manifest = dict(meta, seq=seq, rows=rows, columns=columns)
+    _write_manifest(directory, manifest)
+    _remove_unreferenced(directory, {MANIFEST_FILE, *(col['file'] for col in columns)})
+    return manifest
+
+
+def update_manifest(directory, **meta):
+    """
+    Cập nhật thông tin trong manifest (ví dụ thời điểm tải khi nguồn không đổi)
+    """
+    manifest = read_manifest(directory)
+    manifest.update(meta)
+    _write_manifest(directory, manifest)
+    return manifest
+
+
+def map_column_cache(directory):
+    """
+    Mở cache cột bằng memory-map (chế độ copy-on-write: các trang chưa sửa được
+    chia sẻ qua page cache của hệ điều hành giữa các tiến trình)
+    """
+    manifest = read_manifest(directory)
+    columns = {}
+    for col in manifest['columns']:
+        path = os.path.join(directory, col['file'])
+        if col['dtype'] == 'object':
+            columns[col['name']] = np.load(path, allow_pickle=True)
+        else:
+            columns[col['name']] = np.load(path, mmap_mode='c')
+    return pd.DataFrame(columns, copy=False)
+
+
+def publish_table(store, directory, **meta):
+    """
+    Công bố bảng hiện tại (đã gộp delta, bỏ dòng đã xóa) thành các file cột .npy nguyên
+    khối kèm chỉ mục khóa đã sắp xếp, để các tiến trình khác memory-map không cần sao chép.
+    File của lần công bố trước được giữ lại cho các tiến trình đang chuyển sang bản mới.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with store.lock:
+        store.compact()
+        previous = read_manifest(directory)
+        seq = previous['seq'] + 1 if previous else 0
+        data = store.data
+        columns = []
+        for i, col in enumerate(data.columns):
+            values = data[col].to_numpy()
+            columns.append({'name': str(col), 'dtype': str(values.dtype),
+                            'file': _save_array(directory, f'c{i}_{seq}.npy', values)})
+        index = {}
+        if 'SBD' in data.columns and 'Year' in data.columns:
+            keys = KeyIndex.build(data['SBD'].to_numpy(), data['Year'].to_numpy(), np.ones(len(data), dtype=bool))[0]
+            index = {'keys': _save_array(directory, f'index_keys_{seq}.npy', keys.keys),
+                     'positions': _save_array(directory, f'index_positions_{seq}.npy', keys.positions)}
+        manifest = dict(meta, seq=seq, rows=len(data), columns=columns, index=index,
+                        published_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+        _write_manifest(directory, manifest)
+
+    referenced = {MANIFEST_FILE, *index.values(), *(col['file'] for col in columns)}
+    if previous is not None:
+        referenced.update(previous['index'].values())
+        referenced.update(col['file'] for col in previous['columns'])
+    _remove_unreferenced(directory, referenced)
+    return manifest
+
+
+def map_table(directory, manifest):
+    """
+    Mở bảng đã công bố bằng memory-map copy-on-write, trả về (bảng, chỉ mục khóa)
+    """
+    columns = {col['name']: np.load(os.path.join(directory, col['file']), mmap_mode='c')
+               for col in manifest['columns']}
+    index = None
+    if manifest['index']:
+        index = KeyIndex(np.load(os.path.join(directory, manifest['index']['keys']), mmap_mode='r'),
+                         np.load(os.path.join(directory, manifest['index']['positions']), mmap_mode='r'))
+    return pd.DataFrame(columns, copy=False), index
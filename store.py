@@ -0,0 +1,689 @@
+import contextlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from schema import (SUBJECTS, KEY_DTYPES, KEY_MISSING, coerce_row, encode_value, decode_value,
+                    decode_column, encode_column, encode_frame, memory_per_row)
+
+# Gộp phần dữ liệu mới vào bảng chính khi vượt ngưỡng
+# (tối thiểu COMPACT_MIN_ROWS dòng hoặc COMPACT_RATIO kích thước bảng chính)
+COMPACT_MIN_ROWS = 10000
+COMPACT_RATIO = 0.1
+
+# Số dòng mỗi khối (chunk) khi theo dõi phần bảng chính đã thay đổi
+CHUNK_ROWS = 262144
+
+
+def normalize_key(value):
+    """
+    Chuẩn hóa SBD/Year về số nguyên để dùng làm khóa chỉ mục
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _packable(sbd, year):
+    # Khóa gộp SBD << 16 | Year chỉ dùng cho SBD/Year nguyên không âm vừa 31/16 bit
+    return (isinstance(sbd, (int, np.integer)) and isinstance(year, (int, np.integer))
+            and 0 <= sbd < (1 << 31) and 0 <= year < (1 << 16))
+
+
+class KeyIndex:
+    """
+    Chỉ mục (SBD, Year) -> vị trí dòng.
+    Phần gốc là mảng khóa gộp SBD << 16 | Year đã sắp xếp kèm mảng vị trí, dựng vector hóa
+    và có thể là memory-map dùng chung giữa các tiến trình (16 byte mỗi dòng thay vì
+    vài trăm byte của dict). Thay đổi sau khi dựng nằm trong dict added và tập removed
+    (khóa gộp của phần gốc đã bị gỡ).
+    """
+
+    def __init__(self, keys=None, positions=None):
+        self.keys = np.zeros(0, dtype='int64') if keys is None else keys
+        self.positions = np.zeros(0, dtype='int64') if positions is None else positions
+        self.added = {}
+        self.added_years = {}
+        self.removed = set()
+        self._shared = False
+
+    @classmethod
+    def build(cls, sbds, years, valid):
+        """
+        Dựng từ hai cột SBD/Year nguyên, chỉ các dòng valid; khóa trùng chỉ giữ dòng đầu tiên.
+        Trả về (chỉ mục, số dòng trùng)
+        """
+        rows = np.flatnonzero(valid)
+        keys = (np.asarray(sbds)[rows].astype('int64') << 16) | np.asarray(years)[rows].astype('int64')
+        order = np.argsort(keys, kind='stable')
+        keys, rows = keys[order], rows[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+        return cls(keys[first], rows[first]), int((~first).sum())
+
+    def _base(self, code):
+        i = int(np.searchsorted(self.keys, code))
+        if i < len(self.keys) and self.keys[i] == code and code not in self.removed:
+            return int(self.positions[i])
+        return None
+
+    def get(self, key):
+        pos = self.added.get(key)
+        if pos is None and _packable(*key):
+            pos = self._base(int(key[0]) << 16 | int(key[1]))
+        return pos
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        pos = self.get(key)
+        if pos is None:
+            raise KeyError(key)
+        return pos
+
+    def __len__(self):
+        return len(self.keys) - len(self.removed) + len(self.added)
+
+    def snapshot(self):
+        """
+        Bản chỉ đọc của chỉ mục hiện tại: dùng chung mảng gốc và phần thay đổi,
+        lần sửa kế tiếp sao chép phần thay đổi trước (mảng gốc chỉ bị thay, không bị sửa)
+        """
+        view = KeyIndex(self.keys, self.positions)
+        view.added, view.added_years, view.removed = self.added, self.added_years, self.removed
+        self._shared = True
+        return view
+
+    def _own(self):
+        if self._shared:
+            self.added = dict(self.added)
+            self.added_years = {sbd: list(years) for sbd, years in self.added_years.items()}
+            self.removed = set(self.removed)
+            self._shared = False
+
+    def add(self, sbd, year, pos):
+        if (sbd, year) in self:
+            return False
+        self._own()
+        self.added[(sbd, year)] = pos
+        self.added_years.setdefault(sbd, []).append(year)
+        return True
+
+    def remove(self, sbd, year):
+        self._own()
+        key = (sbd, year)
+        if key in self.added:
+            years = self.added_years[sbd]
+            years.remove(year)
+            if not years:
+                del self.added_years[sbd]
+            return self.added.pop(key)
+        pos = self[key]
+        self.removed.add(int(sbd) << 16 | int(year))
+        return pos
+
+    def years(self, sbd):
+        """
+        Các năm đang có của một SBD
+        """
+        years = []
+        if _packable(sbd, 0):
+            start, stop = np.searchsorted(self.keys, [int(sbd) << 16, (int(sbd) + 1) << 16])
+            years = [code & 0xFFFF for code in self.keys[start:stop].tolist() if code not in self.removed]
+        return years + self.added_years.get(sbd, [])
+
+    def extend(self, sbds, years, start):
+        """
+        Thêm vào phần gốc các khóa (chưa có trong chỉ mục) của khối dòng bắt đầu ở vị trí
+        start; các thay đổi đang nằm ngoài phần gốc được gộp vào luôn
+        """
+        self._own()
+        keep = np.ones(len(self.keys), dtype=bool)
+        if self.removed:
+            keep = ~np.isin(self.keys, np.fromiter(self.removed, dtype='int64'))
+        packed = [(key, pos) for key, pos in self.added.items() if _packable(*key)]
+        added_keys = np.array([int(sbd) << 16 | int(year) for (sbd, year), _ in packed], dtype='int64')
+        added_positions = np.array([pos for _, pos in packed], dtype='int64')
+        new_keys = (np.asarray(sbds).astype('int64') << 16) | np.asarray(years).astype('int64')
+        keys = np.concatenate([self.keys[keep], added_keys, new_keys])
+        positions = np.concatenate([self.positions[keep], added_positions,
+                                    np.arange(start, start + len(new_keys), dtype='int64')])
+        order = np.argsort(keys, kind='stable')
+        for key, _ in packed:
+            self.remove(*key)
+        self.keys, self.positions = keys[order], positions[order]
+        self.removed = set()
+
+
+class StoreSnapshot:
+    """
+    Ảnh chụp chỉ đọc của bảng tại một phiên bản: bảng chính, mảng alive, phần delta,
+    chỉ mục khóa, các vị trí bị sửa tại chỗ (patched[:patched_count]) và bản chỉ đọc của
+    các listener có snapshot() (view(listener)). Không phần nào bị sửa sau khi chụp (bên ghi
+    sao chép trước khi sửa tại chỗ) nên đọc không cần lock; người đọc không được sửa chúng.
+    frame (các dòng còn hiệu lực, đã mã hóa) chỉ được dựng khi cần.
+    """
+
+    def __init__(self, version, data, alive, delta, columns, index, main_version, patched, views):
+        self.version = version
+        self.data = data
+        self.alive = alive
+        self.delta = delta
+        self.columns = columns
+        self.index = index
+        self.main_version = main_version
+        self.patched = patched
+        self.patched_count = len(patched)
+        self.views = views
+        self._frame = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def view(self, listener):
+        return self.views[listener]
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            main = self.data if self.alive.all() else self.data[self.alive]
+            rows = [row for row in self.delta if row is not None]
+            if rows:
+                main = pd.concat([main, encode_frame(pd.DataFrame(rows, columns=self.columns))], ignore_index=True)
+            self._frame = main.reset_index(drop=True) if main is not self.data else main
+        return self._frame
+
+    def _row(self, pos):
+        if pos >= len(self.data):
+            row = self.delta[pos - len(self.data)]
+            return {col: np.nan if row.get(col) is None else row[col] for col in self.columns}
+        return {col: decode_value(col, self.data[col].values[pos]) for col in self.data.columns}
+
+    def rows(self, positions):
+        """
+        Các dòng (đã giải mã) tại các vị trí cho trước; phần bảng chính được lấy theo cột
+        """
+        n = len(self.data)
+        main = np.array([pos for pos in positions if pos < n], dtype='int64')
+        columns = {}
+        for col in self.data.columns:
+            values = self.data[col].values[main]
+            if col in SUBJECTS:
+                columns[col] = decode_column(col, values).tolist()
+            elif col in KEY_DTYPES:
+                columns[col] = [np.nan if v == KEY_MISSING else v for v in values.tolist()]
+            else:
+                columns[col] = [decode_value(col, v) for v in values]
+        result = []
+        i = 0
+        for pos in positions:
+            if pos < n:
+                result.append({col: values[i] for col, values in columns.items()})
+                i += 1
+            else:
+                result.append(self._row(pos))
+        return result
+
+    def contains(self, sbd, year):
+        return (normalize_key(sbd), normalize_key(year)) in self.index
+
+    def get(self, sbd, year):
+        pos = self.index.get((normalize_key(sbd), normalize_key(year)))
+        return None if pos is None else self._row(pos)
+
+    def find(self, sbd):
+        """
+        Tất cả bản ghi của một SBD (mọi năm), theo thứ tự trong bảng
+        """
+        sbd = normalize_key(sbd)
+        return [self._row(pos) for pos in sorted(self.index[(sbd, year)] for year in self.index.years(sbd))]
+
+
+class StudentStore:
+    """
+    Bảng điểm thí sinh kèm chỉ mục (SBD, Year) -> vị trí dòng.
+    Bảng chính lưu theo schema gọn (schema.py); mọi dòng ghi vào đều được chuẩn hóa
+    bằng coerce_row (ValueError nếu không hợp lệ), các dòng đọc ra đã được giải mã.
+    Dòng bị xóa chỉ được đánh dấu (tombstone) nên vị trí các dòng khác không đổi.
+    Dòng mới được ghi vào phần delta (list các dict), vị trí len(data) + i,
+    và định kỳ được gộp (compact) vào bảng chính.
+
+    Các cấu trúc dẫn xuất (thống kê, histogram, ...) đăng ký qua add_listener:
+    listener.rebuild(frame) khi nạp bảng và listener.apply(old, new) sau mỗi
+    lần ghi, với old/new là dict của dòng (None khi thêm mới hoặc xóa).
+    main_version tăng mỗi khi bảng chính được thay mới (nạp, gộp, nối khối);
+    patched ghi lần lượt các vị trí bảng chính bị sửa tại chỗ kể từ đó (chỉ nối thêm).
+    Với apply_batch, listener có apply_many(changes) nhận cả list (old, new) một lần;
+    với append_frame, listener có extend(frame) nhận cả khối dòng mới (đã mã hóa).
+
+    Mọi thao tác ghi được tuần tự hóa bằng lock; version tăng sau mỗi lần dữ liệu đổi.
+    Người đọc lấy snapshot() (StoreSnapshot bất biến, gồm cả bản chỉ đọc của chỉ mục và
+    các listener) thay vì giữ lock: khi bảng chính, alive hay delta đang được một ảnh chụp
+    dùng chung, lần sửa tại chỗ kế tiếp sẽ sao chép phần đó trước (copy-on-write) nên
+    ảnh chụp cũ không bị thay đổi. get/find/contains đọc trạng thái hiện tại dưới lock
+    (dùng cho kiểm tra trước khi ghi).
+    """
+
+    def __init__(self, data=None):
+        self.lock = threading.RLock()
+        self._compactor = None
+        self.listeners = []
+        self._pending_changes = None
+        self.main_version = 0
+        self.version = 0
+        self.committed_version = 0
+        self._snapshot = None
+        self._data_shared = self._alive_shared = self._delta_shared = False
+        self.load(data if data is not None else pd.DataFrame())
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            listener.rebuild(self.frame())
+
+    def _notify(self, old, new):
+        if self._pending_changes is not None:
+            self._pending_changes.append((old, new))
+            return
+        for listener in self.listeners:
+            listener.apply(old, new)
+
+    def _notify_many(self, changes):
+        for listener in self.listeners:
+            if hasattr(listener, 'apply_many'):
+                listener.apply_many(changes)
+            else:
+                for old, new in changes:
+                    listener.apply(old, new)
+
+    def load(self, data, alive=None, delta=None, index=None, notify=True):
+        """
+        Nạp bảng chính; alive/delta dùng khi khôi phục từ snapshot, index là KeyIndex
+        dựng sẵn của bảng (ví dụ bản memory-map dùng chung). notify=False khi bảng mới
+        có cùng nội dung với bảng hiện tại nên không cần dựng lại các listener.
+        """
+        with self._writing():
+            self.data = encode_frame(data.reset_index(drop=True))
+            self.alive = np.ones(len(self.data), dtype=bool) if alive is None else alive
+            self.delta = list(delta) if delta else []
+            self._columns = list(self.data.columns)
+            for row in self.delta:
+                for col in row or ():
+                    if col not in self._columns:
+                        self._columns.append(col)
+            self._changed()
+            self._main_replaced()
+            self._build_index(index)
+            if notify:
+                for listener in self.listeners:
+                    listener.rebuild(self.frame())
+
+    @contextlib.contextmanager
+    def _writing(self):
+        # Thao tác ghi giữ lock; khi xong, committed_version cho snapshot() biết các thay đổi
+        # tới phiên bản này đã hoàn tất (người đọc phải thấy chúng)
+        with self.lock:
+            try:
+                yield
+            finally:
+                self.committed_version = self.version
+
+    def _changed(self):
+        # Dữ liệu vừa đổi: bỏ cache bảng còn hiệu lực, ảnh chụp mới sẽ mang phiên bản mới
+        self._live = None
+        self.version += 1
+
+    def _main_replaced(self):
+        # Bảng chính được thay mới: mọi vị trí đều có thể đã đổi
+        self.main_version += 1
+        snapshot = self._snapshot
+        self._data_shared = snapshot is not None and snapshot.data is self.data
+        self._alive_shared = snapshot is not None and snapshot.alive is self.alive
+        self._delta_shared = snapshot is not None and snapshot.delta is self.delta
+        self.patched = []
+        self._mark_all_dirty()
+
+    def _mark_all_dirty(self):
+        # dirty_chunks = None nghĩa là cần ghi lại toàn bộ bảng chính
+        self.dirty_chunks = None
+        self.dirty_alive = set()
+        self.delta_dirty = True
+
+    def mark_clean(self):
+        self.dirty_chunks = set()
+        self.dirty_alive = set()
+        self.delta_dirty = False
+
+    def take_dirty(self):
+        """
+        Ảnh chụp hiện tại cùng thông tin khối bẩn kể từ lần lưu trước (dirty_chunks,
+        dirty_alive, delta_dirty) khớp với ảnh chụp đó, rồi đánh dấu sạch.
+        Gọi restore_dirty nếu việc lưu thất bại.
+        """
+        with self.lock:
+            dirty = (self.dirty_chunks, self.dirty_alive, self.delta_dirty)
+            snapshot = self.snapshot()
+            self.mark_clean()
+            return snapshot, dirty
+
+    def restore_dirty(self, dirty):
+        # Lưu thất bại: gộp lại thông tin khối bẩn đã lấy bằng take_dirty
+        chunks, alive, delta_dirty = dirty
+        with self.lock:
+            self.dirty_chunks = None if chunks is None or self.dirty_chunks is None else self.dirty_chunks | chunks
+            self.dirty_alive |= alive
+            self.delta_dirty = self.delta_dirty or delta_dirty
+
+    def _build_index(self, index=None):
+        if index is not None:
+            self.index = index
+            return
+        self.index = KeyIndex()
+        if 'SBD' not in self.data.columns or 'Year' not in self.data.columns:
+            return
+        self.index, duplicates = KeyIndex.build(self.data['SBD'].to_numpy(), self.data['Year'].to_numpy(), self.alive)
+        for i, row in enumerate(self.delta):
+            if row is not None and not self.index.add(normalize_key(row.get('SBD')), normalize_key(row.get('Year')),
+                                                      len(self.data) + i):
+                duplicates += 1
+        if duplicates:
+            print(f"Có {duplicates} bản ghi trùng (SBD, Year), chỉ giữ bản ghi đầu tiên trong chỉ mục")
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def _row(self, pos):
+        if pos >= len(self.data):
+            row = self.delta[pos - len(self.data)]
+            return {col: np.nan if row.get(col) is None else row[col] for col in self._columns}
+        return {col: decode_value(col, self.data[col].values[pos]) for col in self.data.columns}
+
+    def memory_per_row(self):
+        """
+        Số byte bộ nhớ trung bình mỗi dòng của bảng chính
+        """
+        return memory_per_row(self.data)
+
+    def contains(self, sbd, year):
+        with self.lock:
+            return (normalize_key(sbd), normalize_key(year)) in self.index
+
+    def get(self, sbd, year):
+        with self.lock:
+            pos = self.index.get((normalize_key(sbd), normalize_key(year)))
+            return None if pos is None else self._row(pos)
+
+    def find(self, sbd):
+        """
+        Tất cả bản ghi của một SBD (mọi năm), theo thứ tự trong bảng
+        """
+        sbd = normalize_key(sbd)
+        with self.lock:
+            return [self._row(pos) for pos in sorted(self.index[(sbd, year)] for year in self.index.years(sbd))]
+
+    def insert(self, row):
+        """
+        Thêm một dòng, trả về dòng đã chuẩn hóa
+        """
+        row = coerce_row(row)
+        with self._writing():
+            self._insert(row)
+            self._maybe_compact()
+            return row
+
+    def delete(self, sbd, year):
+        """
+        Xóa bản ghi (SBD, Year), trả về dữ liệu cũ hoặc None nếu không tồn tại
+        """
+        with self._writing():
+            return self._delete((normalize_key(sbd), normalize_key(year)))
+
+    def update(self, sbd, year, values):
+        """
+        Cập nhật tại chỗ các cột của bản ghi (SBD, Year), trả về dữ liệu cũ
+        """
+        values = coerce_row(values)
+        with self._writing():
+            return self._update((normalize_key(sbd), normalize_key(year)), values)
+
+    def apply_batch(self, operations):
+        """
+        Áp dụng lần lượt nhiều thao tác trong một lần giữ khóa. operations là list
+        (loại, (SBD, Year), dòng đã chuẩn hóa) với loại 'create', 'update' hoặc 'delete'.
+        Trả về kết quả từng thao tác như insert/update/delete, hoặc đối tượng KeyError
+        nếu khóa đã tồn tại. Listener được cập nhật và phần delta được xét gộp
+        một lần ở cuối lô.
+        """
+        results = []
+        with self._writing():
+            self._pending_changes = []
+            try:
+                for kind, key, values in operations:
+                    try:
+                        if kind == 'create':
+                            results.append(self._insert(values))
+                        elif kind == 'update':
+                            results.append(self._update(key, values))
+                        else:
+                            results.append(self._delete(key))
+                    except KeyError as e:
+                        results.append(e)
+            finally:
+                changes, self._pending_changes = self._pending_changes, None
+                if changes:
+                    self._notify_many(changes)
+            self._maybe_compact()
+        return results
+
+    def append_frame(self, frame):
+        """
+        Thêm cả một khối dòng (bảng đã mã hóa theo schema) vào cuối bảng chính.
+        Dòng có (SBD, Year) đã tồn tại hoặc trùng với dòng trước đó trong khối bị bỏ qua;
+        trả về mảng bool đánh dấu các dòng đã được thêm.
+        """
+        with self._writing():
+            # Vị trí dòng delta phụ thuộc len(data) nên gộp delta trước khi nối thêm
+            if self.delta:
+                self.compact()
+            # Lọc trùng vector hóa trên khóa gộp SBD << 16 | Year: sau khi gộp delta,
+            # các khóa đang có chính là khóa của các dòng còn hiệu lực trong bảng chính
+            sbds = frame['SBD'].to_numpy().astype('int64')
+            years = frame['Year'].to_numpy().astype('int64')
+            codes = (sbds << 16) | years
+            added = ~pd.Series(codes).duplicated().to_numpy()
+            if len(self.data) and 'SBD' in self.data.columns:
+                # Chỉ so với các dòng cùng năm (nhập một năm thi mới thì không phải so gì)
+                data_years = self.data['Year'].to_numpy()
+                candidates = self.alive & np.isin(data_years, np.unique(years))
+                if candidates.any():
+                    existing = np.sort((self.data['SBD'].to_numpy()[candidates].astype('int64') << 16)
+                                       | data_years[candidates])
+                    found = np.minimum(np.searchsorted(existing, codes), len(existing) - 1)
+                    added &= existing[found] != codes
+            kept = np.flatnonzero(added)
+            if not len(kept):
+                return added
+
+            start = len(self.data)
+            self.index.extend(sbds[kept], years[kept], start)
+
+            block = frame[added].reset_index(drop=True)
+            for col in self.data.columns:
+                if col not in block.columns:
+                    block[col] = encode_column(col, np.full(len(block), np.nan))
+            for col in block.columns:
+                if col not in self.data.columns:
+                    # assign trả về bảng mới nên ảnh chụp đang dùng bảng chính không bị đổi
+                    self.data = self.data.assign(**{col: encode_column(col, np.full(len(self.data), np.nan))})
+            block = block[list(self.data.columns)]
+            self.data = pd.concat([self.data, block], ignore_index=True) if len(self.data) else block
+            self.alive = np.concatenate([self.alive, np.ones(len(block), dtype=bool)])
+            self._columns = list(self.data.columns)
+            self._changed()
+            self._main_replaced()
+            for listener in self.listeners:
+                if hasattr(listener, 'extend'):
+                    listener.extend(block)
+                else:
+                    for pos in range(start, start + len(block)):
+                        listener.apply(None, self._row(pos))
+            return added
+
+    def _insert(self, row):
+        sbd, year = normalize_key(row.get('SBD')), normalize_key(row.get('Year'))
+        if (sbd, year) in self.index:
+            raise KeyError((sbd, year))
+        pos = len(self.data) + len(self.delta)
+        self._own_delta()
+        self.delta.append(dict(row))
+        self.delta_dirty = True
+        for col in row:
+            if col not in self._columns:
+                self._columns.append(col)
+        self.index.add(sbd, year, pos)
+        self._changed()
+        self._notify(None, self._row(pos))
+        return row
+
+    def _maybe_compact(self):
+        if len(self.delta) >= max(COMPACT_MIN_ROWS, COMPACT_RATIO * len(self.data)):
+            self.compact()
+
+    def _delete(self, key):
+        if key not in self.index:
+            return None
+        pos = self.index.remove(*key)
+        old = self._row(pos)
+        if pos >= len(self.data):
+            self._own_delta()
+            self.delta[pos - len(self.data)] = None
+            self.delta_dirty = True
+        else:
+            if self._alive_shared:
+                self.alive = self.alive.copy()
+                self._alive_shared = False
+            self.alive[pos] = False
+            self.dirty_alive.add(pos // CHUNK_ROWS)
+        self._changed()
+        self._notify(old, None)
+        return old
+
+    def _update(self, key, values):
+        pos = self.index.get(key)
+        if pos is None:
+            return None
+        old = self._row(pos)
+        new_key = (normalize_key(values.get('SBD', key[0])), normalize_key(values.get('Year', key[1])))
+        if new_key != key and new_key in self.index:
+            raise KeyError(new_key)
+        if pos >= len(self.data):
+            # Thay dict của dòng (không sửa tại chỗ) vì ảnh chụp có thể đang giữ nó
+            self._own_delta()
+            self.delta[pos - len(self.data)] = dict(self.delta[pos - len(self.data)], **values)
+            self.delta_dirty = True
+        else:
+            if self._data_shared:
+                # Bảng chính đang nằm trong một ảnh chụp: sao chép trước khi sửa tại chỗ.
+                # assign tạo bảng mới dùng chung dữ liệu; copy-on-write của pandas >= 3
+                # (requirements.txt) chỉ sao chép khối bị sửa ở lần .at bên dưới
+                self.data = self.data.assign()
+                self._data_shared = False
+            for col, value in values.items():
+                if col not in self.data.columns:
+                    if col not in self._columns:
+                        self._columns.append(col)
+                    self.dirty_chunks = None
+                self.data.at[pos, col] = encode_value(col, value)
+                if self.dirty_chunks is not None:
+                    self.dirty_chunks.add((col, pos // CHUNK_ROWS))
+            # Vị trí bảng chính bị sửa tại chỗ (ảnh chụp chỉ đọc phần trước đó của list)
+            self.patched.append(pos)
+        if new_key != key:
+            self.index.remove(*key)
+            self.index.add(new_key[0], new_key[1], pos)
+        self._changed()
+        self._notify(old, self._row(pos))
+        return old
+
+    def _own_delta(self):
+        if self._delta_shared:
+            self.delta = list(self.delta)
+            self._delta_shared = False
+
+    def _delta_frame(self):
+        rows = [row for row in self.delta if row is not None]
+        return encode_frame(pd.DataFrame(rows, columns=self._columns))
+
+    def frame(self):
+        """
+        DataFrame gồm bảng chính và phần delta, chỉ các dòng còn hiệu lực
+        (được cache tới lần ghi kế tiếp)
+        """
+        with self.lock:
+            if self._live is None:
+                main = self.data if self.alive.all() else self.data[self.alive]
+                if any(row is not None for row in self.delta):
+                    main = pd.concat([main, self._delta_frame()], ignore_index=True)
+                self._live = main.reset_index(drop=True) if main is not self.data else main
+            return self._live
+
+    def snapshot(self):
+        """
+        Ảnh chụp (StoreSnapshot) của phiên bản hiện tại, được dùng lại tới lần ghi kế tiếp.
+        Không chờ thao tác ghi đang chạy: khi lock đang bị giữ, trả về ảnh chụp gần nhất nếu
+        nó đã gồm mọi thao tác ghi đã hoàn tất; ngược lại (hoặc chưa có ảnh chụp nào) chờ lock
+        để người đọc luôn thấy các thao tác ghi đã trả về.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == self.version:
+            return snapshot
+        current = snapshot is not None and snapshot.version >= self.committed_version
+        if not self.lock.acquire(blocking=not current):
+            return snapshot
+        try:
+            if self._snapshot is None or self._snapshot.version != self.version:
+                views = {listener: listener.snapshot() for listener in self.listeners if hasattr(listener, 'snapshot')}
+                self._snapshot = StoreSnapshot(self.version, self.data, self.alive, self.delta, list(self._columns),
+                                               self.index.snapshot(), self.main_version, self.patched, views)
+                self._data_shared = self._alive_shared = self._delta_shared = True
+            return self._snapshot
+        finally:
+            self.lock.release()
+
+    def compact(self):
+        """
+        Gộp phần delta vào bảng chính và bỏ các dòng đã xóa
+        """
+        with self.lock:
+            if not self.delta and self.alive.all():
+                return
+            self.data = self.frame()
+            self.alive = np.ones(len(self.data), dtype=bool)
+            self.delta = []
+            self._columns = list(self.data.columns)
+            self._main_replaced()
+            self._build_index()
+
+    def start_compactor(self, interval=60):
+        """
+        Luồng nền gộp phần delta định kỳ
+        """
+        def run():
+            while True:
+                self._stop.wait(interval)
+                if self._stop.is_set():
+                    return
+                if self.delta:
+                    self.compact()
+
+        if self._compactor is None:
+            self._stop = threading.Event()
+            self._compactor = threading.Thread(target=run, daemon=True)
+            self._compactor.start()